@@ -0,0 +1,7 @@
+"""Fleet-scale benchmarks.
+
+``python -m benchmarks.fleet`` (run from ``backend/``) simulates a swarm of
+agents against an in-process backend and reports request latencies,
+queries per request and end-to-end rollout time. See ``benchmarks.fleet``
+for the options.
+"""
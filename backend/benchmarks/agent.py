@@ -0,0 +1,176 @@
+"""Simulated agents for the fleet benchmark.
+
+Each agent is a coroutine that speaks the same HTTP API as
+``client/client.py``, without downloading or installing anything: an
+install is a sleep of ``install_time`` seconds. Thousands of them share one
+event loop and a minimal HTTP/1.1 client on asyncio streams, so the
+benchmark itself stays cheap compared with the server it measures.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+
+def percentile(values, fraction):
+    """The value below which ``fraction`` of the sorted ``values`` fall."""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+class Stats:
+    """Latencies and query counts of the requests made, by endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, endpoint, latency, queries):
+        self.latencies[endpoint].append(latency)
+        if queries is not None:
+            self.queries[endpoint].append(queries)
+
+    def summary(self):
+        summary = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            latencies = sorted(self.latencies[endpoint])
+            queries = sorted(self.queries[endpoint])
+            summary[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors[endpoint],
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 1) if latencies else None,
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                'queries_mean': round(sum(queries) / len(queries), 1) if queries else None,
+                'queries_max': queries[-1] if queries else None,
+            }
+        return summary
+
+
+class HttpClient:
+    """Just enough HTTP/1.1 for JSON requests, one connection per request.
+
+    ``limit`` caps the requests in flight, like a fleet spread over time
+    would; without it thousands of agents would connect at the same moment.
+    """
+
+    def __init__(self, host, port, token, stats, limit):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.stats = stats
+        self.slots = asyncio.Semaphore(limit)
+
+    async def request(self, endpoint, method, path, data=None):
+        """Send a request and return ``(status, body)``; records the timing under ``endpoint``."""
+        body = json.dumps(data).encode() if data is not None else b''
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}:{self.port}\r\n"
+            f"Authorization: Token {self.token}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n"
+        ).encode()
+        async with self.slots:
+            started = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                try:
+                    writer.write(head + body)
+                    await writer.drain()
+                    response = await reader.read()
+                finally:
+                    writer.close()
+            except OSError:
+                self.stats.errors[endpoint] += 1
+                return None, None
+            latency = time.perf_counter() - started
+
+        head, _, payload = response.partition(b'\r\n\r\n')
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+        if status >= 400:
+            self.stats.errors[endpoint] += 1
+            return status, None
+        queries = headers.get('X-Query-Count')
+        self.stats.record(endpoint, latency, int(queries) if queries is not None else None)
+        return status, json.loads(payload) if payload else None
+
+
+class SimulatedAgent:
+    """One agent polling for work and reporting its (simulated) installs.
+
+    ``protocol`` is ``sync`` for the combined sync endpoint the agent uses,
+    or ``legacy`` for separate check-in, work and status PATCH requests.
+    """
+
+    def __init__(self, client_id, http, protocol, poll_interval, install_time):
+        self.client_id = client_id
+        self.http = http
+        self.protocol = protocol
+        self.poll_interval = poll_interval
+        self.install_time = install_time
+        self.active = set()
+        # The event loop only keeps weak references to tasks.
+        self.installs = set()
+        self.outbox = {}
+        self.reported = asyncio.Event()
+        self.completed = 0
+
+    async def run(self):
+        # Spread the first polls so the fleet does not start in lockstep.
+        await asyncio.sleep(random.uniform(0, self.poll_interval))
+        poll = self._poll_sync if self.protocol == 'sync' else self._poll_legacy
+        while True:
+            self.reported.clear()
+            await poll()
+            if not self.outbox:
+                # Like the real agent, sync again as soon as there is something to report.
+                try:
+                    await asyncio.wait_for(self.reported.wait(), self.poll_interval * random.uniform(0.9, 1.1))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _poll_sync(self):
+        updates = list(self.outbox.values())
+        _, body = await self.http.request('sync', 'POST', f'/api/clients/{self.client_id}/sync/',
+                                          {'updates': updates, 'wait': 0})
+        if body is None:
+            return
+        for update in updates:
+            if self.outbox.get(update['id']) is update:
+                del self.outbox[update['id']]
+        for work in body['work']:
+            self._start(work['id'])
+
+    async def _poll_legacy(self):
+        await self.http.request('checkin', 'POST', f'/api/clients/{self.client_id}/checkin/')
+        _, work = await self.http.request('work', 'GET', f'/api/clients/{self.client_id}/work/')
+        for item in work or []:
+            self._start(item['id'])
+
+    def _start(self, status_id):
+        if status_id not in self.active:
+            self.active.add(status_id)
+            task = asyncio.get_running_loop().create_task(self._install(status_id))
+            self.installs.add(task)
+            task.add_done_callback(self.installs.discard)
+
+    async def _report(self, status_id, status, **fields):
+        if self.protocol == 'sync':
+            self.outbox[status_id] = {'id': status_id, 'status': status, **fields}
+            self.reported.set()
+        else:
+            await self.http.request('status_update', 'PATCH', f'/api/deployment-status/{status_id}/',
+                                    {'status': status, **fields})
+
+    async def _install(self, status_id):
+        await self._report(status_id, 'in_progress')
+        await asyncio.sleep(self.install_time)
+        await self._report(status_id, 'completed', log_output='Installation completed successfully\n')
+        self.completed += 1
@@ -0,0 +1,224 @@
+"""Benchmark the backend against a swarm of simulated agents.
+
+Run from ``backend/``::
+
+    python -m benchmarks.fleet --agents 2000 --protocol sync
+    BENCHMARK_DATABASE=postgres python -m benchmarks.fleet --agents 5000
+
+The backend runs in this process on a threaded WSGI server with
+``benchmarks.settings``; the agents (``benchmarks.agent``) share one
+asyncio event loop. After ``--warmup`` seconds of idle polling a
+deployment to every agent is created, and the run ends once all agents
+have reported it completed (or ``--timeout`` passes).
+
+SQLite allows a single writer and concurrent transactions that both want
+to write fail with "database is locked", so on SQLite requests are served
+one at a time. Use PostgreSQL for numbers that size real hardware.
+
+Reported are p50/p99 latency and queries per request for each endpoint
+the agents used, and the rollout time from creating the deployment until
+the last completion was recorded. An agent should see the deployment at
+its next poll, so a rollout far longer than a poll interval plus the
+install time is flagged: new work is reaching the agents late, or the
+server cannot keep up with the fleet. ``--json`` writes the same numbers
+to a file for comparison between runs.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from clients.models import Client  # noqa: E402
+from deployments.models import Deployment  # noqa: E402
+from deployments.serializers import DeploymentSerializer  # noqa: E402
+from packages.models import Package  # noqa: E402
+from .agent import HttpClient, SimulatedAgent, Stats  # noqa: E402
+
+
+# Rollouts slower than this many times the expected time are flagged.
+SLOW_ROLLOUT_FACTOR = 3
+
+
+class ThreadedServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# Held around every request and database access of the harness on SQLite.
+database_lock = threading.Lock() if connection.vendor == 'sqlite' else None
+
+
+def serialized(func):
+    def wrapper(*args, **kwargs):
+        if database_lock is None:
+            return func(*args, **kwargs)
+        with database_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def serialized_application(application):
+    call = serialized(application)
+
+    def wrapper(environ, start_response):
+        # Buffer the body so the lock covers the whole response.
+        return [b''.join(call(environ, start_response))]
+    return wrapper
+
+
+def _enable_wal(sender, connection, **kwargs):
+    # Lets agents read while another request writes.
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def prepare(agents):
+    """Create a fresh fleet and return the agents' client ids and API token."""
+    call_command('migrate', verbosity=0)
+    # Only remove what earlier runs created; the database may be shared.
+    Deployment.objects.filter(package__name__startswith='benchmark-').delete()
+    Package.objects.filter(name__startswith='benchmark-').delete()
+    Client.objects.filter(hostname__startswith='bench-').delete()
+    Client.objects.bulk_create(
+        [
+            Client(hostname=f'bench-{n}', ip_address=f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}',
+                   os_type='linux', os_version='22.04', status='online')
+            for n in range(agents)
+        ],
+        batch_size=1000,
+    )
+    user, _ = User.objects.get_or_create(username='benchmark')
+    token, _ = Token.objects.get_or_create(user=user)
+    client_ids = list(Client.objects.filter(hostname__startswith='bench-').values_list('id', flat=True))
+    return client_ids, token.key
+
+
+@serialized
+def create_rollout():
+    """Deploy a new package to every benchmark client, like POST /api/deployments/ would."""
+    name = f'benchmark-{time.time_ns()}'
+    package = Package.objects.create(name=name, version='1.0', os_compatibility='linux',
+                                     file=f'packages/{name}.deb')
+    serializer = DeploymentSerializer(data={
+        'package': package.id, 'client_filter': {'hostname': 'bench-'}, 'description': 'Fleet benchmark',
+    })
+    serializer.is_valid(raise_exception=True)
+    return serializer.save(created_by=User.objects.get(username='benchmark')).id
+
+
+@serialized
+def completed_count(deployment_id):
+    return Deployment.objects.values_list('completed_count', flat=True).get(id=deployment_id)
+
+
+def expected_rollout_seconds(options):
+    """Time for every agent to poll once (with jitter) and install, ignoring server load."""
+    return options.poll_interval * 1.1 + options.install_time
+
+
+async def benchmark(options, port, client_ids, token):
+    stats = Stats()
+    http = HttpClient('127.0.0.1', port, token, stats, options.concurrency)
+    agents = [
+        SimulatedAgent(client_id, http, options.protocol, options.poll_interval, options.install_time)
+        for client_id in client_ids
+    ]
+    tasks = [asyncio.create_task(agent.run()) for agent in agents]
+    try:
+        await asyncio.sleep(options.warmup)
+        deployment_id = await asyncio.to_thread(create_rollout)
+        started = time.perf_counter()
+        rollout_time = None
+        while time.perf_counter() - started < options.timeout:
+            await asyncio.sleep(0.5)
+            if await asyncio.to_thread(completed_count, deployment_id) == len(agents):
+                rollout_time = time.perf_counter() - started
+                break
+    finally:
+        # Stop the agents and any installs still running.
+        pending = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    return {
+        'agents': len(agents),
+        'protocol': options.protocol,
+        'database': connection.vendor,
+        'rollout_seconds': round(rollout_time, 2) if rollout_time is not None else None,
+        'expected_rollout_seconds': round(expected_rollout_seconds(options), 2),
+        'completed': await asyncio.to_thread(completed_count, deployment_id),
+        'endpoints': stats.summary(),
+    }
+
+
+def report(result):
+    print(f"{result['agents']} agents, {result['protocol']} protocol, {result['database']} database")
+    if result['rollout_seconds'] is None:
+        print(f"Rollout timed out with {result['completed']} of {result['agents']} completed")
+    else:
+        print(f"Rollout completed in {result['rollout_seconds']}s")
+        expected = result['expected_rollout_seconds']
+        if result['rollout_seconds'] > SLOW_ROLLOUT_FACTOR * expected:
+            print(f"WARNING: expected about {expected}s for one poll and the install; "
+                  "agents got the work late or the server could not keep up")
+    print(f"{'endpoint':<15}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}{'max':>6}")
+    for endpoint, row in result['endpoints'].items():
+        print(f"{endpoint:<15}{row['requests']:>10}{row['errors']:>8}{row['p50_ms'] or '-':>10}"
+              f"{row['p99_ms'] or '-':>10}{row['queries_mean'] or '-':>9}{row['queries_max'] or '-':>6}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--protocol', choices=['sync', 'legacy'], default='sync')
+    parser.add_argument('--poll-interval', type=float, default=5,
+                        help="Seconds between an idle agent's polls")
+    parser.add_argument('--install-time', type=float, default=1, help="Seconds a simulated install takes")
+    parser.add_argument('--concurrency', type=int, default=100, help="Most requests in flight at once")
+    parser.add_argument('--warmup', type=float, default=10, help="Seconds of idle polling before the rollout")
+    parser.add_argument('--timeout', type=float, default=600, help="Longest rollout to wait for")
+    parser.add_argument('--json', help="Also write the results to this file")
+    options = parser.parse_args(argv)
+
+    connection_created.connect(_enable_wal)
+    client_ids, token = prepare(options.agents)
+    server = make_server('127.0.0.1', 0, serialized_application(get_wsgi_application()),
+                         server_class=ThreadedServer, handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        result = asyncio.run(benchmark(options, server.server_port, client_ids, token))
+    finally:
+        server.shutdown()
+
+    report(result)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0 if result['rollout_seconds'] is not None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
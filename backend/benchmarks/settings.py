@@ -0,0 +1,40 @@
+"""Settings for the fleet benchmark.
+
+SQLite in a file by default; set ``BENCHMARK_DATABASE=postgres`` to use the
+PostgreSQL database configured for the project. The cache is in-process
+unless ``BENCHMARK_USE_REDIS=True``; heartbeats and pub/sub use Redis when
+it is reachable and fall back to the database otherwise. Celery tasks run
+eagerly.
+"""
+import os
+import tempfile
+from deployment_backend.settings import *  # noqa: F401,F403
+from deployment_backend.settings import MIDDLEWARE
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+if os.getenv('BENCHMARK_DATABASE', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('BENCHMARK_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'fleet-benchmark.sqlite3')),
+            # Agents write concurrently; wait for the lock instead of failing.
+            'OPTIONS': {'timeout': 60},
+        }
+    }
+
+if os.getenv('BENCHMARK_USE_REDIS', 'False') != 'True':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+CELERY_TASK_ALWAYS_EAGER = True
+
+MIDDLEWARE = ['benchmarks.middleware.QueryCountMiddleware'] + MIDDLEWARE
+
+# Fallback warnings (e.g. Redis unavailable) would be logged on every request.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'root': {'handlers': ['console'], 'level': 'ERROR'},
+}
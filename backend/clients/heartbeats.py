@@ -0,0 +1,112 @@
+"""Buffer client heartbeats in Redis and flush them to the database in bulk.
+
+Check-ins only record the latest status, time and address per client in
+a Redis hash. ``clients.tasks.flush_heartbeats`` periodically drains the
+hash and writes every buffered client with a single ``bulk_update`` of the
+``status``, ``last_seen`` and ``ip_address`` columns. If Redis is
+unavailable the heartbeat is written straight to the database instead.
+
+Addresses are taken from the connection (``request_address``) rather than
+reported by agents, which often only know a loopback address for their
+own hostname.
+
+Each check-in is answered with when the agent should check in next
+(``poll_advice``): sooner while it has deployments to work on, later while
+the heartbeat buffer is backed up.
+"""
+import json
+import logging
+import redis
+from datetime import datetime
+from deployment_backend.redis_client import get_connection
+from deployments.models import DeploymentStatus
+from django.conf import settings
+from django.utils import timezone
+from .models import Client
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_KEY = 'client-heartbeats'
+
+
+def request_address(request):
+    """The address a request came from.
+
+    ``X-Forwarded-For`` is only followed through the proxies listed in
+    ``TRUSTED_PROXY_IPS``: the client address is the last hop that is not
+    one of them.
+    """
+    address = request.META.get('REMOTE_ADDR')
+    trusted = settings.TRUSTED_PROXY_IPS
+    if address in trusted:
+        forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')]
+        for hop in reversed(forwarded):
+            if hop and hop not in trusted:
+                return hop
+    return address
+
+
+def record_heartbeat(client_id, status='online', ip_address=None):
+    """Buffer a heartbeat for ``client_id`` with the given status and address.
+
+    Returns the number of heartbeats waiting to be flushed, or None if
+    Redis was unavailable and the heartbeat was written directly.
+    """
+    now = timezone.now()
+    heartbeat = {'status': status, 'last_seen': now}
+    if ip_address:
+        heartbeat['ip_address'] = ip_address
+    try:
+        pipe = get_connection().pipeline()
+        pipe.hset(HEARTBEAT_KEY, client_id, json.dumps({**heartbeat, 'last_seen': now.isoformat()}))
+        pipe.hlen(HEARTBEAT_KEY)
+        _, backlog = pipe.execute()
+        return backlog
+    except redis.RedisError as e:
+        logger.warning("Heartbeat buffer unavailable, writing client %s directly: %s", client_id, e)
+        Client.objects.filter(pk=client_id).update(**heartbeat)
+        return None
+
+
+def poll_advice(client_id, backlog):
+    """Seconds until the client should check in again and retry after errors.
+
+    Clients with pending or running deployments are asked to come back
+    after ``CLIENT_POLL_INTERVAL_ACTIVE``, others after
+    ``CLIENT_POLL_INTERVAL``. Both stretch with the heartbeat backlog (or
+    double while heartbeats bypass Redis), so the fleet slows down when the
+    server falls behind.
+    """
+    active = DeploymentStatus.objects.filter(
+        client_id=client_id, status__in=['pending', 'in_progress']
+    ).exists()
+    interval = settings.CLIENT_POLL_INTERVAL_ACTIVE if active else settings.CLIENT_POLL_INTERVAL
+    load = 2 if backlog is None else 1 + backlog / settings.CLIENT_HEARTBEAT_BACKLOG
+    return {
+        'poll_interval': min(round(interval * load), settings.CLIENT_OFFLINE_AFTER // 2),
+        'retry_after': round(settings.CLIENT_RETRY_AFTER * load),
+    }
+
+
+def drain_heartbeats():
+    """Atomically take every buffered heartbeat out of Redis.
+
+    Returns a list of unsaved ``Client`` instances carrying only the primary
+    key, ``status``, ``last_seen`` and, if the heartbeat had one,
+    ``ip_address``.
+    """
+    pipe = get_connection().pipeline()
+    pipe.hgetall(HEARTBEAT_KEY)
+    pipe.delete(HEARTBEAT_KEY)
+    entries, _ = pipe.execute()
+
+    clients = []
+    for client_id, value in entries.items():
+        heartbeat = json.loads(value)
+        clients.append(Client(
+            pk=int(client_id),
+            status=heartbeat['status'],
+            last_seen=datetime.fromisoformat(heartbeat['last_seen']),
+            ip_address=heartbeat.get('ip_address'),
+        ))
+    return clients
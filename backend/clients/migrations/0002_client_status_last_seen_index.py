@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['status', 'last_seen'], name='client_status_last_seen'),
+        ),
+    ]
@@ -25,6 +25,9 @@ class Client(models.Model):
 
     class Meta:
         ordering = ['-last_seen']
+        indexes = [
+            models.Index(fields=['status', 'last_seen'], name='client_status_last_seen'),
+        ]
 
     def __str__(self):
         return f"{self.hostname} ({self.ip_address})"
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from deployments.serializers import StatusReportSerializer
 from .models import Client
 
 class ClientSerializer(serializers.ModelSerializer):
@@ -6,4 +7,11 @@ class ClientSerializer(serializers.ModelSerializer):
         model = Client
         fields = ['id', 'hostname', 'ip_address', 'os_type', 'os_version', 
                  'status', 'last_seen', 'registration_date']
-        read_only_fields = ['id', 'registration_date'] 
\ No newline at end of file
+        # The address is the one requests come from, not what the agent reports.
+        read_only_fields = ['id', 'ip_address', 'registration_date']
+
+class SyncSerializer(serializers.Serializer):
+    """An agent's sync request: heartbeat, status reports and how long to wait for work."""
+    status = serializers.ChoiceField(choices=Client.STATUS_CHOICES, default='online')
+    updates = StatusReportSerializer(many=True, required=False, default=list)
+    wait = serializers.FloatField(min_value=0, required=False, default=0)
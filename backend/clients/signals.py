@@ -0,0 +1,23 @@
+"""Cache invalidation for the client listing."""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from deployment_backend.caching import invalidate, invalidate_work
+from .models import Client
+
+
+@receiver([post_save, post_delete], sender=Client)
+def invalidate_clients(sender, **kwargs):
+    invalidate('clients')
+
+
+@receiver(post_save, sender=Client)
+def invalidate_new_client_work(sender, instance, created, **kwargs):
+    # Heartbeat endpoints cache that an unknown id has no client.
+    if created:
+        invalidate_work([instance.id])
+
+
+@receiver(post_delete, sender=Client)
+def invalidate_client_work(sender, instance, **kwargs):
+    # The client's statuses are deleted with it without signals of their own.
+    invalidate_work([instance.id])
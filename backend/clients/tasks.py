@@ -0,0 +1,49 @@
+from datetime import timedelta
+import redis
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.utils import timezone
+from deployment_backend.caching import invalidate
+from .heartbeats import drain_heartbeats
+from .models import Client
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def flush_heartbeats():
+    """Write buffered client heartbeats to the database in bulk."""
+    clients = drain_heartbeats()
+    if clients:
+        with_address = [client for client in clients if client.ip_address]
+        without_address = [client for client in clients if not client.ip_address]
+        for group, fields in ((with_address, ['status', 'last_seen', 'ip_address']),
+                              (without_address, ['status', 'last_seen'])):
+            if group:
+                Client.objects.bulk_update(group, fields, batch_size=settings.CLIENT_HEARTBEAT_FLUSH_BATCH_SIZE)
+        # bulk_update sends no signals.
+        invalidate('clients')
+        logger.info("Flushed %d client heartbeats", len(clients))
+    return len(clients)
+
+
+@shared_task
+def mark_offline_clients():
+    """Mark clients offline that have not checked in within the threshold.
+
+    Buffered heartbeats are flushed first so that clients which checked in
+    since the last flush are not swept. The sweep itself is a single UPDATE
+    served by the (status, last_seen) index.
+    """
+    try:
+        flush_heartbeats()
+    except redis.RedisError as e:
+        # Heartbeats are written directly while Redis is down.
+        logger.warning("Could not flush heartbeats before the offline sweep: %s", e)
+    cutoff = timezone.now() - timedelta(seconds=settings.CLIENT_OFFLINE_AFTER)
+    swept = Client.objects.filter(status='online', last_seen__lt=cutoff).update(status='offline')
+    if swept:
+        invalidate('clients')
+        logger.info("Marked %d clients offline", swept)
+    return swept
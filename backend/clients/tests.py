@@ -1,3 +1,463 @@
-from django.test import TestCase
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+import redis
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from deployment_backend.testing import (
+    LOCAL_CACHE, NO_CACHE, FakeRedis, QueryCountMixin, assign_deployment, make_client, make_deployment,
+    make_package, redis_available,
+)
+from deployments.models import Deployment, DeploymentLogChunk, DeploymentStatus
+from deployments.tasks import advance_rollout, check_scheduled_deployments
+from deployments.notifications import WorkSubscription, notify_clients
+from .heartbeats import HEARTBEAT_KEY, poll_advice, record_heartbeat, request_address
+from .models import Client
+from .tasks import flush_heartbeats, mark_offline_clients
 
-# Create your tests here.
+
+class ClientQueryCountTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.agent = make_client()
+
+    def test_list(self):
+        self.assertQueryBudget(lambda: self.client.get('/api/clients/'), make_client, budget=2)
+
+    def test_work(self):
+        self.assertQueryBudget(
+            lambda: self.client.get(f'/api/clients/{self.agent.id}/work/'),
+            lambda: assign_deployment(self.user, self.agent), budget=3,
+        )
+
+    def test_prestage(self):
+        soon = timezone.now() + timedelta(seconds=60)
+        self.assertQueryBudget(
+            lambda: self.client.get(f'/api/clients/{self.agent.id}/prestage/'),
+            lambda: assign_deployment(self.user, self.agent, scheduled_for=soon), budget=3,
+        )
+
+    def test_sync(self):
+        # Reports for one deployment are a single transition however many
+        # deployments are waiting as work.
+        reported = assign_deployment(self.user, self.agent)
+        self.assertQueryBudget(
+            lambda: self.client.post(
+                f'/api/clients/{self.agent.id}/sync/',
+                {'updates': [{'id': reported.id, 'status': 'completed', 'log_output': 'done\n'}]},
+                format='json',
+            ),
+            lambda: assign_deployment(self.user, self.agent), budget=12,
+        )
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class WorkCacheTests(APITestCase):
+    def setUp(self):
+        # Client ids are reused between tests, so their cached work lists would be too.
+        cache.clear()
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.agent = make_client()
+
+    def get_work(self):
+        return [work['id'] for work in self.client.get(f'/api/clients/{self.agent.id}/work/').data]
+
+    def test_claimed_work_is_not_served_from_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            status = assign_deployment(self.user, self.agent)
+        self.assertEqual(self.get_work(), [status.id])
+        # Only the client itself is looked up.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_work(), [status.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/clients/{self.agent.id}/sync/',
+                             {'updates': [{'id': status.id, 'status': 'in_progress'}]}, format='json')
+        self.assertEqual(self.get_work(), [])
+
+    def test_other_clients_work_keeps_the_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            status = assign_deployment(self.user, self.agent)
+        self.get_work()
+        with self.captureOnCommitCallbacks(execute=True):
+            other = assign_deployment(self.user, make_client())
+            DeploymentStatus.objects.filter(id=other.id).transition(other.deployment_id, 'pending', 'in_progress')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_work(), [status.id])
+
+    def test_deleted_deployments_leave_the_work_list(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            kept = assign_deployment(self.user, self.agent)
+            deleted = assign_deployment(self.user, self.agent)
+        self.assertEqual(self.get_work(), [kept.id, deleted.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            deleted.deployment.delete()
+        self.assertEqual(self.get_work(), [kept.id])
+
+    def staged(self, current_wave, **fields):
+        """A two-wave rollout with a failed client in wave 1 and this agent in ``wave``."""
+        with self.captureOnCommitCallbacks(execute=True):
+            deployment = make_deployment(self.user, clients=0, rollout_waves=[50, 100], failure_threshold=0,
+                                         current_wave=current_wave, **fields)
+            DeploymentStatus.objects.create(deployment=deployment, client=make_client(), wave=1, status='failed')
+        return deployment
+
+    def test_halting_withdraws_released_work(self):
+        deployment = self.staged(1, rollout_status='running')
+        with self.captureOnCommitCallbacks(execute=True):
+            status = DeploymentStatus.objects.create(deployment=deployment, client=self.agent, wave=1)
+        # Offline agents keep their released work and do not hold up the wave.
+        Client.objects.filter(id=self.agent.id).update(status='offline')
+        self.assertEqual(self.get_work(), [status.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            advance_rollout(deployment, 1)
+        self.assertEqual(self.get_work(), [])
+
+    def sync_work(self):
+        response = self.client.post(f'/api/clients/{self.agent.id}/sync/', {}, format='json')
+        return [work['id'] for work in response.data['work']]
+
+    def create_deployment(self, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/deployments/', {
+                'package': make_package().id, 'clients': [self.agent.id], **data,
+            }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return DeploymentStatus.objects.get(deployment_id=response.data['id'])
+
+    def heartbeat(self, client_id, endpoint):
+        return self.client.post(f'/api/clients/{client_id}/{endpoint}/', {}, format='json').status_code
+
+    def test_deleted_clients_are_not_found(self):
+        client_id = self.agent.id
+        self.assertEqual(self.heartbeat(client_id, 'sync'), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.agent.delete()
+        self.assertEqual(self.heartbeat(client_id, 'sync'), 404)
+        self.assertEqual(self.heartbeat(client_id, 'checkin'), 404)
+        self.assertFalse(Client.objects.filter(id=client_id).exists())
+
+    def test_registered_clients_are_found(self):
+        client_id = self.agent.id + 1
+        self.assertEqual(self.heartbeat(client_id, 'checkin'), 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_client(id=client_id)
+        self.assertEqual(self.heartbeat(client_id, 'checkin'), 200)
+
+    @mock.patch('deployments.views.process_deployment')
+    def test_new_deployments_reach_cached_work_lists(self, process):
+        self.assertEqual(self.sync_work(), [])
+        status = self.create_deployment()
+        self.assertEqual(self.sync_work(), [status.id])
+
+    @override_settings(DEPLOYMENT_FANOUT_ENABLED=False)
+    @mock.patch('deployments.tasks.process_deployment_batch')
+    def test_due_scheduled_deployments_reach_cached_work_lists(self, batch):
+        status = self.create_deployment(scheduled_for=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.sync_work(), [])
+        Deployment.objects.filter(id=status.deployment_id).update(scheduled_for=timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            check_scheduled_deployments()
+        batch.assert_called_once_with(status.deployment_id, [status.id])
+        self.assertEqual(self.sync_work(), [status.id])
+
+    @mock.patch('deployments.views.process_deployment')
+    def test_resuming_releases_work(self, process):
+        deployment = self.staged(1, rollout_status='halted')
+        with self.captureOnCommitCallbacks(execute=True):
+            status = DeploymentStatus.objects.create(deployment=deployment, client=self.agent, wave=2)
+        self.assertEqual(self.get_work(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/deployments/{deployment.id}/resume/')
+        self.assertEqual(self.get_work(), [status.id])
+
+
+@override_settings(CACHES=NO_CACHE)
+class WorkLongPollTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.agent = make_client()
+
+    def get_work(self, wait):
+        started = time.monotonic()
+        response = self.client.get(f'/api/clients/{self.agent.id}/work/', {'wait': wait})
+        return response, time.monotonic() - started
+
+    def test_existing_work_is_returned_without_waiting(self):
+        status = assign_deployment(self.user, self.agent)
+        response, elapsed = self.get_work(10)
+        self.assertEqual([work['id'] for work in response.data], [status.id])
+        self.assertLess(elapsed, 5)
+
+    @override_settings(CLIENT_WORK_MAX_WAIT=0.2)
+    def test_wait_is_capped(self):
+        response, elapsed = self.get_work(60)
+        self.assertEqual(response.data, [])
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 5)
+
+    def test_invalid_wait(self):
+        response, _ = self.get_work('soon')
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(redis_available(), "needs Redis")
+    def test_notification_wakes_subscriber(self):
+        with WorkSubscription(self.agent.id) as subscription:
+            threading.Timer(0.1, notify_clients, [[self.agent.id]]).start()
+            started = time.monotonic()
+            self.assertTrue(subscription.wait(10))
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class HeartbeatBufferTests(APITestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('clients.heartbeats.get_connection', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.agents = [make_client(status='offline', last_seen=timezone.now() - timedelta(hours=1))
+                       for _ in range(3)]
+
+    def test_heartbeats_are_buffered_until_flushed(self):
+        self.assertEqual(record_heartbeat(self.agents[0].id), 1)
+        self.assertEqual(record_heartbeat(self.agents[1].id, 'error'), 2)
+        # A repeated heartbeat replaces the buffered one.
+        self.assertEqual(record_heartbeat(self.agents[0].id), 2)
+        self.assertEqual(Client.objects.filter(status='offline').count(), 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_heartbeats(), 2)
+        statuses = dict(Client.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[agent.id] for agent in self.agents], ['online', 'error', 'offline'])
+        self.agents[0].refresh_from_db()
+        self.assertGreater(self.agents[0].last_seen, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.redis.hlen(HEARTBEAT_KEY), 0)
+
+    def test_heartbeats_of_deleted_clients_are_dropped(self):
+        record_heartbeat(self.agents[0].id)
+        self.agents[0].delete()
+        self.assertEqual(flush_heartbeats(), 1)
+        self.assertFalse(Client.objects.filter(id=self.agents[0].id).exists())
+
+    def test_written_directly_without_redis(self):
+        with mock.patch('clients.heartbeats.get_connection', side_effect=redis.ConnectionError):
+            self.assertIsNone(record_heartbeat(self.agents[0].id))
+        self.agents[0].refresh_from_db()
+        self.assertEqual(self.agents[0].status, 'online')
+
+    def test_checkin_returns_poll_advice(self):
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+        response = self.client.post(f'/api/clients/{self.agents[0].id}/checkin/')
+        self.assertEqual(response.data['status'], 'success')
+        self.assertIn('poll_interval', response.data)
+        self.assertEqual(self.redis.hlen(HEARTBEAT_KEY), 1)
+
+
+@override_settings(CLIENT_POLL_INTERVAL=60, CLIENT_POLL_INTERVAL_ACTIVE=15, CLIENT_RETRY_AFTER=30,
+                   CLIENT_HEARTBEAT_BACKLOG=1000, CLIENT_OFFLINE_AFTER=300)
+class PollAdviceTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.agent = make_client()
+
+    def test_idle_and_active_intervals(self):
+        self.assertEqual(poll_advice(self.agent.id, 0), {'poll_interval': 60, 'retry_after': 30})
+        assign_deployment(self.user, self.agent)
+        self.assertEqual(poll_advice(self.agent.id, 0), {'poll_interval': 15, 'retry_after': 30})
+
+    def test_intervals_stretch_with_the_backlog(self):
+        self.assertEqual(poll_advice(self.agent.id, 1000), {'poll_interval': 120, 'retry_after': 60})
+        # Without Redis the server is assumed to be under load.
+        self.assertEqual(poll_advice(self.agent.id, None), {'poll_interval': 120, 'retry_after': 60})
+        # Agents are never told to stay away long enough to be swept offline.
+        self.assertEqual(poll_advice(self.agent.id, 10000)['poll_interval'], 150)
+
+
+@override_settings(CLIENT_OFFLINE_AFTER=300)
+class OfflineSweepTests(APITestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('clients.heartbeats.get_connection', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stale_clients_are_marked_offline(self):
+        stale = timezone.now() - timedelta(seconds=600)
+        gone = make_client(last_seen=stale)
+        fresh = make_client()
+        failing = make_client(status='error', last_seen=stale)
+        self.assertEqual(mark_offline_clients(), 1)
+        statuses = dict(Client.objects.values_list('id', 'status'))
+        self.assertEqual([statuses[gone.id], statuses[fresh.id], statuses[failing.id]],
+                         ['offline', 'online', 'error'])
+
+    def test_buffered_heartbeats_are_flushed_first(self):
+        agent = make_client(last_seen=timezone.now() - timedelta(seconds=600))
+        record_heartbeat(agent.id)
+        self.assertEqual(mark_offline_clients(), 0)
+        agent.refresh_from_db()
+        self.assertEqual(agent.status, 'online')
+
+
+@override_settings(CACHES=NO_CACHE)
+class ClientListTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+
+    def test_pages_are_stable_while_heartbeats_arrive(self):
+        agents = [make_client() for _ in range(5)]
+        seen = []
+        url = '/api/clients/?page_size=2'
+        while url:
+            page = self.client.get(url).data
+            seen += [client['id'] for client in page['results']]
+            # Heartbeat flushes rewrite last_seen between page reads.
+            Client.objects.update(last_seen=timezone.now())
+            url = page['next']
+        self.assertEqual(sorted(seen), sorted(agent.id for agent in agents))
+
+    def test_summary(self):
+        make_client()
+        make_client()
+        make_client(status='offline')
+        self.assertEqual(self.client.get('/api/clients/summary/').data,
+                         {'online': 2, 'offline': 1, 'error': 0, 'total': 3})
+
+
+@override_settings(CACHES=NO_CACHE, TRUSTED_PROXY_IPS=['10.9.0.1'])
+class ClientAddressTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+        self.redis = FakeRedis()
+        patcher = mock.patch('clients.heartbeats.get_connection', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def address(self, remote, forwarded=None):
+        request = mock.Mock(META={'REMOTE_ADDR': remote})
+        if forwarded is not None:
+            request.META['HTTP_X_FORWARDED_FOR'] = forwarded
+        return request_address(request)
+
+    def test_forwarded_for_is_only_trusted_from_proxies(self):
+        self.assertEqual(self.address('192.168.1.5'), '192.168.1.5')
+        self.assertEqual(self.address('192.168.1.5', '1.2.3.4'), '192.168.1.5')
+        self.assertEqual(self.address('10.9.0.1', '1.2.3.4, 192.168.1.7'), '192.168.1.7')
+        self.assertEqual(self.address('10.9.0.1', '192.168.1.7, 10.9.0.1'), '192.168.1.7')
+        self.assertEqual(self.address('10.9.0.1'), '10.9.0.1')
+
+    def test_registration_records_the_request_address(self):
+        response = self.client.post('/api/clients/', {
+            'hostname': 'agent', 'ip_address': '127.0.1.1', 'os_type': 'linux', 'os_version': '22.04',
+        }, format='json', REMOTE_ADDR='192.168.1.5')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Client.objects.get().ip_address, '192.168.1.5')
+
+    def test_checkin_and_sync_refresh_the_address(self):
+        agent = make_client(ip_address='192.168.1.5')
+        self.client.post(f'/api/clients/{agent.id}/checkin/', REMOTE_ADDR='192.168.2.9')
+        flush_heartbeats()
+        agent.refresh_from_db()
+        self.assertEqual(agent.ip_address, '192.168.2.9')
+
+        self.client.post(f'/api/clients/{agent.id}/sync/', {}, format='json', REMOTE_ADDR='10.9.0.1',
+                         HTTP_X_FORWARDED_FOR='192.168.3.1')
+        with mock.patch('clients.heartbeats.get_connection', side_effect=redis.ConnectionError):
+            # Written directly while the buffer is down.
+            self.client.post(f'/api/clients/{agent.id}/checkin/', REMOTE_ADDR='192.168.4.1')
+        agent.refresh_from_db()
+        self.assertEqual(agent.ip_address, '192.168.4.1')
+        flush_heartbeats()
+        agent.refresh_from_db()
+        self.assertEqual(agent.ip_address, '192.168.3.1')
+
+
+@override_settings(CACHES=NO_CACHE, DEPLOYMENT_PRESTAGE_WINDOW=3600)
+class PrestageTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.agent = make_client()
+
+    def schedule(self, seconds, **fields):
+        return assign_deployment(self.user, self.agent,
+                                 scheduled_for=timezone.now() + timedelta(seconds=seconds), **fields)
+
+    def prestage(self, agent=None):
+        agent = agent or self.agent
+        return [item['id'] for item in self.client.get(f'/api/clients/{agent.id}/prestage/').data]
+
+    def test_deployments_due_within_half_the_window(self):
+        # Every client's offset falls in the first half of the window.
+        later = self.schedule(1700)
+        sooner = self.schedule(60)
+        self.schedule(4000)
+        self.schedule(60, rollout_status='halted')
+        self.schedule(-60)
+        self.assertEqual(self.prestage(), [sooner.id, later.id])
+
+    def test_downloads_are_spread_over_the_window(self):
+        agents = [self.agent] + [make_client() for _ in range(19)]
+        for agent in agents:
+            assign_deployment(self.user, agent, scheduled_for=timezone.now() + timedelta(seconds=3000))
+        # 600 seconds into the window only the clients with the earliest offsets start.
+        started = sum(bool(self.prestage(agent)) for agent in agents)
+        self.assertGreater(started, 0)
+        self.assertLess(started, len(agents))
+
+
+@override_settings(CACHES=NO_CACHE)
+class SyncTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.agent = make_client()
+
+    def sync(self, *updates, agent=None):
+        agent = agent or self.agent
+        response = self.client.post(f'/api/clients/{agent.id}/sync/', {'updates': list(updates)}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_reports_are_applied_before_work_is_listed(self):
+        claimed = assign_deployment(self.user, self.agent)
+        waiting = assign_deployment(self.user, self.agent)
+        data = self.sync({'id': claimed.id, 'status': 'in_progress'})
+        self.assertEqual(data['applied'], 1)
+        self.assertEqual([item['id'] for item in data['work']], [waiting.id])
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, 'in_progress')
+        self.assertIsNotNone(claimed.started_at)
+
+    def test_resent_reports_change_nothing(self):
+        status = assign_deployment(self.user, self.agent)
+        report = {'id': status.id, 'status': 'failed', 'error_message': 'boom', 'log_output': 'output\n'}
+        self.assertEqual(self.sync(report)['applied'], 1)
+        # The agent never saw the response and sends the report again.
+        self.assertEqual(self.sync(report)['applied'], 0)
+        self.assertEqual(list(DeploymentLogChunk.objects.values_list('content', flat=True)), ['output\n'])
+        status.deployment.refresh_from_db()
+        self.assertEqual(status.deployment.status_counts['failed'], 1)
+        self.assertEqual(status.deployment.status_counts['total'], 1)
+
+    def test_reports_that_do_not_fit_are_ignored(self):
+        cancelled = assign_deployment(self.user, self.agent)
+        DeploymentStatus.objects.filter(id=cancelled.id).transition(cancelled.deployment_id, 'pending', 'cancelled')
+        others = assign_deployment(self.user, make_client())
+        data = self.sync({'id': cancelled.id, 'status': 'completed', 'log_output': 'late'},
+                         {'id': others.id, 'status': 'completed'})
+        self.assertEqual(data['applied'], 0)
+        self.assertEqual(set(DeploymentStatus.objects.values_list('status', flat=True)), {'cancelled', 'pending'})
+        self.assertFalse(DeploymentLogChunk.objects.exists())
+
+    def test_invalid_report(self):
+        response = self.client.post(f'/api/clients/{self.agent.id}/sync/',
+                                    {'updates': [{'id': 1, 'status': 'cancelled'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
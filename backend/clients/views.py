@@ -1,11 +1,22 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404
 from django.shortcuts import render
+from django.utils import timezone
 from rest_framework import viewsets, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.utils import timezone
 from rest_framework.permissions import IsAuthenticated
+from deployment_backend.caching import cached, conditional_response, work_namespace
+from deployments.models import DeploymentStatus
+from deployments.notifications import WorkSubscription
+from deployments.serializers import PendingWorkSerializer, PrestageWorkSerializer
+from packages.models import PackageBlob, PackagePeer
+from packages.serializers import PeerChunksSerializer
+from .heartbeats import poll_advice, record_heartbeat, request_address
 from .models import Client
-from .serializers import ClientSerializer
+from .serializers import ClientSerializer, SyncSerializer
 
 class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.all()
@@ -13,24 +24,163 @@ class ClientViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['hostname', 'ip_address', 'os_type', 'status']
-    ordering_fields = ['hostname', 'last_seen', 'status']
-    ordering = ['-last_seen']
+    # Pagination cursors need a unique ordering that heartbeats do not
+    # rewrite; last_seen and status change every few seconds.
+    ordering_fields = ['id', 'hostname', 'registration_date']
+    ordering = ['-id']
+
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return conditional_response(request, 'clients', lambda: build(request, *args, **kwargs).data)
+
+    def perform_create(self, serializer):
+        serializer.save(ip_address=request_address(self.request))
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Number of clients in each status, cached until clients change."""
+        def build():
+            counts = dict(Client.objects.order_by().values_list('status').annotate(total=Count('id')))
+            summary = {status: counts.get(status, 0) for status, _ in Client.STATUS_CHOICES}
+            summary['total'] = sum(summary.values())
+            return summary
+
+        return Response(cached('clients', 'summary', build))
+
+    def _heartbeat_client_id(self):
+        # Heartbeats are buffered without loading the client row. Whether it
+        # exists is cached with the client's work list, which is dropped when
+        # the client is created or deleted; ids of clients deleted while
+        # their heartbeat waits in the buffer are dropped when it is flushed.
+        try:
+            client_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise Http404
+        if not cached(work_namespace(client_id), 'exists', Client.objects.filter(pk=client_id).exists):
+            raise Http404
+        return client_id
 
     @action(detail=True, methods=['post'])
     def checkin(self, request, pk=None):
-        client = self.get_object()
-        client.status = 'online'
-        client.last_seen = timezone.now()
-        client.save()
-        return Response({'status': 'success'})
+        """Record a heartbeat and tell the agent when to check in next."""
+        client_id = self._heartbeat_client_id()
+        backlog = record_heartbeat(client_id, 'online', request_address(request))
+        return Response({'status': 'success', **poll_advice(client_id, backlog)})
 
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
-        client = self.get_object()
         status = request.data.get('status')
         if status in [s[0] for s in Client.STATUS_CHOICES]:
-            client.status = status
-            client.last_seen = timezone.now()
-            client.save()
+            record_heartbeat(self._heartbeat_client_id(), status)
             return Response({'status': 'success'})
-        return Response({'status': 'error', 'message': 'Invalid status'}, status=400)
\ No newline at end of file
+        return Response({'status': 'error', 'message': 'Invalid status'}, status=400)
+
+    @action(detail=True, methods=['get'])
+    def work(self, request, pk=None):
+        """Pending deployments for this client.
+
+        With ``?wait=<seconds>`` the request is held open until new work is
+        published for the client or the wait (capped at
+        ``CLIENT_WORK_MAX_WAIT``) expires, so idle clients can long-poll
+        instead of polling on a short interval.
+        """
+        client_id = self.get_object().id
+        try:
+            wait = max(float(request.query_params.get('wait', 0)), 0)
+        except ValueError:
+            return Response({'status': 'error', 'message': 'Invalid wait'}, status=400)
+        return Response(self._wait_for_work(client_id, wait))
+
+    @action(detail=True, methods=['post'])
+    def sync(self, request, pk=None):
+        """Heartbeat, status reports and work fetch in a single round trip.
+
+        The body carries the agent's ``status``, a batch of status
+        ``updates`` (see ``StatusReportSerializer``) and an optional
+        ``wait`` for long-polling. Reports are applied before pending work
+        is looked up, so a deployment the agent just claimed is not handed
+        out again. The response includes the check-in advice and ``work``.
+        """
+        client_id = self._heartbeat_client_id()
+        serializer = SyncSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        backlog = record_heartbeat(client_id, data['status'], request_address(request))
+        applied = DeploymentStatus.objects.filter(client_id=client_id).apply_reports(data['updates'])
+        work = self._wait_for_work(client_id, data['wait'])
+        return Response({
+            'status': 'success',
+            'applied': applied,
+            **poll_advice(client_id, backlog),
+            'work': work,
+        })
+
+    def _wait_for_work(self, client_id, wait):
+        """Pending work, waiting up to ``wait`` seconds (capped) for some to appear."""
+        wait = min(wait, settings.CLIENT_WORK_MAX_WAIT)
+
+        if wait:
+            with WorkSubscription(client_id) as subscription:
+                work = self._pending_work(client_id)
+                if not work and subscription.wait(wait):
+                    work = self._pending_work(client_id)
+        else:
+            work = self._pending_work(client_id)
+        return work
+
+    @action(detail=True, methods=['get'])
+    def prestage(self, request, pk=None):
+        """Scheduled deployments whose package this client should download now.
+
+        Deployments are offered ``DEPLOYMENT_PRESTAGE_WINDOW`` seconds before
+        ``scheduled_for``. Each client gets a fixed offset within the first
+        half of that window, so the fleet's downloads are spread out instead
+        of all starting at once.
+        """
+        client_id = self.get_object().id
+        window = settings.DEPLOYMENT_PRESTAGE_WINDOW
+        # Knuth's multiplicative hash spreads consecutive ids over [0, 1).
+        offset = timedelta(seconds=window / 2 * ((client_id * 2654435761) % 2 ** 32) / 2 ** 32)
+        now = timezone.now()
+        statuses = [
+            status for status in
+            DeploymentStatus.objects.prestage_for_client(client_id, window)
+            .select_related('deployment__package').order_by('deployment__scheduled_for')
+            if status.deployment.scheduled_for - timedelta(seconds=window) + offset <= now
+        ]
+        return Response(PrestageWorkSerializer(statuses, many=True).data)
+
+    @action(detail=True, methods=['post'])
+    def chunks(self, request, pk=None):
+        """Record which chunks of a package blob this client serves to peers."""
+        client = self.get_object()
+        serializer = PeerChunksSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        blob = PackageBlob.objects.filter(checksum=data['checksum']).first()
+        if blob is None:
+            return Response({'status': 'error', 'message': 'Unknown package blob'}, status=404)
+        if data['chunks']:
+            PackagePeer.objects.update_or_create(
+                client=client, blob=blob,
+                defaults={'port': data['port'], 'chunks': sorted(set(data['chunks']))},
+            )
+        else:
+            PackagePeer.objects.filter(client=client, blob=blob).delete()
+        return Response({'status': 'success'})
+
+    def _pending_work(self, client_id):
+        """Serialized pending work of a client, cached until its work changes."""
+        def build():
+            statuses = (
+                DeploymentStatus.objects.pending_for_client(client_id)
+                .select_related('deployment__package')
+                .only('id', 'deployment__id', 'deployment__package__id', 'deployment__package__name',
+                      'deployment__package__version', 'deployment__package__checksum',
+                      'deployment__package__size')
+                .order_by('id')
+            )
+            return PendingWorkSerializer(statuses, many=True).data
+
+        return cached(work_namespace(client_id), 'pending', build, timeout=settings.API_CACHE_WORK_TIMEOUT)
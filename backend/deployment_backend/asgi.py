@@ -2,6 +2,10 @@
 ASGI config for deployment_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve the deployment event streams through it (e.g. ``uvicorn
+deployment_backend.asgi:application``) so that they run as coroutines instead
+of tying up a worker thread each. Everything else, package downloads in
+particular, is best served by a WSGI server (see the README).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
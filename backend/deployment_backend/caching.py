@@ -0,0 +1,113 @@
+"""Versioned caching of hot read endpoints.
+
+Cached entries live under a namespace (``packages``, ``clients`` and
+``work:<client id>`` for each client's work list) whose current version is
+part of every key. Invalidating a namespace drops its version once the
+transaction commits, so all of its entries become unreachable at once and
+simply expire; the next read starts a new version. The version is also the
+ETag of cached responses, so a client revalidating an unchanged list gets a
+304 without touching the database.
+
+Caching is best effort: if the cache is unavailable, reads go to the
+database and responses carry no ETag.
+"""
+import hashlib
+import logging
+import time
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(namespace):
+    return f"version:{namespace}"
+
+
+def get_version(namespace):
+    """Current version of ``namespace``, or None if the cache is unavailable."""
+    key = _version_key(namespace)
+    try:
+        version = cache.get(key)
+        if version is None:
+            # Start from the clock so a lost version never resurrects old entries.
+            cache.add(key, time.time_ns(), timeout=None)
+            version = cache.get(key)
+        return version
+    except redis.RedisError as e:
+        logger.warning("Cache unavailable, reading %s uncached: %s", namespace, e)
+        return None
+
+
+def _drop_versions(namespaces):
+    # One round trip however many clients' work lists a rollout touched.
+    try:
+        cache.delete_many([_version_key(namespace) for namespace in namespaces])
+    except redis.RedisError as e:
+        logger.warning("Could not invalidate %d cached namespaces: %s", len(namespaces), e)
+
+
+def invalidate(*namespaces):
+    """Drop every cached entry of the given namespaces after the transaction commits."""
+    if namespaces:
+        transaction.on_commit(lambda: _drop_versions(namespaces))
+
+
+def work_namespace(client_id):
+    return f"work:{client_id}"
+
+
+def invalidate_work(client_ids):
+    """Drop the cached work lists of the given clients after the transaction commits."""
+    invalidate(*{work_namespace(client_id) for client_id in client_ids})
+
+
+def cached(namespace, key, build, timeout=None, version=None):
+    """Return ``build()``'s result, cached under ``key`` in ``namespace``.
+
+    ``version`` may be passed if the caller already looked it up.
+    """
+    version = version or get_version(namespace)
+    if version is None:
+        return build()
+    full_key = f"{namespace}:{version}:{key}"
+    try:
+        data = cache.get(full_key)
+    except redis.RedisError as e:
+        logger.warning("Cache unavailable, reading %s uncached: %s", namespace, e)
+        return build()
+    if data is None:
+        data = build()
+        try:
+            cache.set(full_key, data, settings.API_CACHE_TIMEOUT if timeout is None else timeout)
+        except redis.RedisError as e:
+            logger.warning("Could not cache %s: %s", full_key, e)
+    return data
+
+
+def conditional_response(request, namespace, build):
+    """Serve ``build()``'s response data from the cache with an ETag.
+
+    The data is cached per absolute URL, which covers query parameters and
+    the host in pagination links. A request whose ``If-None-Match`` matches
+    the current version gets a 304.
+    """
+    version = get_version(namespace)
+    if version is None:
+        return Response(build())
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    etag = f'"{namespace}-{version}-{digest}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(cached(namespace, digest, build, version=version))
+    response['ETag'] = etag
+    # Let browsers keep the copy but revalidate it on every use.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -11,4 +11,7 @@ app = Celery('deployment_backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 # Load task modules from all registered Django app configs.
-app.autodiscover_tasks() 
\ No newline at end of file
+app.autodiscover_tasks()
+
+# Connect the signal handlers that record task queue wait and run time.
+from . import metrics  # noqa: E402,F401
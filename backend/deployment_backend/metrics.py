@@ -0,0 +1,144 @@
+"""Prometheus metrics for requests and Celery tasks.
+
+``MetricsMiddleware`` records the latency of every request and the number
+and total duration of the SQL queries it ran, labelled by view name. The
+Celery signal handlers below record how long each task waited in the queue
+and how long it ran. ``metrics_view`` serves everything in the Prometheus
+text format at ``/metrics``.
+
+With several processes (gunicorn workers, Celery's prefork pool) each one
+keeps its own samples. Point ``PROMETHEUS_MULTIPROC_DIR`` at an empty
+directory shared by all of them and ``/metrics`` reports their sum.
+"""
+import os
+import time
+from datetime import datetime
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to respond to a request, by view.',
+    ['view', 'method', 'status'],
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries run by a request, by view.',
+    ['view'], buckets=(0, 1, 2, 3, 5, 8, 13, 20, 30, 50, 100, float('inf')),
+)
+REQUEST_QUERY_TIME = Histogram(
+    'http_request_db_duration_seconds', 'Time a request spent in SQL queries, by view.',
+    ['view'],
+)
+TASK_QUEUE_WAIT = Histogram(
+    'celery_task_queue_wait_seconds', 'Time from publishing (or the ETA) to a worker starting a task.',
+    ['task'], buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')),
+)
+TASK_RUN_TIME = Histogram(
+    'celery_task_run_seconds', 'Time a worker spent running a task.',
+    ['task', 'state'], buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float('inf')),
+)
+
+
+class MetricsMiddleware:
+    """Records request latency and SQL queries per view.
+
+    Requests that match no URL are counted as ``<unmatched>`` so scanners
+    cannot create a label per path.
+
+    Under ASGI the middleware stays async so streaming views such as the
+    deployment event stream are not pushed into a thread. Queries then run
+    in ``sync_to_async`` threads it cannot see, so only latency is recorded,
+    and for streams it ends when the response headers are ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        queries = 0
+        query_time = 0.0
+
+        def record_query(execute, sql, params, many, context):
+            nonlocal queries, query_time
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries += 1
+                query_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(record_query):
+            response = self.get_response(request)
+        view = self._record(request, response, time.perf_counter() - started)
+        REQUEST_QUERIES.labels(view).observe(queries)
+        REQUEST_QUERY_TIME.labels(view).observe(query_time)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    def _record(self, request, response, latency):
+        match = request.resolver_match
+        view = match.view_name if match is not None else '<unmatched>'
+        REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(latency)
+        return view
+
+
+def metrics_view(request):
+    """Serve the metrics to addresses in ``METRICS_ALLOWED_IPS``."""
+    allowed = settings.METRICS_ALLOWED_IPS
+    if '*' not in allowed and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+# Task start times by task id, in the worker process running them.
+_task_started = {}
+
+
+@before_task_publish.connect
+def _stamp_published(headers=None, **kwargs):
+    # Custom headers travel with the message and end up in task.request.headers.
+    if headers is not None:
+        headers.setdefault('published_at', time.time())
+
+
+@task_prerun.connect
+def _task_started_handler(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+    published_at = (task.request.headers or {}).get('published_at')
+    if published_at is None:
+        # Run eagerly or published without our handler; there was no queue.
+        return
+    if task.request.eta:
+        # A countdown or ETA is not time spent waiting for a worker.
+        published_at = max(published_at, datetime.fromisoformat(task.request.eta).timestamp())
+    TASK_QUEUE_WAIT.labels(task.name).observe(max(time.time() - published_at, 0))
+
+
+@task_postrun.connect
+def _task_finished_handler(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_RUN_TIME.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
@@ -0,0 +1,12 @@
+from rest_framework.pagination import CursorPagination
+
+
+class StandardCursorPagination(CursorPagination):
+    """Cursor pagination used by every list endpoint.
+
+    Unlike offset pages, cursors stay stable while new rows are inserted.
+    The ordering comes from each viewset's ``ordering``/``OrderingFilter``,
+    so only non-nullable fields should be offered for ordering.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
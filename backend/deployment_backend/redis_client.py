@@ -0,0 +1,26 @@
+"""Shared Redis connections for the pub/sub and buffering helpers."""
+import asyncio
+import weakref
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+_connection = None
+# asyncio connections belong to the event loop that opened them.
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def get_connection():
+    global _connection
+    if _connection is None:
+        _connection = redis.Redis.from_url(settings.REDIS_URL)
+    return _connection
+
+
+def get_async_connection():
+    """An asyncio client drawing on one connection pool per event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = _async_pools[loop] = aioredis.ConnectionPool.from_url(settings.REDIS_URL)
+    return aioredis.Redis(connection_pool=pool)
@@ -57,10 +57,13 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'deployment_backend.pagination.StandardCursorPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', '50')),
 }
 
 MIDDLEWARE = [
+    "deployment_backend.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -148,15 +151,127 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# Uploaded package files
+MEDIA_URL = "media/"
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+# Hash uploads while they are received instead of re-reading them afterwards.
+FILE_UPLOAD_HANDLERS = [
+    'packages.uploadhandlers.HashingMemoryFileUploadHandler',
+    'packages.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Cache for hot read endpoints, invalidated by model signals (see deployment_backend.caching)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CACHE_URL', REDIS_URL),
+        'KEY_PREFIX': 'api',
+    }
+}
+# Seconds a cached response is kept if nothing invalidates it first.
+API_CACHE_TIMEOUT = int(os.getenv('API_CACHE_TIMEOUT', '300'))
+# Work lists also depend on the clock (scheduled deployments becoming due),
+# so they are kept for a shorter time.
+API_CACHE_WORK_TIMEOUT = int(os.getenv('API_CACHE_WORK_TIMEOUT', '30'))
+
 # Celery Configuration
-CELERY_BROKER_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'flush-client-heartbeats': {
+        'task': 'clients.tasks.flush_heartbeats',
+        'schedule': float(os.getenv('CLIENT_HEARTBEAT_FLUSH_INTERVAL', '15')),
+    },
+    'mark-offline-clients': {
+        'task': 'clients.tasks.mark_offline_clients',
+        'schedule': float(os.getenv('CLIENT_OFFLINE_SWEEP_INTERVAL', '60')),
+    },
+    'collect-package-blobs': {
+        'task': 'packages.tasks.collect_package_blobs',
+        'schedule': float(os.getenv('PACKAGE_BLOB_GC_INTERVAL', '3600')),
+    },
+    'expire-package-uploads': {
+        'task': 'packages.tasks.expire_package_uploads',
+        'schedule': float(os.getenv('PACKAGE_UPLOAD_EXPIRY_INTERVAL', '3600')),
+    },
+}
+
+# Deployment engine
+# Fan a deployment out into per-batch Celery subtasks instead of one serial task.
+DEPLOYMENT_FANOUT_ENABLED = os.getenv('DEPLOYMENT_FANOUT_ENABLED', 'True') == 'True'
+DEPLOYMENT_FANOUT_BATCH_SIZE = int(os.getenv('DEPLOYMENT_FANOUT_BATCH_SIZE', '25'))
+# Upper bound on batch subtasks of a single deployment running at the same time.
+DEPLOYMENT_FANOUT_MAX_CONCURRENCY = int(os.getenv('DEPLOYMENT_FANOUT_MAX_CONCURRENCY', '8'))
+# Rows per INSERT when creating the statuses of a new deployment.
+DEPLOYMENT_STATUS_BATCH_SIZE = int(os.getenv('DEPLOYMENT_STATUS_BATCH_SIZE', '1000'))
+
+# Seconds before scheduled_for that agents start downloading a deployment's package.
+DEPLOYMENT_PRESTAGE_WINDOW = int(os.getenv('DEPLOYMENT_PRESTAGE_WINDOW', '3600'))
+
+# Longest time (seconds) a client's work request may be held open waiting for new work.
+CLIENT_WORK_MAX_WAIT = int(os.getenv('CLIENT_WORK_MAX_WAIT', '30'))
+
+# Client heartbeats are buffered in Redis and written in batches of this size.
+CLIENT_HEARTBEAT_FLUSH_BATCH_SIZE = int(os.getenv('CLIENT_HEARTBEAT_FLUSH_BATCH_SIZE', '1000'))
+# Seconds without a check-in after which a client is considered offline.
+CLIENT_OFFLINE_AFTER = int(os.getenv('CLIENT_OFFLINE_AFTER', '300'))
+# Check-in interval (seconds) suggested to idle agents and to agents with deployments to run.
+CLIENT_POLL_INTERVAL = int(os.getenv('CLIENT_POLL_INTERVAL', '60'))
+CLIENT_POLL_INTERVAL_ACTIVE = int(os.getenv('CLIENT_POLL_INTERVAL_ACTIVE', '15'))
+# Base delay (seconds) agents back off from after a failed request.
+CLIENT_RETRY_AFTER = int(os.getenv('CLIENT_RETRY_AFTER', '30'))
+# Buffered heartbeats at which the suggested intervals double.
+CLIENT_HEARTBEAT_BACKLOG = int(os.getenv('CLIENT_HEARTBEAT_BACKLOG', '5000'))
+# Reverse proxies whose X-Forwarded-For header is trusted for client addresses.
+TRUSTED_PROXY_IPS = [ip for ip in os.getenv('TRUSTED_PROXY_IPS', '').split(',') if ip]
+
+# Deployment logs are read in pages of this many chunks.
+DEPLOYMENT_LOG_READ_CHUNKS = int(os.getenv('DEPLOYMENT_LOG_READ_CHUNKS', '500'))
+# Longest time (seconds) a log read may wait for new output in follow mode.
+DEPLOYMENT_LOG_FOLLOW_MAX_WAIT = int(os.getenv('DEPLOYMENT_LOG_FOLLOW_MAX_WAIT', '30'))
+# Seconds between full snapshots on a deployment event stream; they also keep it alive.
+DEPLOYMENT_EVENTS_SNAPSHOT_INTERVAL = int(os.getenv('DEPLOYMENT_EVENTS_SNAPSHOT_INTERVAL', '15'))
+# Seconds after which an event stream is closed; the browser reconnects by itself.
+DEPLOYMENT_EVENTS_MAX_AGE = int(os.getenv('DEPLOYMENT_EVENTS_MAX_AGE', '300'))
+# Seconds within which a stream ticket must be used to open an event stream.
+DEPLOYMENT_EVENTS_TICKET_MAX_AGE = int(os.getenv('DEPLOYMENT_EVENTS_TICKET_MAX_AGE', '30'))
+
+# Metrics
+# Addresses allowed to read /metrics ('*' for any).
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Package blobs
+# Seconds an unreferenced blob is kept before garbage collection removes it.
+PACKAGE_BLOB_GC_GRACE = int(os.getenv('PACKAGE_BLOB_GC_GRACE', '3600'))
+# Seconds after its last chunk that an unfinished chunked upload is discarded.
+PACKAGE_UPLOAD_EXPIRY = int(os.getenv('PACKAGE_UPLOAD_EXPIRY', '86400'))
+
+# Binary deltas between consecutive versions of a package
+PACKAGE_DELTA_BLOCK_SIZE = int(os.getenv('PACKAGE_DELTA_BLOCK_SIZE', '4096'))
+# Deltas larger than this fraction of the full package are not kept.
+PACKAGE_DELTA_MAX_RATIO = float(os.getenv('PACKAGE_DELTA_MAX_RATIO', '0.5'))
+# Packages larger than this (bytes) get no deltas. Unmatched bytes are
+# scanned at a few MB/s, so building a delta of a file this size that has
+# changed throughout takes about a minute of worker time.
+PACKAGE_DELTA_MAX_FILE_SIZE = int(os.getenv('PACKAGE_DELTA_MAX_FILE_SIZE', str(256 * 1024 ** 2)))
+
+# Peer-assisted distribution
+# Size of the chunks agents verify and exchange with peers.
+PACKAGE_CHUNK_SIZE = int(os.getenv('PACKAGE_CHUNK_SIZE', str(4 * 1024 * 1024)))
+# Most peers listed in a blob manifest.
+PACKAGE_PEER_LIMIT = int(os.getenv('PACKAGE_PEER_LIMIT', '10'))
+# Seconds agents are told to wait for a manifest that is being computed, and
+# after which a manifest computation that never finished may be retried.
+PACKAGE_MANIFEST_RETRY_AFTER = int(os.getenv('PACKAGE_MANIFEST_RETRY_AFTER', '5'))
+PACKAGE_MANIFEST_LOCK_TIMEOUT = int(os.getenv('PACKAGE_MANIFEST_LOCK_TIMEOUT', '600'))
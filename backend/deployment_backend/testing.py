@@ -0,0 +1,142 @@
+"""Helpers shared by the apps' test suites."""
+from itertools import count
+import shutil
+import tempfile
+import redis
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from clients.models import Client
+from deployment_backend.redis_client import get_connection
+from deployments.models import Deployment, DeploymentStatus
+from packages.models import Package
+
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+NO_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+sequence = count(1)
+
+
+class FakeRedis:
+    """In-memory stand-in for the few hash commands the heartbeat buffer uses."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[str(field).encode()] = value.encode()
+        return 1
+
+    def hlen(self, key):
+        return len(self.hashes.get(key, {}))
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def delete(self, key):
+        return int(self.hashes.pop(key, None) is not None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self.commands.append((getattr(self.redis, name), args))
+        return queue
+
+    def execute(self):
+        results = [command(*args) for command, args in self.commands]
+        self.commands = []
+        return results
+
+
+def redis_available():
+    """Whether the configured Redis answers, for tests that need real pub/sub."""
+    try:
+        return get_connection().ping()
+    except redis.RedisError:
+        return False
+
+
+def make_client(status='online', **fields):
+    n = next(sequence)
+    return Client.objects.create(**{
+        'hostname': f'host-{n}', 'ip_address': f'10.0.{n // 250}.{n % 250 + 1}',
+        'os_type': 'linux', 'os_version': '22.04', 'status': status, **fields,
+    })
+
+
+def make_package(**fields):
+    n = next(sequence)
+    return Package.objects.create(**{
+        'name': f'package-{n}', 'version': '1.0', 'os_compatibility': 'linux',
+        'file': f'packages/package-{n}.deb', **fields,
+    })
+
+
+def make_deployment(user, clients=2, **fields):
+    """Create a deployment of a fresh package with a pending status for each of ``clients`` new clients."""
+    deployment = Deployment.objects.create(package=make_package(), created_by=user, **fields)
+    for _ in range(clients):
+        DeploymentStatus.objects.create(deployment=deployment, client=make_client())
+    return deployment
+
+
+def assign_deployment(user, client, **fields):
+    """Create a deployment of a fresh package with a pending status for ``client``."""
+    deployment = Deployment.objects.create(package=make_package(), created_by=user, **fields)
+    return DeploymentStatus.objects.create(deployment=deployment, client=client)
+
+
+class TemporaryMediaMixin:
+    """Store the files a test case writes in a directory removed afterwards."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        cls.addClassCleanup(media.disable)
+
+
+class QueryCountMixin:
+    """Guard endpoints against N+1 queries.
+
+    ``assertQueryBudget`` runs a request, adds more rows and runs it again.
+    An N+1 pattern shows up as a query count that grows with the rows; a
+    fixed ``budget`` catches regressions that add constant extra queries.
+    Caching is disabled so that the queries of uncached reads are counted.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        no_cache = override_settings(CACHES=NO_CACHE)
+        no_cache.enable()
+        cls.addClassCleanup(no_cache.disable)
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            result = func()
+        return result, len(queries)
+
+    def assertQueryBudget(self, func, add_rows, budget, rounds=3):
+        add_rows()
+        # Warm up caches such as the content types before counting.
+        func()
+        response, few = self.count_queries(func)
+        if hasattr(response, 'status_code'):
+            self.assertLess(response.status_code, 400, getattr(response, 'data', response))
+        for _ in range(rounds):
+            add_rows()
+        _, many = self.count_queries(func)
+        self.assertEqual(few, many, "Query count grows with the number of rows")
+        self.assertLessEqual(many, budget)
@@ -0,0 +1,78 @@
+import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.test import override_settings
+from prometheus_client import REGISTRY
+from rest_framework.test import APITestCase
+from rest_framework.authtoken.models import Token
+from deployments.tasks import check_scheduled_deployments
+from .metrics import MetricsMiddleware
+from .testing import NO_CACHE, make_deployment
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@override_settings(CACHES=NO_CACHE)
+class MetricsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_request_metrics_by_view(self):
+        labels = {'view': 'client-list', 'method': 'GET', 'status': '200'}
+        requests = sample('http_request_duration_seconds_count', **labels)
+        queries = sample('http_request_db_queries_sum', view='client-list')
+        self.client.get('/api/clients/')
+        self.assertEqual(sample('http_request_duration_seconds_count', **labels), requests + 1)
+        self.assertGreater(sample('http_request_db_queries_sum', view='client-list'), queries)
+
+    def test_unmatched_paths_share_a_label(self):
+        labels = {'view': '<unmatched>', 'method': 'GET', 'status': '404'}
+        before = sample('http_request_duration_seconds_count', **labels)
+        self.client.get('/no-such-page-1/')
+        self.client.get('/no-such-page-2/')
+        self.assertEqual(sample('http_request_duration_seconds_count', **labels), before + 2)
+
+    @override_settings(DEPLOYMENT_EVENTS_MAX_AGE=0)
+    async def test_async_requests_stay_async(self):
+        async def view(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(view)))
+        deployment = await sync_to_async(make_deployment)(self.user)
+        token = await sync_to_async(Token.objects.create)(user=self.user)
+        labels = {'view': 'deployment-events', 'method': 'GET', 'status': '200'}
+        before = sample('http_request_duration_seconds_count', **labels)
+        response = await self.async_client.get(
+            f'/api/deployments/{deployment.pk}/events/', AUTHORIZATION=f'Token {token.key}',
+        )
+        self.assertEqual(response.status_code, 200)
+        async for _ in response.streaming_content:
+            pass
+        self.assertEqual(sample('http_request_duration_seconds_count', **labels), before + 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/clients/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_bucket{', response.content)
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_endpoint_restricted(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_task_run_time_and_queue_wait(self):
+        task = check_scheduled_deployments.name
+        runs = sample('celery_task_run_seconds_count', task=task, state='SUCCESS')
+        waits = sample('celery_task_queue_wait_seconds_count', task=task)
+        # Run eagerly, there is no queue to wait in.
+        check_scheduled_deployments.apply()
+        self.assertEqual(sample('celery_task_run_seconds_count', task=task, state='SUCCESS'), runs + 1)
+        self.assertEqual(sample('celery_task_queue_wait_seconds_count', task=task), waits)
+
+        waited = sample('celery_task_queue_wait_seconds_sum', task=task)
+        check_scheduled_deployments.apply(headers={'published_at': time.time() - 5})
+        self.assertEqual(sample('celery_task_queue_wait_seconds_count', task=task), waits + 1)
+        self.assertGreaterEqual(sample('celery_task_queue_wait_seconds_sum', task=task), waited + 5)
@@ -19,17 +19,23 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken import views as auth_views
 from clients.views import ClientViewSet
-from packages.views import PackageViewSet
-from deployments.views import DeploymentViewSet
+from packages.views import PackageViewSet, PackageUploadViewSet
+from deployment_backend.metrics import metrics_view
+from deployments.events import deployment_events
+from deployments.views import DeploymentViewSet, DeploymentStatusViewSet
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
 router.register(r'clients', ClientViewSet)
 router.register(r'packages', PackageViewSet)
+router.register(r'package-uploads', PackageUploadViewSet)
 router.register(r'deployments', DeploymentViewSet)
+router.register(r'deployment-status', DeploymentStatusViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/deployments/<int:pk>/events/', deployment_events, name='deployment-events'),
     path('api/', include(router.urls)),
     path('api/token/', auth_views.obtain_auth_token),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -4,14 +4,37 @@ from .models import Deployment, DeploymentStatus
 class DeploymentStatusInline(admin.TabularInline):
     model = DeploymentStatus
     extra = 0
-    readonly_fields = ('started_at', 'completed_at')
+    # The client set is fixed once a deployment has been created, and a
+    # client widget would cost a query (or a whole client list) per row.
+    readonly_fields = ('client', 'started_at', 'completed_at', 'wave')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('client')
+
+    def has_add_permission(self, request, obj=None):
+        return False
 
 @admin.register(Deployment)
 class DeploymentAdmin(admin.ModelAdmin):
-    list_display = ('package', 'created_at', 'scheduled_for')
-    list_filter = ('created_at', 'scheduled_for')
+    list_display = ('package', 'created_at', 'scheduled_for', 'rollout_status', 'current_wave')
+    list_filter = ('created_at', 'scheduled_for', 'rollout_status')
     search_fields = ('package__name', 'description')
+    list_select_related = ('package',)
     inlines = [DeploymentStatusInline]
+    readonly_fields = ('pending_count', 'in_progress_count', 'completed_count', 'failed_count',
+                       'cancelled_count')
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is not None:
+            # Statuses are assigned to waves when the deployment is created.
+            readonly_fields += ('rollout_waves',)
+        return readonly_fields
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Inline edits bypass the status transitions, so rebuild the counters.
+        form.instance.recount_statuses()
 
 @admin.register(DeploymentStatus)
 class DeploymentStatusAdmin(admin.ModelAdmin):
@@ -19,3 +42,20 @@ class DeploymentStatusAdmin(admin.ModelAdmin):
     list_filter = ('status', 'started_at', 'completed_at')
     search_fields = ('deployment__package__name', 'client__hostname', 'error_message')
     readonly_fields = ('started_at', 'completed_at')
+    # Both columns render through __str__, which follows these relations.
+    list_select_related = ('deployment__package', 'client')
+    raw_id_fields = ('deployment', 'client')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        obj.deployment.recount_statuses()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        obj.deployment.recount_statuses()
+
+    def delete_queryset(self, request, queryset):
+        deployment_ids = set(queryset.values_list('deployment_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for deployment in Deployment.objects.filter(id__in=deployment_ids):
+            deployment.recount_statuses()
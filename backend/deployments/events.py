@@ -0,0 +1,148 @@
+"""Server-Sent Events stream of a deployment's progress for the dashboard.
+
+``GET /api/deployments/<id>/events/`` is an async view: under the ASGI
+application (``deployment_backend.asgi``) every open stream is a coroutine
+waiting on Redis pub/sub instead of a worker thread. The stream starts with
+a ``snapshot`` of the deployment's counters and then relays the ``counts``
+and ``statuses`` events published on the deployment's event channel.
+
+A fresh snapshot is sent every ``DEPLOYMENT_EVENTS_SNAPSHOT_INTERVAL``
+seconds. It keeps proxies from closing an idle connection and corrects the
+counters if an event was missed, e.g. while Redis was unavailable. Streams
+end after ``DEPLOYMENT_EVENTS_MAX_AGE`` seconds so that streams of departed
+browsers do not pile up.
+
+``EventSource`` cannot send an Authorization header, and API tokens do not
+belong in URLs where proxies and browser history keep them. The dashboard
+first asks ``POST /api/deployments/<id>/events/ticket/`` for a signed
+ticket that opens a stream of that deployment only and expires after
+``DEPLOYMENT_EVENTS_TICKET_MAX_AGE`` seconds, and passes it as
+``?ticket=``. Other clients may send their token in the header.
+
+Subscriptions draw on a connection pool shared by all streams of the
+process (see ``deployment_backend.redis_client``).
+"""
+import asyncio
+import json
+import logging
+import time
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from rest_framework.authtoken.models import Token
+from deployment_backend.redis_client import get_async_connection
+from .models import Deployment
+from .notifications import deployment_channel
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds the browser waits before reconnecting a closed stream.
+RECONNECT_DELAY = 3000
+
+
+TICKET_SALT = 'deployments.events'
+
+
+def issue_ticket(user, deployment_id):
+    """A signed ticket letting ``user`` open the event stream of one deployment."""
+    return signing.dumps({'user': user.id, 'deployment': deployment_id}, salt=TICKET_SALT)
+
+
+def _authenticated(request, deployment_id):
+    ticket = request.GET.get('ticket')
+    if ticket:
+        try:
+            grant = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.DEPLOYMENT_EVENTS_TICKET_MAX_AGE)
+        except signing.BadSignature:
+            return False
+        return (grant['deployment'] == deployment_id
+                and User.objects.filter(id=grant['user'], is_active=True).exists())
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword != 'Token':
+        return False
+    return Token.objects.filter(key=key, user__is_active=True).exists()
+
+
+def _snapshot(deployment_id):
+    deployment = Deployment.objects.get(id=deployment_id)
+    return {
+        'type': 'snapshot',
+        'rollout_status': deployment.rollout_status,
+        'current_wave': deployment.current_wave,
+        'status_counts': deployment.status_counts,
+    }
+
+
+def _event(data):
+    if not isinstance(data, str):
+        data = json.dumps(data, cls=DjangoJSONEncoder)
+    return f"data: {data}\n\n"
+
+
+async def _subscribe(deployment_id):
+    pubsub = get_async_connection().pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(deployment_channel(deployment_id))
+    except redis.RedisError as e:
+        logger.warning("Could not subscribe to events of deployment %s: %s", deployment_id, e)
+        await _close(pubsub)
+        return None
+    return pubsub
+
+
+async def _close(pubsub):
+    # Hands the connection back to the pool.
+    if pubsub is not None:
+        await pubsub.aclose()
+
+
+async def _stream(deployment_id, pubsub, snapshot):
+    listening = pubsub is not None
+    closes_at = time.monotonic() + settings.DEPLOYMENT_EVENTS_MAX_AGE
+    try:
+        yield f"retry: {RECONNECT_DELAY}\n" + _event(snapshot)
+        while time.monotonic() < closes_at:
+            next_snapshot = time.monotonic() + settings.DEPLOYMENT_EVENTS_SNAPSHOT_INTERVAL
+            while (remaining := next_snapshot - time.monotonic()) > 0:
+                if not listening:
+                    # Without Redis the stream degrades to periodic snapshots.
+                    await asyncio.sleep(remaining)
+                    break
+                try:
+                    message = await pubsub.get_message(timeout=remaining)
+                except redis.RedisError as e:
+                    logger.warning("Lost events of deployment %s: %s", deployment_id, e)
+                    listening = False
+                    continue
+                if message:
+                    yield _event(message['data'].decode())
+            try:
+                yield _event(await sync_to_async(_snapshot)(deployment_id))
+            except Deployment.DoesNotExist:
+                return
+    finally:
+        await _close(pubsub)
+
+
+async def deployment_events(request, pk):
+    """Stream progress events of one deployment as ``text/event-stream``."""
+    if not await sync_to_async(_authenticated)(request, pk):
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    # Subscribe before reading the snapshot so no event falls in between.
+    pubsub = await _subscribe(pk)
+    try:
+        snapshot = await sync_to_async(_snapshot)(pk)
+    except Deployment.DoesNotExist:
+        await _close(pubsub)
+        raise Http404
+    response = StreamingHttpResponse(
+        _stream(pk, pubsub, snapshot), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 15:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deployments', '0002_deployment_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='current_wave',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='failure_threshold',
+            field=models.FloatField(blank=True, help_text='Failure rate (percent) of released clients that halts later waves', null=True),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='rollout_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('halted', 'Halted'), ('completed', 'Completed')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='rollout_waves',
+            field=models.JSONField(blank=True, default=list, help_text='Cumulative percentage of clients released per wave, e.g. [1, 10, 50, 100]'),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='wave_concurrency',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum parallel batch subtasks per wave', null=True),
+        ),
+        migrations.AddField(
+            model_name='deploymentstatus',
+            name='wave',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deployments', '0003_deployment_rollout_waves'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deploymentstatus',
+            index=models.Index(fields=['client', 'status'], include=('deployment', 'wave'), name='deploystatus_client_status'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+def backfill_status_counts(apps, schema_editor):
+    Deployment = apps.get_model('deployments', 'Deployment')
+    DeploymentStatus = apps.get_model('deployments', 'DeploymentStatus')
+    counts = {}
+    rows = (
+        DeploymentStatus.objects.order_by()
+        .values_list('deployment_id', 'status')
+        .annotate(total=models.Count('id'))
+    )
+    for deployment_id, status, total in rows:
+        counts.setdefault(deployment_id, {})[f'{status}_count'] = total
+    for deployment_id, fields in counts.items():
+        Deployment.objects.filter(id=deployment_id).update(**fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deployments', '0004_deploystatus_client_status_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deployment',
+            name='cancelled_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='completed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='in_progress_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='deployment',
+            name='pending_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_status_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-18 15:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_logs_to_chunks(apps, schema_editor):
+    DeploymentStatus = apps.get_model('deployments', 'DeploymentStatus')
+    DeploymentLogChunk = apps.get_model('deployments', 'DeploymentLogChunk')
+    statuses = DeploymentStatus.objects.exclude(log_output='').values_list('id', 'log_output')
+    DeploymentLogChunk.objects.bulk_create(
+        (DeploymentLogChunk(status_id=status_id, content=log_output) for status_id, log_output in statuses.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deployments', '0005_deployment_status_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeploymentLogChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='log_chunks', to='deployments.deploymentstatus')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='deploymentlogchunk',
+            index=models.Index(fields=['status', 'id'], name='deploylogchunk_status_id'),
+        ),
+        migrations.RunPython(move_logs_to_chunks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='deploymentstatus',
+            name='log_output',
+        ),
+    ]
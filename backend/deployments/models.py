@@ -1,21 +1,222 @@
-from django.db import models
+import math
+from collections import defaultdict
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from django.contrib.auth.models import User
 from clients.models import Client
+from deployment_backend.caching import invalidate_work
 from packages.models import Package
+from .notifications import notify_deployment, notify_log
 
 class Deployment(models.Model):
+    ROLLOUT_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('halted', 'Halted'),
+        ('completed', 'Completed'),
+    ]
+
     package = models.ForeignKey(Package, on_delete=models.CASCADE)
     clients = models.ManyToManyField(Client, through='DeploymentStatus')
     description = models.TextField(blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     scheduled_for = models.DateTimeField(null=True, blank=True)
+    rollout_waves = models.JSONField(
+        default=list, blank=True,
+        help_text="Cumulative percentage of clients released per wave, e.g. [1, 10, 50, 100]"
+    )
+    wave_concurrency = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text="Maximum parallel batch subtasks per wave"
+    )
+    failure_threshold = models.FloatField(
+        null=True, blank=True,
+        help_text="Failure rate (percent) of released clients that halts later waves"
+    )
+    current_wave = models.PositiveIntegerField(default=0)
+    rollout_status = models.CharField(max_length=20, choices=ROLLOUT_STATUS_CHOICES, default='pending')
+    # Denormalized number of statuses in each state, kept up to date by
+    # every status transition (see DeploymentStatusQuerySet.transition).
+    pending_count = models.PositiveIntegerField(default=0)
+    in_progress_count = models.PositiveIntegerField(default=0)
+    completed_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created_at']
 
     def __str__(self):
-        return f"Deployment of {self.package.name} to {self.clients.count()} clients"
+        return f"Deployment of {self.package.name} to {self.status_counts['total']} clients"
+
+    @property
+    def status_counts(self):
+        counts = {status: getattr(self, f'{status}_count') for status, _ in DeploymentStatus.STATUS_CHOICES}
+        counts['total'] = sum(counts.values())
+        return counts
+
+    @classmethod
+    def adjust_status_counts(cls, deployment_id, deltas):
+        """Apply ``{status: delta}`` changes to the counters in one UPDATE.
+
+        The deltas are published as a ``counts`` event once the transaction
+        commits.
+        """
+        deltas = {status: delta for status, delta in deltas.items() if delta}
+        if deltas:
+            cls.objects.filter(id=deployment_id).update(
+                **{f'{status}_count': F(f'{status}_count') + delta for status, delta in deltas.items()}
+            )
+            transaction.on_commit(
+                lambda: notify_deployment(deployment_id, {'type': 'counts', 'deltas': deltas})
+            )
+
+    def recount_statuses(self):
+        """Rebuild the counters from the status rows."""
+        counts = dict(
+            self.deployment_statuses.order_by().values_list('status').annotate(total=models.Count('id'))
+        )
+        for status, _ in DeploymentStatus.STATUS_CHOICES:
+            setattr(self, f'{status}_count', counts.get(status, 0))
+        self.save(update_fields=[f'{status}_count' for status, _ in DeploymentStatus.STATUS_CHOICES])
+
+    @property
+    def is_staged(self):
+        return bool(self.rollout_waves)
+
+    def assign_waves(self):
+        """Spread the deployment's statuses over its rollout waves.
+
+        Wave ``n`` receives the clients between the previous cumulative
+        percentage and ``rollout_waves[n - 1]``; every wave gets at least one
+        client while any remain.
+        """
+        status_ids = list(self.deployment_statuses.order_by('id').values_list('id', flat=True))
+        total = len(status_ids)
+        start = 0
+        for wave, percentage in enumerate(self.rollout_waves, start=1):
+            end = min(total, max(start + 1, math.ceil(total * percentage / 100)))
+            if end > start:
+                self.deployment_statuses.filter(
+                    id__gte=status_ids[start], id__lte=status_ids[end - 1]
+                ).update(wave=wave)
+            start = end
+
+# Status changes an agent may report, and the states they may come from.
+AGENT_TRANSITIONS = {
+    'in_progress': ['pending'],
+    'completed': ['pending', 'in_progress'],
+    'failed': ['pending', 'in_progress'],
+}
+
+class DeploymentStatusQuerySet(models.QuerySet):
+    def pending_for_client(self, client_id):
+        """Pending statuses a client may start now.
+
+        Excludes statuses in rollout waves that have not been released yet,
+        halted rollouts and deployments scheduled for later.
+        """
+        return self.filter(
+            client_id=client_id,
+            status='pending',
+            wave__lte=F('deployment__current_wave'),
+        ).filter(
+            Q(deployment__scheduled_for__isnull=True) | Q(deployment__scheduled_for__lte=timezone.now())
+        ).exclude(deployment__rollout_status='halted')
+
+    def prestage_for_client(self, client_id, window):
+        """Pending statuses of a client scheduled to start within ``window`` seconds."""
+        now = timezone.now()
+        return self.filter(
+            client_id=client_id,
+            status='pending',
+            deployment__scheduled_for__gt=now,
+            deployment__scheduled_for__lte=now + timedelta(seconds=window),
+        ).exclude(deployment__rollout_status='halted')
+
+    def transition(self, deployment_id, from_status, to_status, **fields):
+        """Move matching statuses of one deployment between two states.
+
+        A single conditional UPDATE only touches rows still in
+        ``from_status``; the deployment's counters are adjusted by the
+        number of rows it changed, in the same transaction. Moves into or
+        out of ``pending`` invalidate the work lists of the clients
+        concerned. Returns the number of rows changed.
+        """
+        matching = self.filter(deployment_id=deployment_id, status=from_status)
+        changes_work = from_status != to_status and 'pending' in (from_status, to_status)
+        with transaction.atomic():
+            client_ids = []
+            if changes_work:
+                # Lock the rows so the clients read are the ones the UPDATE moves.
+                client_ids = list(matching.select_for_update().values_list('client_id', flat=True))
+            updated = matching.update(status=to_status, **fields)
+            if updated and from_status != to_status:
+                Deployment.adjust_status_counts(deployment_id, {from_status: -updated, to_status: updated})
+                invalidate_work(client_ids)
+        return updated
+
+    def publish_changes(self, deployment_id, status_ids, to_status, **fields):
+        """Publish a ``statuses`` event once the transaction commits.
+
+        Called after a transition() of known ids by the per-status paths
+        (the install task, agent reports and status updates) and by
+        cancellation; ``fields`` are the timestamps and error message that
+        came with it.
+        """
+        event = {
+            'type': 'statuses',
+            'statuses': [{'id': status_id, 'status': to_status, **fields} for status_id in status_ids],
+        }
+        transaction.on_commit(lambda: notify_deployment(deployment_id, event))
+
+    def apply_reports(self, reports):
+        """Apply a batch of agent status reports to the statuses in this queryset.
+
+        ``reports`` are dicts with ``id``, ``status`` and optionally
+        ``error_message`` and ``log_output``. Statuses are read in one query
+        and grouped so that every (deployment, from, to, error) combination
+        is a single transition(); log output is inserted in one batch.
+        Reports that do not fit the current state (e.g. for a cancelled
+        status) are ignored, log output included, so an agent resending a
+        report whose response it never received changes nothing. Returns
+        the number of statuses changed.
+        """
+        by_id = {report['id']: report for report in reports}
+        current = list(self.filter(id__in=by_id).values_list('id', 'deployment_id', 'status'))
+        groups = defaultdict(list)
+        for status_id, deployment_id, status in current:
+            report = by_id[status_id]
+            if status in AGENT_TRANSITIONS[report['status']]:
+                key = (deployment_id, status, report['status'], report.get('error_message', ''))
+                groups[key].append(status_id)
+
+        now = timezone.now()
+        moved = []
+        with transaction.atomic():
+            for (deployment_id, from_status, to_status, error_message), ids in groups.items():
+                fields = {'started_at': now} if to_status == 'in_progress' else {'completed_at': now}
+                if error_message:
+                    fields['error_message'] = error_message
+                updated = DeploymentStatus.objects.filter(id__in=ids).transition(
+                    deployment_id, from_status, to_status, **fields
+                )
+                if updated != len(ids):
+                    # Some statuses changed in between; only report the ones that moved.
+                    ids = list(
+                        DeploymentStatus.objects.filter(id__in=ids, status=to_status, **fields)
+                        .values_list('id', flat=True)
+                    )
+                if ids:
+                    self.publish_changes(deployment_id, ids, to_status, **fields)
+                    moved.extend(ids)
+            DeploymentLogChunk.append_many(
+                (status_id, by_id[status_id].get('log_output', '')) for status_id in moved
+            )
+        return len(moved)
 
 class DeploymentStatus(models.Model):
     STATUS_CHOICES = [
@@ -32,11 +233,73 @@ class DeploymentStatus(models.Model):
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(blank=True)
-    log_output = models.TextField(blank=True)
+    wave = models.PositiveIntegerField(default=0)
+
+    objects = DeploymentStatusQuerySet.as_manager()
 
     class Meta:
         unique_together = ('deployment', 'client')
         ordering = ['-started_at']
+        indexes = [
+            # Serves a client's pending-work lookup; on PostgreSQL the
+            # included columns let the wave check run as an index-only scan.
+            models.Index(fields=['client', 'status'], include=['deployment', 'wave'],
+                         name='deploystatus_client_status'),
+        ]
 
     def __str__(self):
-        return f"Deployment {self.deployment.id} to {self.client.hostname}: {self.status}"
+        return f"Deployment {self.deployment_id} to {self.client.hostname}: {self.status}"
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                # Status changes of existing rows go through transition();
+                # bulk_create callers maintain the counters themselves.
+                Deployment.adjust_status_counts(self.deployment_id, {self.status: 1})
+
+    def append_log(self, content):
+        DeploymentLogChunk.append(self.id, content)
+
+class DeploymentLogChunk(models.Model):
+    """One appended piece of a deployment status's log output.
+
+    Logs are append-only: writing a line inserts a small row instead of
+    rewriting the whole log, and readers page through chunks by id.
+    """
+    status = models.ForeignKey(DeploymentStatus, on_delete=models.CASCADE, related_name='log_chunks')
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='deploylogchunk_status_id'),
+        ]
+
+    def __str__(self):
+        return f"Log chunk {self.id} of status {self.status_id}"
+
+    @classmethod
+    def append(cls, status_id, content):
+        """Append ``content`` to a status log and wake up its followers."""
+        if not content:
+            return None
+        chunk = cls.objects.create(status_id=status_id, content=content)
+        transaction.on_commit(lambda: notify_log(status_id))
+        return chunk
+
+    @classmethod
+    def append_many(cls, entries):
+        """Append to several status logs with a single INSERT.
+
+        ``entries`` are ``(status_id, content)`` pairs; empty content is skipped.
+        """
+        chunks = cls.objects.bulk_create(
+            [cls(status_id=status_id, content=content) for status_id, content in entries if content]
+        )
+        status_ids = {chunk.status_id for chunk in chunks}
+        if status_ids:
+            transaction.on_commit(lambda: notify_log(*status_ids))
+        return chunks
@@ -0,0 +1,113 @@
+"""Redis pub/sub channels that wake up long-polling requests.
+
+Each client has a work channel and each deployment status a log channel.
+A long-polling request subscribes to its channel before reading the
+database, so a notification published in between is never lost.
+Each deployment also has an event channel carrying small JSON progress
+events for the dashboard's event stream (see ``deployments.events``).
+Publishing is best effort: if Redis is unavailable the waiting requests
+simply fall back to their poll timeout.
+"""
+import json
+import logging
+import time
+import redis
+from django.core.serializers.json import DjangoJSONEncoder
+from deployment_backend.redis_client import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+def work_channel(client_id):
+    return f"client-work:{client_id}"
+
+
+def log_channel(status_id):
+    return f"status-log:{status_id}"
+
+
+def deployment_channel(deployment_id):
+    return f"deployment-events:{deployment_id}"
+
+
+def publish(channels, message='1'):
+    """Publish ``message`` on each of the given channels in one round trip."""
+    channels = list(channels)
+    if not channels:
+        return
+    try:
+        pipe = get_connection().pipeline(transaction=False)
+        for channel in channels:
+            pipe.publish(channel, message)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Could not publish to %d channels: %s", len(channels), e)
+
+
+def notify_clients(client_ids):
+    """Tell each of the given clients that it has new work."""
+    publish(work_channel(client_id) for client_id in client_ids)
+
+
+def notify_log(*status_ids):
+    """Tell followers of status logs that new output was appended."""
+    publish(log_channel(status_id) for status_id in status_ids)
+
+
+def notify_deployment(deployment_id, event):
+    """Publish a progress event (a JSON-serialisable dict) for a deployment."""
+    publish([deployment_channel(deployment_id)], json.dumps(event, cls=DjangoJSONEncoder))
+
+
+class Subscription:
+    """Context manager subscribing to a single channel."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.pubsub = None
+
+    def __enter__(self):
+        try:
+            self.pubsub = get_connection().pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(self.channel)
+        except redis.RedisError as e:
+            logger.warning("Could not subscribe to %s: %s", self.channel, e)
+            self.pubsub = None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.pubsub is not None:
+            self.pubsub.close()
+
+    def wait(self, timeout):
+        """Block until a notification arrives or ``timeout`` seconds pass.
+
+        Returns True if a notification arrived.
+        """
+        deadline = time.monotonic() + timeout
+        if self.pubsub is not None:
+            try:
+                remaining = timeout
+                while remaining > 0:
+                    if self.pubsub.get_message(timeout=remaining):
+                        return True
+                    remaining = deadline - time.monotonic()
+            except redis.RedisError as e:
+                logger.warning("Lost subscription to %s: %s", self.channel, e)
+        # Without Redis, behave like a plain poll of the same length.
+        time.sleep(max(0, deadline - time.monotonic()))
+        return False
+
+
+class WorkSubscription(Subscription):
+    """Subscription to a client's work channel."""
+
+    def __init__(self, client_id):
+        super().__init__(work_channel(client_id))
+
+
+class LogSubscription(Subscription):
+    """Subscription to a deployment status's log channel."""
+
+    def __init__(self, status_id):
+        super().__init__(log_channel(status_id))
@@ -1,29 +1,178 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
-from .models import Deployment, DeploymentStatus
+from .models import AGENT_TRANSITIONS, Deployment, DeploymentStatus
 from packages.models import Package
 from clients.models import Client
+from deployment_backend.caching import invalidate_work
 
 class DeploymentStatusSerializer(serializers.ModelSerializer):
+    # Output written here is appended to the status log; read it back
+    # through the status's logs endpoint.
+    log_output = serializers.CharField(write_only=True, required=False, allow_blank=True,
+                                       trim_whitespace=False)
+
     class Meta:
         model = DeploymentStatus
         fields = ['id', 'client', 'status', 'started_at', 'completed_at',
                  'error_message', 'log_output']
         read_only_fields = ['id', 'started_at', 'completed_at']
 
+    def create(self, validated_data):
+        log_output = validated_data.pop('log_output', '')
+        instance = super().create(validated_data)
+        instance.append_log(log_output)
+        return instance
+
+    def update(self, instance, validated_data):
+        log_output = validated_data.pop('log_output', '')
+        instance = super().update(instance, validated_data)
+        instance.append_log(log_output)
+        return instance
+
+class DeploymentStatusListSerializer(serializers.ModelSerializer):
+    """Status rows for list responses."""
+    class Meta:
+        model = DeploymentStatus
+        fields = ['id', 'deployment', 'client', 'status', 'started_at', 'completed_at',
+                 'error_message']
+        read_only_fields = fields
+
+class PendingWorkSerializer(serializers.ModelSerializer):
+    """Just what an agent needs to start a pending deployment."""
+    package = serializers.IntegerField(source='deployment.package_id', read_only=True)
+    package_name = serializers.CharField(source='deployment.package.name', read_only=True)
+    package_version = serializers.CharField(source='deployment.package.version', read_only=True)
+    checksum = serializers.CharField(source='deployment.package.checksum', read_only=True)
+    size = serializers.IntegerField(source='deployment.package.size', read_only=True)
+
+    class Meta:
+        model = DeploymentStatus
+        fields = ['id', 'deployment', 'package', 'package_name', 'package_version',
+                 'checksum', 'size']
+        read_only_fields = fields
+
+class StatusReportSerializer(serializers.Serializer):
+    """A status change reported by an agent through the sync endpoint."""
+    id = serializers.IntegerField(min_value=1)
+    status = serializers.ChoiceField(choices=list(AGENT_TRANSITIONS))
+    error_message = serializers.CharField(required=False, allow_blank=True)
+    log_output = serializers.CharField(required=False, allow_blank=True, trim_whitespace=False)
+
+class PrestageWorkSerializer(PendingWorkSerializer):
+    """A scheduled deployment whose package an agent should download in advance."""
+    scheduled_for = serializers.DateTimeField(source='deployment.scheduled_for', read_only=True)
+
+    class Meta(PendingWorkSerializer.Meta):
+        fields = PendingWorkSerializer.Meta.fields + ['scheduled_for']
+        read_only_fields = fields
+
+class ClientIdListField(serializers.ListField):
+    """Client ids of a deployment, validated with a single query."""
+    child = serializers.IntegerField(min_value=1)
+
+    def to_internal_value(self, data):
+        client_ids = list(dict.fromkeys(super().to_internal_value(data)))
+        existing = set(Client.objects.filter(id__in=client_ids).values_list('id', flat=True))
+        missing = [client_id for client_id in client_ids if client_id not in existing]
+        if missing:
+            raise serializers.ValidationError(f"Invalid client ids: {missing[:20]}")
+        return client_ids
+
+    def to_representation(self, data):
+        return list(data.values_list('id', flat=True))
+
 class DeploymentSerializer(serializers.ModelSerializer):
+    # Lookups a client_filter may use, mapped to their ORM expressions.
+    CLIENT_FILTER_LOOKUPS = {
+        'os_type': 'os_type',
+        'os_version': 'os_version',
+        'status': 'status',
+        'hostname': 'hostname__icontains',
+        'ip_prefix': 'ip_address__startswith',
+    }
+
     deployment_statuses = DeploymentStatusSerializer(many=True, read_only=True)
     package = serializers.PrimaryKeyRelatedField(queryset=Package.objects.all())
-    clients = serializers.PrimaryKeyRelatedField(many=True, queryset=Client.objects.all())
+    clients = ClientIdListField(required=False)
+    status_counts = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    client_filter = serializers.DictField(
+        child=serializers.CharField(), required=False, write_only=True,
+        help_text="Select clients server-side, e.g. {\"os_type\": \"linux\"}; {} selects all clients"
+    )
 
     class Meta:
         model = Deployment
-        fields = ['id', 'package', 'clients', 'description', 'created_at',
-                 'scheduled_for', 'deployment_statuses']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'package', 'clients', 'client_filter', 'description', 'created_at',
+                 'scheduled_for', 'rollout_waves', 'wave_concurrency', 'failure_threshold',
+                 'current_wave', 'rollout_status', 'status_counts', 'deployment_statuses']
+        read_only_fields = ['id', 'created_at', 'current_wave', 'rollout_status', 'status_counts']
+
+    def validate_client_filter(self, value):
+        unknown = set(value) - set(self.CLIENT_FILTER_LOOKUPS)
+        if unknown:
+            raise serializers.ValidationError(f"Unsupported client filters: {sorted(unknown)}")
+        return value
+
+    def validate(self, attrs):
+        if self.instance is None and ('clients' in attrs) == ('client_filter' in attrs):
+            raise serializers.ValidationError("Provide exactly one of clients or client_filter.")
+        return attrs
+
+    def validate_rollout_waves(self, value):
+        if self.instance is not None and value != self.instance.rollout_waves \
+                and self.instance.deployment_statuses.exists():
+            # Statuses are assigned to waves when the deployment is created.
+            raise serializers.ValidationError("Waves cannot be changed once the deployment has clients.")
+        if not value:
+            return []
+        if not all(isinstance(p, (int, float)) and 0 < p <= 100 for p in value):
+            raise serializers.ValidationError("Each wave must be a percentage between 0 and 100.")
+        if any(a >= b for a, b in zip(value, value[1:])):
+            raise serializers.ValidationError("Wave percentages must be strictly increasing.")
+        if value[-1] != 100:
+            raise serializers.ValidationError("The last wave must release 100% of clients.")
+        return value
 
+    def validate_failure_threshold(self, value):
+        if value is not None and not 0 <= value <= 100:
+            raise serializers.ValidationError("Failure threshold must be a percentage between 0 and 100.")
+        return value
+
+    @transaction.atomic
     def create(self, validated_data):
-        clients = validated_data.pop('clients')
+        client_ids = validated_data.pop('clients', None)
+        client_filter = validated_data.pop('client_filter', None)
+        if client_ids is None:
+            lookups = {self.CLIENT_FILTER_LOOKUPS[key]: value for key, value in client_filter.items()}
+            client_ids = Client.objects.filter(**lookups).order_by('id').values_list('id', flat=True)
+
         deployment = super().create(validated_data)
-        for client in clients:
-            DeploymentStatus.objects.create(deployment=deployment, client=client)
-        return deployment 
\ No newline at end of file
+        statuses = DeploymentStatus.objects.bulk_create(
+            (DeploymentStatus(deployment=deployment, client_id=client_id) for client_id in client_ids),
+            batch_size=settings.DEPLOYMENT_STATUS_BATCH_SIZE
+        )
+        deployment.pending_count = len(statuses)
+        deployment.save(update_fields=['pending_count'])
+        # The post_save signal skips new deployments; their clients may
+        # have an empty work list cached.
+        invalidate_work(status.client_id for status in statuses)
+        if deployment.is_staged:
+            deployment.assign_waves()
+        return deployment
+
+    def update(self, instance, validated_data):
+        # The client set is fixed once a deployment has been created.
+        validated_data.pop('clients', None)
+        validated_data.pop('client_filter', None)
+        return super().update(instance, validated_data)
+
+class DeploymentListSerializer(serializers.ModelSerializer):
+    """Deployment summary with per-status counts instead of nested statuses."""
+    status_counts = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
+    class Meta:
+        model = Deployment
+        fields = ['id', 'package', 'description', 'created_at', 'scheduled_for',
+                 'rollout_waves', 'current_wave', 'rollout_status', 'status_counts']
+        read_only_fields = fields
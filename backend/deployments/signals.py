@@ -0,0 +1,50 @@
+"""Cache invalidation for per-client work lists.
+
+Only the work lists of the clients a change concerns are invalidated.
+Status changes made through transition() and rollout updates invalidate
+the work cache themselves, since queryset updates send no signals. There
+is deliberately no delete receiver for ``DeploymentStatus``: it would make
+Django load every status of a deleted deployment instead of deleting them
+in bulk. Deleting the deployment (or client) invalidates instead.
+
+Deleting a client cascades to its statuses, so the counters of the
+deployments it was part of are rebuilt once it is gone.
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from clients.models import Client
+from deployment_backend.caching import invalidate_work
+from .models import Deployment, DeploymentStatus
+
+
+@receiver(post_save, sender=Deployment)
+def invalidate_deployment_work(sender, instance, created, update_fields=None, **kwargs):
+    # New deployments have no statuses yet (the serializer invalidates once it
+    # creates them), and counter updates change no work.
+    if created or (update_fields and all(field.endswith('_count') for field in update_fields)):
+        return
+    invalidate_work(instance.deployment_statuses.filter(status='pending').values_list('client_id', flat=True))
+
+
+@receiver(pre_delete, sender=Deployment)
+def invalidate_deleted_deployment_work(sender, instance, **kwargs):
+    # Read before the statuses are deleted with the deployment.
+    invalidate_work(instance.deployment_statuses.filter(status='pending').values_list('client_id', flat=True))
+
+
+@receiver(post_save, sender=DeploymentStatus)
+def invalidate_status_work(sender, instance, **kwargs):
+    invalidate_work([instance.client_id])
+
+
+@receiver(pre_delete, sender=Client)
+def remember_client_deployments(sender, instance, **kwargs):
+    instance._deployment_ids = list(
+        DeploymentStatus.objects.filter(client=instance).values_list('deployment_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Client)
+def recount_client_deployments(sender, instance, **kwargs):
+    for deployment in Deployment.objects.filter(id__in=getattr(instance, '_deployment_ids', ())):
+        deployment.recount_statuses()
@@ -1,45 +1,230 @@
-from celery import shared_task
+from celery import shared_task, chain, chord, group
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db.models import Count, Q
 from django.utils import timezone
-from .models import Deployment, DeploymentStatus
+from deployment_backend.caching import invalidate_work
+from .models import Deployment, DeploymentLogChunk, DeploymentStatus
+from .notifications import notify_clients
 import time
 
+logger = get_task_logger(__name__)
+
+
+def _chunks(items, size):
+    """Split a list into consecutive slices of at most ``size`` items."""
+    size = max(1, size)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class InstallCancelled(Exception):
+    """Raised when a status stops being in progress while it is installed."""
+
+
+def _transition(deployment_id, status_id, from_status, to_status, **fields):
+    """Move a status from ``from_status`` to ``to_status``.
+
+    The UPDATE only matches while the row is still in ``from_status``, so a
+    status that was cancelled or claimed by another worker in the meantime
+    is left alone. Returns True if the row was updated.
+    """
+    updated = DeploymentStatus.objects.filter(id=status_id).transition(
+        deployment_id, from_status, to_status, **fields
+    ) == 1
+    if updated:
+        DeploymentStatus.objects.publish_changes(deployment_id, [status_id], to_status, **fields)
+    return updated
+
+
+def _log(status_id, *lines):
+    DeploymentLogChunk.append(status_id, ''.join(f"[{timezone.now()}] {line}\n" for line in lines))
+
+
+def _check_running(status_id):
+    if not DeploymentStatus.objects.filter(id=status_id, status='in_progress').exists():
+        raise InstallCancelled(status_id)
+
+
+def _install(deployment_id, status_id, package_name):
+    """Run the (simulated) installation for a single deployment status.
+
+    Returns False if the status was no longer pending. A status that is
+    cancelled while installing is noticed at the next step and abandoned.
+    """
+    if not _transition(deployment_id, status_id, 'pending', 'in_progress', started_at=timezone.now()):
+        return False
+
+    try:
+        # Simulate installation process
+        time.sleep(5)  # Simulate some work
+        _check_running(status_id)
+
+        # Log the progress
+        _log(status_id, f"Starting installation of {package_name}", "Downloading package...")
+        time.sleep(2)  # Simulate download
+        _check_running(status_id)
+        _log(status_id, "Package downloaded successfully", "Installing package...")
+        time.sleep(3)  # Simulate installation
+        _log(status_id, "Installation completed successfully")
+
+        # Update status to completed
+        _transition(deployment_id, status_id, 'in_progress', 'completed', completed_at=timezone.now())
+
+    except InstallCancelled:
+        logger.info("Installation for status %s stopped: no longer in progress", status_id)
+
+    except Exception as e:
+        # Handle any errors
+        _log(status_id, f"Error: {str(e)}")
+        _transition(deployment_id, status_id, 'in_progress', 'failed',
+                    error_message=str(e), completed_at=timezone.now())
+    return True
+
+
+@shared_task
+def process_deployment(deployment_id, status_ids=None):
+    """Process a deployment job.
+
+    ``status_ids`` limits the run to the given statuses, e.g. the ones
+    ``retry_failed`` just reset to pending.
+
+    With ``DEPLOYMENT_FANOUT_ENABLED`` the pending statuses are split into
+    batches of ``DEPLOYMENT_FANOUT_BATCH_SIZE`` and spread over at most
+    ``DEPLOYMENT_FANOUT_MAX_CONCURRENCY`` parallel lanes (or the deployment's
+    ``wave_concurrency``). Each lane is a chain of batch subtasks, and a chord
+    runs ``finalize_deployment`` once every lane has finished. Otherwise the
+    statuses are processed serially here.
+
+    Staged deployments only dispatch the clients of waves released so far;
+    the first call releases wave 1.
+    """
+    deployment = Deployment.objects.get(id=deployment_id)
+    if deployment.rollout_status == 'halted':
+        return
+    if deployment.is_staged and deployment.current_wave == 0:
+        released = Deployment.objects.filter(id=deployment_id, current_wave=0).update(
+            current_wave=1, rollout_status='running'
+        )
+        deployment.refresh_from_db()
+
+    wave = deployment.current_wave
+    pending = deployment.deployment_statuses.filter(status='pending', wave__lte=wave)
+    if status_ids is not None:
+        pending = pending.filter(id__in=status_ids)
+    # Work lists cached before the deployment was created, became due or
+    # released wave 1 would hide it from the clients woken below.
+    invalidate_work(pending.values_list('client_id', flat=True))
+    # Offline clients keep their pending status and pick the work up
+    # through the work endpoint once they check in again.
+    pending = list(pending.exclude(client__status='offline').order_by('id').values_list('id', 'client_id'))
+    if not pending:
+        return finalize_deployment(deployment_id, wave)
+    status_ids = [status_id for status_id, _ in pending]
+    notify_clients(client_id for _, client_id in pending)
+
+    if not settings.DEPLOYMENT_FANOUT_ENABLED:
+        process_deployment_batch(deployment_id, status_ids)
+        return finalize_deployment(deployment_id, wave)
+
+    concurrency = deployment.wave_concurrency or settings.DEPLOYMENT_FANOUT_MAX_CONCURRENCY
+    batches = _chunks(status_ids, settings.DEPLOYMENT_FANOUT_BATCH_SIZE)
+    lane_count = min(len(batches), max(1, concurrency))
+    lanes = [batches[i::lane_count] for i in range(lane_count)]
+
+    header = group([
+        chain(*[process_deployment_batch.si(deployment_id, batch) for batch in lane])
+        for lane in lanes
+    ])
+    chord(header)(finalize_deployment.si(deployment_id, wave))
+    logger.info(
+        "Deployment %s wave %s fanned out: %d clients in %d batches over %d lanes",
+        deployment_id, wave, len(status_ids), len(batches), lane_count,
+    )
+
+
+def _pending_clients(deployment_id, **wave):
+    """Clients with pending statuses of a deployment in the given waves."""
+    return DeploymentStatus.objects.filter(
+        deployment_id=deployment_id, status='pending', **wave
+    ).values_list('client_id', flat=True)
+
+
 @shared_task
-def process_deployment(deployment_id):
-    """Process a deployment job."""
+def process_deployment_batch(deployment_id, status_ids):
+    """Install a deployment on one batch of clients."""
+    pending_ids = list(
+        DeploymentStatus.objects.filter(id__in=status_ids, status='pending')
+        .exclude(client__status='offline')
+        .values_list('id', flat=True)
+    )
+    if not pending_ids:
+        # Everything in the batch was cancelled or handled elsewhere.
+        return 0
+
+    deployment = Deployment.objects.select_related('package').get(id=deployment_id)
+    processed = 0
+    for status_id in pending_ids:
+        if _install(deployment_id, status_id, deployment.package.name):
+            processed += 1
+    return processed
+
+
+@shared_task
+def finalize_deployment(deployment_id, wave=0):
+    """Report the per-client results once every batch has run.
+
+    For staged deployments this also decides whether the next wave may go
+    out: if the failure rate among finished clients of the wave exceeds
+    ``failure_threshold`` the rollout is halted, otherwise the next wave is
+    released and dispatched.
+    """
     deployment = Deployment.objects.get(id=deployment_id)
-    statuses = deployment.deploymentstatus_set.filter(status='pending')
-
-    for status in statuses:
-        try:
-            # Update status to in progress
-            status.status = 'in_progress'
-            status.started_at = timezone.now()
-            status.save()
-
-            # Simulate installation process
-            time.sleep(5)  # Simulate some work
-            
-            # Log the progress
-            status.log_output += f"[{timezone.now()}] Starting installation of {deployment.package.name}\n"
-            status.log_output += f"[{timezone.now()}] Downloading package...\n"
-            time.sleep(2)  # Simulate download
-            status.log_output += f"[{timezone.now()}] Package downloaded successfully\n"
-            status.log_output += f"[{timezone.now()}] Installing package...\n"
-            time.sleep(3)  # Simulate installation
-            status.log_output += f"[{timezone.now()}] Installation completed successfully\n"
-            
-            # Update status to completed
-            status.status = 'completed'
-            status.completed_at = timezone.now()
-            status.save()
-
-        except Exception as e:
-            # Handle any errors
-            status.status = 'failed'
-            status.error_message = str(e)
-            status.completed_at = timezone.now()
-            status.log_output += f"[{timezone.now()}] Error: {str(e)}\n"
-            status.save()
+    counts = deployment.status_counts
+    logger.info("Deployment %s wave %s finished: %s", deployment_id, wave, counts)
+
+    if deployment.is_staged and deployment.rollout_status == 'running':
+        advance_rollout(deployment, wave)
+    return counts
+
+
+def advance_rollout(deployment, wave):
+    """Release the wave after ``wave``, or halt/complete the rollout."""
+    finished = deployment.deployment_statuses.filter(wave=wave).aggregate(
+        # Pending work of offline clients is picked up whenever they return
+        # and does not hold back the rollout.
+        active=Count('id', filter=Q(status='in_progress')
+                     | (Q(status='pending') & ~Q(client__status='offline'))),
+        completed=Count('id', filter=Q(status='completed')),
+        failed=Count('id', filter=Q(status='failed')),
+    )
+    if finished['active']:
+        # Another dispatch of this wave is still working through its clients.
+        return
+
+    done = finished['completed'] + finished['failed']
+    failure_rate = 100 * finished['failed'] / done if done else 0
+    if deployment.failure_threshold is not None and failure_rate > deployment.failure_threshold:
+        halted = Deployment.objects.filter(id=deployment.id, current_wave=wave).update(rollout_status='halted')
+        if halted:
+            invalidate_work(_pending_clients(deployment.id, wave__lte=wave))
+        logger.warning(
+            "Deployment %s halted after wave %s: failure rate %.1f%% exceeds %.1f%%",
+            deployment.id, wave, failure_rate, deployment.failure_threshold,
+        )
+        return
+
+    if wave >= len(deployment.rollout_waves):
+        Deployment.objects.filter(id=deployment.id, current_wave=wave).update(rollout_status='completed')
+        return
+
+    # Only the first finalizer of a wave may release the next one.
+    released = Deployment.objects.filter(id=deployment.id, current_wave=wave).update(
+        current_wave=wave + 1, rollout_status='running'
+    )
+    if released:
+        invalidate_work(_pending_clients(deployment.id, wave=wave + 1))
+        process_deployment.delay(deployment.id)
+
 
 @shared_task
 def check_scheduled_deployments():
@@ -47,8 +232,8 @@ def check_scheduled_deployments():
     now = timezone.now()
     scheduled_deployments = Deployment.objects.filter(
         scheduled_for__lte=now,
-        deploymentstatus__status='pending'
+        deployment_statuses__status='pending'
     ).distinct()
 
     for deployment in scheduled_deployments:
-        process_deployment.delay(deployment.id) 
\ No newline at end of file
+        process_deployment.delay(deployment.id)
@@ -1,3 +1,544 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+from clients.models import Client
+from deployment_backend.testing import (
+    NO_CACHE, QueryCountMixin, assign_deployment, make_client, make_deployment, make_package,
+)
+from .models import Deployment, DeploymentLogChunk, DeploymentStatus
+from .tasks import _chunks, _install, advance_rollout, process_deployment, process_deployment_batch
+from .views import DeploymentViewSet
 
-# Create your tests here.
+
+class DeploymentQueryCountTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_list(self):
+        self.assertQueryBudget(
+            lambda: self.client.get('/api/deployments/'),
+            lambda: make_deployment(self.user), budget=2,
+        )
+
+    def test_retrieve(self):
+        deployment = make_deployment(self.user)
+        self.assertQueryBudget(
+            lambda: self.client.get(f'/api/deployments/{deployment.id}/'),
+            lambda: DeploymentStatus.objects.create(deployment=deployment, client=make_client()),
+            budget=4,
+        )
+
+    def test_status_list(self):
+        self.assertQueryBudget(
+            lambda: self.client.get('/api/deployment-status/'),
+            lambda: make_deployment(self.user), budget=2,
+        )
+
+    def test_status_logs(self):
+        status = make_deployment(self.user, clients=1).deployment_statuses.get()
+        self.assertQueryBudget(
+            lambda: self.client.get(f'/api/deployment-status/{status.id}/logs/'),
+            lambda: DeploymentLogChunk.objects.create(status=status, content='line\n'),
+            budget=4,
+        )
+
+
+class DeploymentAdminQueryCountTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def test_deployment_changelist(self):
+        self.assertQueryBudget(
+            lambda: self.client.get('/admin/deployments/deployment/'),
+            lambda: make_deployment(self.user), budget=10,
+        )
+
+    def test_status_changelist(self):
+        self.assertQueryBudget(
+            lambda: self.client.get('/admin/deployments/deploymentstatus/'),
+            lambda: make_deployment(self.user), budget=10,
+        )
+
+    def test_deployment_change_form(self):
+        deployment = make_deployment(self.user)
+        self.assertQueryBudget(
+            lambda: self.client.get(f'/admin/deployments/deployment/{deployment.id}/change/'),
+            lambda: DeploymentStatus.objects.create(deployment=deployment, client=make_client()),
+            budget=25,
+        )
+
+
+@mock.patch('deployments.tasks.time.sleep')
+class ProcessDeploymentQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+
+    def test_package_loaded_once_per_batch(self, sleep):
+        deployment = make_deployment(self.user, clients=5)
+        status_ids = list(deployment.deployment_statuses.values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(process_deployment_batch(deployment.id, status_ids), 5)
+        package_queries = [q for q in queries if 'packages_package' in q['sql']]
+        self.assertEqual(len(package_queries), 1)
+
+
+def batches_of(header):
+    """The status id batches of a fan-out chord header, by lane."""
+    lanes = []
+    for lane in header.tasks:
+        tasks = lane.tasks if hasattr(lane, 'tasks') else [lane]
+        lanes.append([task.args[1] for task in tasks])
+    return lanes
+
+
+@mock.patch('deployments.tasks.time.sleep')
+class FanOutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+
+    def test_chunks(self, sleep):
+        self.assertEqual(_chunks([1, 2, 3, 4, 5], 2), [[1, 2], [3, 4], [5]])
+        self.assertEqual(_chunks([1, 2], 0), [[1], [2]])
+
+    @override_settings(DEPLOYMENT_FANOUT_BATCH_SIZE=2, DEPLOYMENT_FANOUT_MAX_CONCURRENCY=2)
+    def test_lanes_cover_every_pending_status_once(self, sleep):
+        deployment = make_deployment(self.user, clients=7)
+        status_ids = sorted(deployment.deployment_statuses.values_list('id', flat=True))
+        with mock.patch('deployments.tasks.chord') as chord:
+            process_deployment(deployment.id)
+        lanes = batches_of(chord.call_args.args[0])
+        self.assertEqual(len(lanes), 2)
+        batches = [batch for lane in lanes for batch in lane]
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+        self.assertEqual(sorted(status_id for batch in batches for status_id in batch), status_ids)
+
+    @override_settings(DEPLOYMENT_FANOUT_BATCH_SIZE=2)
+    def test_wave_concurrency_caps_lanes(self, sleep):
+        deployment = make_deployment(self.user, clients=7, wave_concurrency=1)
+        with mock.patch('deployments.tasks.chord') as chord:
+            process_deployment(deployment.id)
+        self.assertEqual(len(batches_of(chord.call_args.args[0])), 1)
+
+    def test_offline_clients_are_not_dispatched(self, sleep):
+        deployment = make_deployment(self.user, clients=3)
+        offline = deployment.deployment_statuses.first()
+        Client.objects.filter(id=offline.client_id).update(status='offline')
+        with mock.patch('deployments.tasks.chord') as chord:
+            process_deployment(deployment.id)
+        dispatched = [i for lane in batches_of(chord.call_args.args[0]) for batch in lane for i in batch]
+        self.assertEqual(len(dispatched), 2)
+        self.assertNotIn(offline.id, dispatched)
+
+    @override_settings(DEPLOYMENT_FANOUT_ENABLED=False)
+    def test_serial_processing(self, sleep):
+        deployment = make_deployment(self.user, clients=3)
+        process_deployment(deployment.id)
+        deployment.refresh_from_db()
+        self.assertEqual(deployment.completed_count, 3)
+        self.assertEqual(deployment.pending_count, 0)
+
+
+@mock.patch('deployments.views.process_deployment')
+class StagedRolloutTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def create(self, clients, **data):
+        response = self.client.post('/api/deployments/', {
+            'package': make_package().id, 'clients': [make_client().id for _ in range(clients)], **data,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Deployment.objects.get(id=response.data['id'])
+
+    def waves(self, deployment):
+        return list(deployment.deployment_statuses.order_by('wave').values_list('wave').annotate(n=Count('id')))
+
+    def test_waves_split_clients_by_cumulative_percentage(self, process):
+        deployment = self.create(10, rollout_waves=[10, 50, 100])
+        self.assertEqual(self.waves(deployment), [(1, 1), (2, 4), (3, 5)])
+
+    def test_every_wave_gets_a_client_while_any_remain(self, process):
+        deployment = self.create(2, rollout_waves=[1, 10, 100])
+        self.assertEqual(self.waves(deployment), [(1, 1), (2, 1)])
+
+    def test_invalid_waves(self, process):
+        for waves in ([50, 10, 100], [10, 50], [0, 100], [10, 150]):
+            response = self.client.post('/api/deployments/', {
+                'package': make_package().id, 'clients': [make_client().id], 'rollout_waves': waves,
+            }, format='json')
+            self.assertEqual(response.status_code, 400, waves)
+
+    def test_waves_are_fixed_once_created(self, process):
+        deployment = self.create(4, rollout_waves=[50, 100])
+        response = self.client.patch(f'/api/deployments/{deployment.id}/', {'rollout_waves': [25, 100]},
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/deployments/{deployment.id}/', {'description': 'Renamed'},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unreleased_waves_are_not_handed_out(self, process):
+        deployment = self.create(2, rollout_waves=[50, 100])
+        first, second = deployment.deployment_statuses.order_by('wave')
+        Deployment.objects.filter(id=deployment.id).update(current_wave=1, rollout_status='running')
+        self.assertTrue(DeploymentStatus.objects.pending_for_client(first.client_id).exists())
+        self.assertFalse(DeploymentStatus.objects.pending_for_client(second.client_id).exists())
+
+    def test_failures_above_threshold_halt_the_rollout(self, process):
+        deployment = self.create(4, rollout_waves=[50, 100], failure_threshold=40)
+        Deployment.objects.filter(id=deployment.id).update(current_wave=1, rollout_status='running')
+        first_wave = deployment.deployment_statuses.filter(wave=1)
+        first_wave.filter(id=first_wave.first().id).transition(deployment.id, 'pending', 'failed')
+        first_wave.transition(deployment.id, 'pending', 'completed')
+        deployment.refresh_from_db()
+        with mock.patch('deployments.tasks.process_deployment') as dispatch:
+            advance_rollout(deployment, 1)
+        deployment.refresh_from_db()
+        self.assertEqual((deployment.rollout_status, deployment.current_wave), ('halted', 1))
+        dispatch.delay.assert_not_called()
+
+    def test_successful_wave_releases_the_next(self, process):
+        deployment = self.create(4, rollout_waves=[50, 100], failure_threshold=40)
+        Deployment.objects.filter(id=deployment.id).update(current_wave=1, rollout_status='running')
+        deployment.deployment_statuses.filter(wave=1).transition(deployment.id, 'pending', 'completed')
+        deployment.refresh_from_db()
+        with mock.patch('deployments.tasks.process_deployment') as dispatch:
+            advance_rollout(deployment, 1)
+            # A second finalizer of the same wave releases nothing.
+            advance_rollout(deployment, 1)
+        deployment.refresh_from_db()
+        self.assertEqual((deployment.rollout_status, deployment.current_wave), ('running', 2))
+        dispatch.delay.assert_called_once_with(deployment.id)
+
+    def test_resume_dispatches_once(self, process):
+        deployment = self.create(4, rollout_waves=[50, 100])
+        Deployment.objects.filter(id=deployment.id).update(current_wave=1, rollout_status='halted')
+        halted = Deployment.objects.get(id=deployment.id)
+        process.reset_mock()
+        # Two requests that both read the deployment while it was halted.
+        with mock.patch.object(DeploymentViewSet, 'get_object', return_value=halted):
+            first = self.client.post(f'/api/deployments/{deployment.id}/resume/')
+            second = self.client.post(f'/api/deployments/{deployment.id}/resume/')
+        self.assertEqual((first.status_code, second.status_code), (200, 400))
+        process.delay.assert_called_once_with(deployment.id)
+        deployment.refresh_from_db()
+        self.assertEqual((deployment.rollout_status, deployment.current_wave), ('running', 2))
+
+
+class PendingWorkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.agent = make_client()
+
+    def pending(self):
+        return set(DeploymentStatus.objects.pending_for_client(self.agent.id).values_list('id', flat=True))
+
+    def test_only_startable_statuses_are_pending_work(self):
+        now = timezone.now()
+        ready = assign_deployment(self.user, self.agent)
+        due = assign_deployment(self.user, self.agent, scheduled_for=now - timedelta(minutes=1))
+        assign_deployment(self.user, self.agent, scheduled_for=now + timedelta(minutes=1))
+        assign_deployment(self.user, self.agent, rollout_status='halted')
+        started = assign_deployment(self.user, self.agent)
+        DeploymentStatus.objects.filter(id=started.id).transition(started.deployment_id, 'pending', 'in_progress')
+        assign_deployment(self.user, make_client())
+        self.assertEqual(self.pending(), {ready.id, due.id})
+
+    def test_work_lists_the_package_to_fetch(self):
+        status = assign_deployment(self.user, self.agent)
+        package = status.deployment.package
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with override_settings(CACHES=NO_CACHE):
+            work = client.get(f'/api/clients/{self.agent.id}/work/').data
+        self.assertEqual(work, [{
+            'id': status.id, 'deployment': status.deployment_id, 'package': package.id,
+            'package_name': package.name, 'package_version': package.version,
+            'checksum': package.checksum, 'size': package.size,
+        }])
+
+
+@mock.patch('deployments.views.process_deployment')
+class DeploymentCreateTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def create(self, **data):
+        return self.client.post('/api/deployments/', {'package': make_package().id, **data}, format='json')
+
+    def test_client_filter_selects_clients_server_side(self, process):
+        linux = [make_client(), make_client()]
+        make_client(os_type='windows')
+        response = self.create(client_filter={'os_type': 'linux'})
+        self.assertEqual(response.status_code, 201, response.data)
+        deployment = Deployment.objects.get(id=response.data['id'])
+        self.assertEqual(set(deployment.deployment_statuses.values_list('client_id', flat=True)),
+                         {client.id for client in linux})
+        self.assertEqual(deployment.status_counts['pending'], 2)
+        process.delay.assert_called_once_with(deployment.id)
+
+    def test_explicit_clients(self, process):
+        clients = [make_client(), make_client()]
+        response = self.create(clients=[clients[0].id, clients[1].id, clients[0].id])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(sorted(response.data['clients']), sorted(client.id for client in clients))
+        self.assertEqual(response.data['status_counts']['total'], 2)
+
+    def test_invalid_client_selection(self, process):
+        client = make_client()
+        for data in ({}, {'clients': [client.id], 'client_filter': {}}, {'clients': [client.id, 999999]},
+                     {'client_filter': {'owner': 'me'}}):
+            self.assertEqual(self.create(**data).status_code, 400, data)
+        self.assertFalse(Deployment.objects.exists())
+
+
+@mock.patch('deployments.tasks.time.sleep')
+class CancelAndRetryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.deployment = make_deployment(self.user, clients=4)
+        self.statuses = list(self.deployment.deployment_statuses.order_by('id'))
+
+    def move(self, status, to_status):
+        DeploymentStatus.objects.filter(id=status.id).transition(self.deployment.id, 'pending', to_status)
+
+    def test_cancel_stops_pending_and_running_statuses(self, sleep):
+        self.move(self.statuses[0], 'in_progress')
+        self.move(self.statuses[1], 'completed')
+        response = self.client.post(f'/api/deployments/{self.deployment.id}/cancel/')
+        self.assertEqual(response.data['cancelled'], 3)
+        self.deployment.refresh_from_db()
+        self.assertEqual(self.deployment.status_counts, {
+            'pending': 0, 'in_progress': 0, 'completed': 1, 'failed': 0, 'cancelled': 3, 'total': 4,
+        })
+
+    @mock.patch('deployments.models.notify_deployment')
+    def test_cancel_publishes_the_cancelled_statuses(self, notify, sleep):
+        self.move(self.statuses[0], 'in_progress')
+        self.move(self.statuses[1], 'completed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/deployments/{self.deployment.id}/cancel/')
+        events = [call.args[1] for call in notify.call_args_list if call.args[1]['type'] == 'statuses']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(sorted(change['id'] for change in events[0]['statuses']),
+                         [self.statuses[0].id, self.statuses[2].id, self.statuses[3].id])
+        self.assertEqual({change['status'] for change in events[0]['statuses']}, {'cancelled'})
+
+    @mock.patch('deployments.models.notify_deployment')
+    def test_status_updates_publish_the_change(self, notify, sleep):
+        status = self.statuses[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/deployment-status/{status.id}/', {'status': 'failed', 'error_message': 'boom'})
+        notify.assert_any_call(self.deployment.id, {
+            'type': 'statuses', 'statuses': [{'id': status.id, 'status': 'failed', 'error_message': 'boom'}],
+        })
+
+    def test_retry_failed_resets_only_failed_statuses(self, sleep):
+        self.move(self.statuses[0], 'failed')
+        self.move(self.statuses[1], 'failed')
+        self.move(self.statuses[2], 'completed')
+        with mock.patch('deployments.views.process_deployment') as process:
+            response = self.client.post(f'/api/deployments/{self.deployment.id}/retry_failed/')
+        self.assertEqual(response.data['retried'], 2)
+        process.delay.assert_called_once_with(
+            self.deployment.id, status_ids=[self.statuses[0].id, self.statuses[1].id]
+        )
+        self.deployment.refresh_from_db()
+        self.assertEqual((self.deployment.pending_count, self.deployment.failed_count), (3, 0))
+
+    def test_install_stops_once_cancelled(self, sleep):
+        status = self.statuses[0]
+
+        def cancel(seconds):
+            DeploymentStatus.objects.filter(id=status.id).transition(self.deployment.id, 'in_progress', 'cancelled')
+        sleep.side_effect = cancel
+        self.assertTrue(_install(self.deployment.id, status.id, 'package'))
+        status.refresh_from_db()
+        self.assertEqual(status.status, 'cancelled')
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_claimed_statuses_are_not_installed_twice(self, sleep):
+        self.move(self.statuses[0], 'in_progress')
+        self.assertFalse(_install(self.deployment.id, self.statuses[0].id, 'package'))
+        sleep.assert_not_called()
+
+
+class DeploymentListTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_list_carries_counts_instead_of_statuses(self):
+        make_deployment(self.user, clients=3)
+        page = self.client.get('/api/deployments/').data
+        self.assertIsNone(page['next'])
+        deployment = page['results'][0]
+        self.assertNotIn('deployment_statuses', deployment)
+        self.assertEqual(deployment['status_counts']['pending'], 3)
+
+    def test_summary(self):
+        make_deployment(self.user)
+        make_deployment(self.user, rollout_status='halted')
+        self.assertEqual(self.client.get('/api/deployments/summary/').data,
+                         {'pending': 1, 'running': 0, 'halted': 1, 'completed': 0, 'total': 2})
+
+
+class StatusCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.deployment = make_deployment(self.user, clients=3)
+        self.statuses = list(self.deployment.deployment_statuses.order_by('id'))
+
+    def counts(self, deployment=None):
+        deployment = deployment or self.deployment
+        deployment.refresh_from_db()
+        return deployment.status_counts
+
+    def test_created_statuses_are_counted(self):
+        self.assertEqual(self.counts()['pending'], 3)
+        self.assertEqual(self.counts()['total'], 3)
+
+    def test_transition_moves_counts(self):
+        DeploymentStatus.objects.filter(id=self.statuses[0].id).transition(
+            self.deployment.id, 'pending', 'in_progress'
+        )
+        # A second transition from the old state matches nothing.
+        DeploymentStatus.objects.filter(id=self.statuses[0].id).transition(
+            self.deployment.id, 'pending', 'in_progress'
+        )
+        counts = self.counts()
+        self.assertEqual((counts['pending'], counts['in_progress']), (2, 1))
+
+    def test_deleting_a_client_recounts_its_deployments(self):
+        other = make_deployment(self.user, clients=0)
+        DeploymentStatus.objects.create(deployment=other, client=self.statuses[0].client)
+        self.statuses[0].client.delete()
+        self.assertEqual(self.counts()['pending'], 2)
+        self.assertEqual(self.counts(other)['total'], 0)
+
+    def test_admin_bulk_delete_recounts(self):
+        self.client.force_login(self.user)
+        self.client.post('/admin/deployments/deploymentstatus/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': [status.id for status in self.statuses[:2]],
+        })
+        self.assertEqual(DeploymentStatus.objects.count(), 1)
+        self.assertEqual(self.counts()['pending'], 1)
+
+    def test_admin_client_bulk_delete_recounts(self):
+        self.client.force_login(self.user)
+        self.client.post('/admin/clients/client/', {
+            'action': 'delete_selected', 'post': 'yes',
+            '_selected_action': [status.client_id for status in self.statuses[:2]],
+        })
+        self.assertEqual(self.counts()['pending'], 1)
+
+
+@override_settings(CACHES=NO_CACHE)
+class DeploymentLogTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.status = assign_deployment(self.user, make_client())
+        self.url = f'/api/deployment-status/{self.status.id}/logs/'
+
+    def test_reads_continue_from_the_returned_offset(self):
+        self.status.append_log('one\n')
+        self.status.append_log('two\n')
+        first = self.client.get(self.url).data
+        self.assertEqual(first['content'], 'one\ntwo\n')
+        self.assertFalse(first['more'])
+        self.assertFalse(first['finished'])
+
+        self.status.append_log('three\n')
+        second = self.client.get(self.url, {'offset': first['offset']}).data
+        self.assertEqual(second['content'], 'three\n')
+        self.assertEqual(self.client.get(self.url, {'offset': second['offset']}).data['content'], '')
+
+    @override_settings(DEPLOYMENT_LOG_READ_CHUNKS=2)
+    def test_long_logs_are_read_in_pages(self):
+        for line in 'abc':
+            self.status.append_log(line)
+        first = self.client.get(self.url).data
+        self.assertEqual((first['content'], first['more']), ('ab', True))
+        second = self.client.get(self.url, {'offset': first['offset']}).data
+        self.assertEqual((second['content'], second['more']), ('c', False))
+
+    def test_updates_append_log_output(self):
+        self.client.patch(f'/api/deployment-status/{self.status.id}/',
+                          {'status': 'failed', 'log_output': 'boom\n'}, format='json')
+        self.client.patch(f'/api/deployment-status/{self.status.id}/', {'log_output': ''}, format='json')
+        data = self.client.get(self.url, {'follow': 5}).data
+        self.assertEqual(data['content'], 'boom\n')
+        self.assertTrue(data['finished'])
+        self.assertEqual(DeploymentLogChunk.objects.count(), 1)
+
+    def test_append_many_skips_empty_output(self):
+        other = assign_deployment(self.user, make_client())
+        chunks = DeploymentLogChunk.append_many([(self.status.id, 'x'), (other.id, '')])
+        self.assertEqual([chunk.status_id for chunk in chunks], [self.status.id])
+
+    def test_invalid_offset(self):
+        self.assertEqual(self.client.get(self.url, {'offset': 'abc'}).status_code, 400)
+
+
+@override_settings(CACHES=NO_CACHE, DEPLOYMENT_EVENTS_MAX_AGE=0)
+class DeploymentEventsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.deployment = make_deployment(self.user)
+        self.url = f'/api/deployments/{self.deployment.id}/events/'
+
+    def ticket(self, deployment=None):
+        self.client.force_authenticate(self.user)
+        deployment = deployment or self.deployment
+        response = self.client.post(f'/api/deployments/{deployment.id}/events/ticket/')
+        self.client.force_authenticate(None)
+        return response.data['ticket']
+
+    async def read(self, data=None, **headers):
+        # Streams are async iterators; read them like the ASGI server would.
+        response = await self.async_client.get(self.url, data, **headers)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        return response, content.decode()
+
+    async def test_stream_opens_with_a_ticket(self):
+        ticket = await sync_to_async(self.ticket)()
+        response, content = await self.read({'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('"type": "snapshot"', content)
+        self.assertIn('"pending": 2', content)
+
+    def test_ticket_is_for_one_deployment(self):
+        other = make_deployment(self.user)
+        self.assertEqual(self.client.get(self.url, {'ticket': self.ticket(other)}).status_code, 401)
+
+    def test_expired_or_forged_tickets(self):
+        ticket = self.ticket()
+        with override_settings(DEPLOYMENT_EVENTS_TICKET_MAX_AGE=-1):
+            self.assertEqual(self.client.get(self.url, {'ticket': ticket}).status_code, 401)
+        self.assertEqual(self.client.get(self.url, {'ticket': ticket + 'x'}).status_code, 401)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url, {'ticket': ticket}).status_code, 401)
+
+    async def test_api_tokens_are_not_accepted_in_the_url(self):
+        token = await sync_to_async(Token.objects.create)(user=self.user)
+        response = await self.async_client.get(self.url, {'token': token.key})
+        self.assertEqual(response.status_code, 401)
+        response, _ = await self.read(AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 200)
@@ -3,9 +3,18 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
-from .models import Deployment, DeploymentStatus
-from .serializers import DeploymentSerializer, DeploymentStatusSerializer
+from deployment_backend.caching import invalidate_work
+from .events import issue_ticket
+from .models import Deployment, DeploymentLogChunk, DeploymentStatus
+from .notifications import LogSubscription
+from .serializers import (
+    DeploymentSerializer, DeploymentListSerializer,
+    DeploymentStatusSerializer, DeploymentStatusListSerializer,
+)
 from .tasks import process_deployment
 
 # Create your views here.
@@ -16,9 +25,22 @@ class DeploymentViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['package__name', 'description', 'created_by__username']
-    ordering_fields = ['created_at', 'scheduled_for']
+    ordering_fields = ['created_at']
     ordering = ['-created_at']
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DeploymentListSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Number of deployments in each rollout status."""
+        counts = dict(Deployment.objects.order_by().values_list('rollout_status').annotate(total=Count('id')))
+        summary = {status: counts.get(status, 0) for status, _ in Deployment.ROLLOUT_STATUS_CHOICES}
+        summary['total'] = sum(summary.values())
+        return Response(summary)
+
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
         deployment = serializer.instance
@@ -28,31 +50,148 @@ class DeploymentViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         deployment = self.get_object()
-        for status in deployment.deployment_statuses.filter(status__in=['pending', 'in_progress']):
-            status.status = 'cancelled'
-            status.save()
-        return Response({'status': 'success'})
+        # Running installs notice the cancellation at their next step and
+        # queued batch subtasks find nothing left to claim.
+        now = timezone.now()
+        with transaction.atomic():
+            cancelled = sum(
+                DeploymentStatus.objects.transition(deployment.id, from_status, 'cancelled', completed_at=now)
+                for from_status in ('pending', 'in_progress')
+            )
+            if cancelled:
+                # The statuses this request cancelled carry its timestamp.
+                cancelled_ids = list(
+                    deployment.deployment_statuses.filter(status='cancelled', completed_at=now)
+                    .values_list('id', flat=True)
+                )
+                DeploymentStatus.objects.publish_changes(
+                    deployment.id, cancelled_ids, 'cancelled', completed_at=now
+                )
+        return Response({'status': 'success', 'cancelled': cancelled})
 
     @action(detail=True, methods=['post'])
     def retry_failed(self, request, pk=None):
         deployment = self.get_object()
-        for status in deployment.deployment_statuses.filter(status='failed'):
-            status.status = 'pending'
-            status.save()
+        failed_ids = list(deployment.deployment_statuses.filter(status='failed').values_list('id', flat=True))
+        retried = DeploymentStatus.objects.filter(id__in=failed_ids).transition(
+            deployment.id, 'failed', 'pending', started_at=None, completed_at=None, error_message=''
+        )
+        if retried:
+            process_deployment.delay(deployment.id, status_ids=failed_ids)
+        return Response({'status': 'success', 'retried': retried})
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        deployment = self.get_object()
+        if deployment.rollout_status != 'halted':
+            return Response({'status': 'error', 'message': 'Rollout is not halted'}, status=400)
+        if deployment.current_wave >= len(deployment.rollout_waves):
+            return Response({'status': 'error', 'message': 'No waves left to release'}, status=400)
+        # Only the request that actually moves the rollout on may dispatch it.
+        resumed = Deployment.objects.filter(
+            id=deployment.id, rollout_status='halted', current_wave=deployment.current_wave
+        ).update(current_wave=deployment.current_wave + 1, rollout_status='running')
+        if not resumed:
+            return Response({'status': 'error', 'message': 'Rollout is not halted'}, status=400)
+        invalidate_work(
+            deployment.deployment_statuses.filter(status='pending', wave__lte=deployment.current_wave + 1)
+            .values_list('client_id', flat=True)
+        )
+        process_deployment.delay(deployment.id)
         return Response({'status': 'success'})
 
+    @action(detail=True, methods=['post'], url_path='events/ticket')
+    def events_ticket(self, request, pk=None):
+        """A short-lived ticket for opening this deployment's event stream (see ``deployments.events``)."""
+        deployment = self.get_object()
+        return Response({'ticket': issue_ticket(request.user, deployment.id)})
+
 class DeploymentStatusViewSet(viewsets.ModelViewSet):
     queryset = DeploymentStatus.objects.all()
     serializer_class = DeploymentStatusSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['status', 'client__hostname', 'deployment__package__name']
-    ordering_fields = ['started_at', 'completed_at']
-    ordering = ['-started_at']
+    # started_at/completed_at are nullable and cannot back a pagination cursor.
+    ordering_fields = ['id']
+    ordering = ['-id']
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return DeploymentStatusListSerializer
+        return super().get_serializer_class()
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            # Lock the row so the counter adjustment matches the status
+            # that is actually replaced.
+            previous = DeploymentStatus.objects.select_for_update().values_list(
+                'status', flat=True
+            ).get(id=serializer.instance.id)
+            instance = serializer.save()
+            if instance.status != previous:
+                Deployment.adjust_status_counts(instance.deployment_id, {previous: -1, instance.status: 1})
+                DeploymentStatus.objects.publish_changes(
+                    instance.deployment_id, [instance.id], instance.status, error_message=instance.error_message
+                )
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            Deployment.adjust_status_counts(instance.deployment_id, {instance.status: -1})
+            invalidate_work([instance.client_id])
+
+    @action(detail=True, methods=['get'])
+    def logs(self, request, pk=None):
+        """Read a status log from ``?offset=`` onwards.
+
+        ``offset`` is the value returned by the previous read (0 for the
+        beginning of the log). With ``?follow=<seconds>`` a read that finds
+        no new output on an unfinished status waits for more to be appended,
+        like ``tail -f``.
+        """
+        status_id = self.get_object().id
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            follow = min(max(float(request.query_params.get('follow', 0)), 0),
+                         settings.DEPLOYMENT_LOG_FOLLOW_MAX_WAIT)
+        except ValueError:
+            return Response({'status': 'error', 'message': 'Invalid offset or follow'}, status=400)
+
+        limit = settings.DEPLOYMENT_LOG_READ_CHUNKS
+
+        def read():
+            chunks = list(
+                DeploymentLogChunk.objects.filter(status_id=status_id, id__gt=offset)
+                .values_list('id', 'content')[:limit]
+            )
+            state = DeploymentStatus.objects.filter(id=status_id).values_list('status', flat=True).get()
+            return chunks, state in ('completed', 'failed', 'cancelled')
+
+        if follow:
+            with LogSubscription(status_id) as subscription:
+                chunks, finished = read()
+                if not chunks and not finished and subscription.wait(follow):
+                    chunks, finished = read()
+        else:
+            chunks, finished = read()
+
+        return Response({
+            'offset': chunks[-1][0] if chunks else offset,
+            'content': ''.join(content for _, content in chunks),
+            'more': len(chunks) == limit,
+            'finished': finished,
+        })
 
     def get_queryset(self):
         queryset = super().get_queryset()
         deployment_id = self.request.query_params.get('deployment', None)
         if deployment_id:
             queryset = queryset.filter(deployment_id=deployment_id)
+        client_id = self.request.query_params.get('client', None)
+        if client_id:
+            queryset = queryset.filter(client_id=client_id)
+        status = self.request.query_params.get('status', None)
+        if status:
+            queryset = queryset.filter(status=status)
         return queryset
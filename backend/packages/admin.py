@@ -1,9 +1,23 @@
+from collections import Counter
 from django.contrib import admin
-from .models import Package
+from .models import Package, PackageBlob
 
 @admin.register(Package)
 class PackageAdmin(admin.ModelAdmin):
     list_display = ('name', 'version', 'os_compatibility', 'size', 'created_at', 'is_active')
     list_filter = ('os_compatibility', 'is_active')
-    search_fields = ('name', 'version', 'description')
-    readonly_fields = ('size', 'created_at')
+    search_fields = ('name', 'version', 'description', 'checksum')
+    readonly_fields = ('filename', 'checksum', 'size', 'blob', 'created_at')
+
+    def delete_queryset(self, request, queryset):
+        # Bulk deletes bypass Package.delete, so release the blob references here.
+        refs = Counter(queryset.exclude(blob=None).values_list('blob_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for blob_id, count in refs.items():
+            PackageBlob.adjust_refs(blob_id, -count)
+
+@admin.register(PackageBlob)
+class PackageBlobAdmin(admin.ModelAdmin):
+    list_display = ('checksum', 'size', 'ref_count', 'created_at')
+    search_fields = ('checksum',)
+    readonly_fields = ('checksum', 'file', 'size', 'ref_count', 'created_at')
@@ -0,0 +1,139 @@
+"""rsync-style binary deltas between two versions of a package file.
+
+The old file is split into fixed-size blocks indexed by a weak rolling
+checksum (Adler-32) and a strong hash. The new file is scanned with the
+rolling checksum; every window that matches an old block becomes a copy
+instruction and everything else is sent literally. Whole blocks are
+checksummed with ``zlib.adler32`` and hashed natively, and matching jumps
+a whole block at a time, so incremental releases are scanned in roughly
+``size / block_size`` steps. Only unmatched bytes are rolled over one at
+a time in Python, which is why the size of files that get deltas is
+capped (``PACKAGE_DELTA_MAX_FILE_SIZE``).
+
+Delta format: ``MAGIC`` followed by operations, each either
+``b'C' + offset (u64) + length (u32)`` to copy bytes of the old file or
+``b'L' + length (u32) + data`` for literal bytes.
+"""
+import hashlib
+import struct
+import zlib
+
+MAGIC = b'PDELTA1\n'
+COPY = b'C'
+LITERAL = b'L'
+COPY_STRUCT = struct.Struct('>QI')
+LENGTH_STRUCT = struct.Struct('>I')
+# Adler-32 sums are taken modulo the largest prime below 2 ** 16.
+MOD = 65521
+
+
+class DeltaTooLarge(Exception):
+    """Raised when a delta would not be meaningfully smaller than the file."""
+
+
+def _weak(data):
+    checksum = zlib.adler32(data)
+    return checksum & 0xffff, checksum >> 16
+
+
+def _strong(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def signature(old, block_size):
+    """Map weak checksum -> {strong hash: block offset} for the blocks of ``old``."""
+    blocks = {}
+    for offset in range(0, len(old) - block_size + 1, block_size):
+        block = old[offset:offset + block_size]
+        a, b = _weak(block)
+        blocks.setdefault(a | (b << 16), {}).setdefault(_strong(block), offset)
+    return blocks
+
+
+class _Writer:
+    def __init__(self, out, limit):
+        self.out = out
+        self.limit = limit
+        self.size = 0
+        self.copy = None
+
+    def _write(self, data):
+        self.size += len(data)
+        if self.limit is not None and self.size > self.limit:
+            raise DeltaTooLarge(self.size)
+        self.out.write(data)
+
+    def add_copy(self, offset, length):
+        if self.copy and self.copy[0] + self.copy[1] == offset:
+            self.copy[1] += length
+        else:
+            self.flush()
+            self.copy = [offset, length]
+
+    def add_literal(self, data):
+        if data:
+            self.flush()
+            self._write(LITERAL + LENGTH_STRUCT.pack(len(data)) + data)
+
+    def flush(self):
+        if self.copy:
+            self._write(COPY + COPY_STRUCT.pack(*self.copy))
+            self.copy = None
+
+
+def make_delta(old, new, out, block_size=4096, max_size=None):
+    """Write a delta turning bytes ``old`` into bytes ``new`` to ``out``.
+
+    Raises DeltaTooLarge once more than ``max_size`` bytes were written.
+    Returns the size of the delta.
+    """
+    writer = _Writer(out, max_size)
+    writer._write(MAGIC)
+    blocks = signature(old, block_size)
+    n = len(new)
+    literal_start = 0
+    i = 0
+    a = b = None
+    while i + block_size <= n:
+        if a is None:
+            a, b = _weak(new[i:i + block_size])
+        candidates = blocks.get(a | (b << 16))
+        offset = candidates and candidates.get(_strong(new[i:i + block_size]))
+        if offset is not None:
+            writer.add_literal(new[literal_start:i])
+            writer.add_copy(offset, block_size)
+            i += block_size
+            literal_start = i
+            a = None
+            continue
+        # Roll the window one byte forward.
+        if i + block_size < n:
+            out_byte, in_byte = new[i], new[i + block_size]
+            a = (a - out_byte + in_byte) % MOD
+            b = (b - block_size * out_byte + a - 1) % MOD
+        i += 1
+        if i - literal_start >= 1 << 20:
+            writer.add_literal(new[literal_start:i])
+            literal_start = i
+    writer.add_literal(new[literal_start:])
+    writer.flush()
+    return writer.size
+
+
+def apply_delta(old, delta, out):
+    """Rebuild the new file from file-like ``old`` and ``delta`` into ``out``."""
+    if delta.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a package delta")
+    while True:
+        op = delta.read(1)
+        if not op:
+            return
+        if op == COPY:
+            offset, length = COPY_STRUCT.unpack(delta.read(COPY_STRUCT.size))
+            old.seek(offset)
+            out.write(old.read(length))
+        elif op == LITERAL:
+            (length,) = LENGTH_STRUCT.unpack(delta.read(LENGTH_STRUCT.size))
+            out.write(delta.read(length))
+        else:
+            raise ValueError(f"Unknown delta operation {op!r}")
@@ -0,0 +1,108 @@
+"""Streaming package downloads with HTTP Range and ETag support.
+
+Whole-file responses hand the open file to the WSGI server, which can
+send it with ``sendfile`` (zero-copy). Single byte ranges are served from
+a bounded reader that still exposes the underlying file descriptor,
+already positioned at the start of the range, so servers such as
+gunicorn can use ``sendfile`` for ranged responses as well. The package
+checksum is used as a strong ETag.
+"""
+import os
+import re
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """Parse a single-range ``Range`` header into inclusive ``(start, end)``.
+
+    Returns None for headers this module does not serve as a range (missing,
+    malformed or multi-range), and raises ValueError for a range that cannot
+    be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFile:
+    """File-like view of ``length`` bytes of ``file`` starting at ``start``."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def etag_matches(header, etag):
+    return header is not None and (header.strip() == '*' or etag in [t.strip() for t in header.split(',')])
+
+
+def package_file_response(request, package):
+    """Serve ``package.file`` under the name it was uploaded with."""
+    filename = package.filename or os.path.basename(package.file.name)
+    return file_response(request, package.file, package.checksum, filename)
+
+
+def file_response(request, fieldfile, checksum, filename):
+    """Serve ``fieldfile``, honouring Range, If-Range and If-None-Match."""
+    etag = f'"{checksum}"'
+    if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    file = fieldfile.open('rb')
+    size = fieldfile.size
+
+    byte_range = None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is None or if_range.strip() == etag:
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=True, filename=filename)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(RangeFile(file, start, length), status=206,
+                                as_attachment=True, filename=filename)
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
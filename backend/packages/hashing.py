@@ -0,0 +1,54 @@
+"""Whole-file and per-chunk SHA-256 digests computed in a single pass."""
+import hashlib
+from django.conf import settings
+
+
+class ContentHasher:
+    """Hash a file incrementally as its data goes by.
+
+    Besides the digest of the whole file, ``chunk_hashes`` collects the
+    digests of consecutive ``PACKAGE_CHUNK_SIZE`` pieces. They form the
+    manifest agents use to verify chunks fetched from peers.
+    """
+
+    def __init__(self, chunk_size=None):
+        self.chunk_size = chunk_size or settings.PACKAGE_CHUNK_SIZE
+        self.sha256 = hashlib.sha256()
+        self.chunk_hashes = []
+        self._chunk = hashlib.sha256()
+        self._chunk_length = 0
+
+    @classmethod
+    def of_file(cls, file):
+        """Hash a Django ``File`` and rewind it."""
+        hasher = cls()
+        file.seek(0)
+        for block in file.chunks():
+            hasher.update(block)
+        file.seek(0)
+        return hasher.finish()
+
+    def update(self, data):
+        self.sha256.update(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.chunk_size - self._chunk_length)
+            self._chunk.update(view[:take])
+            self._chunk_length += take
+            view = view[take:]
+            if self._chunk_length == self.chunk_size:
+                self._end_chunk()
+
+    def _end_chunk(self):
+        self.chunk_hashes.append(self._chunk.hexdigest())
+        self._chunk = hashlib.sha256()
+        self._chunk_length = 0
+
+    def finish(self):
+        """Close the trailing partial chunk; call once all data was added."""
+        if self._chunk_length:
+            self._end_chunk()
+        return self
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
@@ -0,0 +1,58 @@
+# Generated by Django 4.2 on 2026-10-18 15:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import os
+import packages.models
+
+
+def create_blobs(apps, schema_editor):
+    """Point existing packages at one blob per distinct checksum.
+
+    The first package's file becomes the blob file; files of duplicates are
+    no longer referenced but are left on disk.
+    """
+    Package = apps.get_model('packages', 'Package')
+    PackageBlob = apps.get_model('packages', 'PackageBlob')
+    for package in Package.objects.exclude(checksum='').order_by('id').iterator():
+        blob, created = PackageBlob.objects.get_or_create(
+            checksum=package.checksum,
+            defaults={'file': package.file.name, 'size': package.size},
+        )
+        blob.ref_count += 1
+        blob.save(update_fields=['ref_count'])
+        Package.objects.filter(id=package.id).update(
+            blob=blob, file=blob.file.name, filename=os.path.basename(package.file.name),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to=packages.models.blob_path)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='filename',
+            field=models.CharField(blank=True, help_text='Original name of the uploaded file', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='package',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='packages', to='packages.packageblob'),
+        ),
+        migrations.RunPython(create_blobs, migrations.RunPython.noop),
+    ]
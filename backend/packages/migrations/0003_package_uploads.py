@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0002_package_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('version', models.CharField(max_length=50)),
+                ('description', models.TextField(blank=True)),
+                ('os_compatibility', models.CharField(choices=[('windows', 'Windows'), ('linux', 'Linux'), ('macos', 'macOS')], max_length=10)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(help_text='Total size of the file in bytes')),
+                ('checksum', models.CharField(blank=True, help_text='Expected SHA-256, verified on completion', max_length=64)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 15:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0003_package_uploads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='deltas/')),
+                ('size', models.BigIntegerField(default=0)),
+                ('checksum', models.CharField(help_text='SHA-256 checksum of the delta file', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deltas_from', to='packages.packageblob')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deltas_to', to='packages.packageblob')),
+            ],
+            options={
+                'unique_together': {('source', 'target')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-18 15:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0002_client_status_last_seen_index'),
+        ('packages', '0004_package_deltas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packageblob',
+            name='chunk_hashes',
+            field=models.JSONField(blank=True, default=list, help_text='SHA-256 of each chunk, in order'),
+        ),
+        migrations.AddField(
+            model_name='packageblob',
+            name='chunk_size',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PackagePeer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('port', models.PositiveIntegerField(help_text="Port of the agent's chunk server")),
+                ('chunks', models.JSONField(default=list, help_text='Indexes of the chunks the agent holds')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='peers', to='packages.packageblob')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='package_chunks', to='clients.client')),
+            ],
+            options={
+                'unique_together': {('client', 'blob')},
+            },
+        ),
+    ]
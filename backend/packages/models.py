@@ -1,6 +1,85 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.core.validators import FileExtensionValidator
 from clients.models import Client
+from .hashing import ContentHasher
+import os
+
+PACKAGE_EXTENSIONS = ['zip', 'exe', 'msi', 'deb', 'rpm', 'dmg']
+
+
+def blob_path(instance, filename):
+    """Store blobs under their checksum, fanned out by its first two characters."""
+    return f'blobs/{instance.checksum[:2]}/{instance.checksum}'
+
+
+class PackageBlob(models.Model):
+    """A package file stored once per distinct content (SHA-256).
+
+    ``ref_count`` is the number of packages that point at the blob. Blobs
+    that are no longer referenced are removed by ``collect_package_blobs``.
+    """
+    checksum = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_path)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    chunk_size = models.PositiveIntegerField(default=0)
+    chunk_hashes = models.JSONField(default=list, blank=True, help_text="SHA-256 of each chunk, in order")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.checksum
+
+    @property
+    def has_manifest(self):
+        """Whether the chunk hashes are there and for the current chunk size."""
+        return self.chunk_size == settings.PACKAGE_CHUNK_SIZE and bool(self.chunk_hashes or not self.size)
+
+    def ensure_manifest(self):
+        """Compute the chunk hashes if they are missing or for another chunk size.
+
+        This reads the whole file; requests leave it to ``build_blob_manifest``.
+        """
+        if self.has_manifest:
+            return
+        with self.file.open('rb') as file:
+            hasher = ContentHasher.of_file(file)
+        self.chunk_size = hasher.chunk_size
+        self.chunk_hashes = hasher.chunk_hashes
+        self.save(update_fields=['chunk_size', 'chunk_hashes'])
+
+    @classmethod
+    def store(cls, file, checksum, chunk_hashes=None):
+        """Return the blob for ``checksum``, writing ``file`` only if it is new.
+
+        Files that live in a temporary file on the same filesystem (large
+        uploads) are moved into place rather than copied.
+        """
+        blob = cls.objects.filter(checksum=checksum).first()
+        if blob is not None:
+            return blob
+        blob = cls(checksum=checksum, size=file.size)
+        if chunk_hashes is not None:
+            blob.chunk_size = settings.PACKAGE_CHUNK_SIZE
+            blob.chunk_hashes = chunk_hashes
+        blob.file.save(checksum, file, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # Lost a race with a concurrent upload of the same content.
+            blob.file.delete(save=False)
+            blob = cls.objects.filter(checksum=checksum).first()
+            if blob is None:
+                raise
+        return blob
+
+    @classmethod
+    def adjust_refs(cls, blob_id, delta):
+        if blob_id is not None:
+            cls.objects.filter(id=blob_id).update(ref_count=F('ref_count') + delta)
+
 
 class Package(models.Model):
     name = models.CharField(max_length=100)
@@ -8,8 +87,10 @@ class Package(models.Model):
     description = models.TextField(blank=True)
     file = models.FileField(
         upload_to='packages/',
-        validators=[FileExtensionValidator(allowed_extensions=['zip', 'exe', 'msi', 'deb', 'rpm', 'dmg'])]
+        validators=[FileExtensionValidator(allowed_extensions=PACKAGE_EXTENSIONS)]
     )
+    filename = models.CharField(max_length=255, blank=True, help_text="Original name of the uploaded file")
+    blob = models.ForeignKey(PackageBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='packages')
     os_compatibility = models.CharField(max_length=10, choices=Client.OS_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -24,7 +105,101 @@ class Package(models.Model):
     def __str__(self):
         return f"{self.name} - {self.version}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'blob_id' in field_names:
+            instance._stored_blob_id = instance.blob_id
+        return instance
+
     def save(self, *args, **kwargs):
-        if self.file:
-            self.size = self.file.size
-        super().save(*args, **kwargs)
+        if self.file and not self.file._committed:
+            # A new upload: point the package at the blob for its content
+            # instead of storing another copy under packages/.
+            upload = self.file.file
+            self.filename = os.path.basename(upload.name)
+            # The hashing upload handlers already computed the digests.
+            if not hasattr(upload, 'sha256'):
+                hasher = ContentHasher.of_file(upload)
+                upload.sha256, upload.chunk_hashes = hasher.hexdigest(), hasher.chunk_hashes
+            self.checksum = upload.sha256
+            self.blob = PackageBlob.store(upload, self.checksum, upload.chunk_hashes)
+            self.file = self.blob.file.name
+            self.size = self.blob.size
+
+        if hasattr(self, '_stored_blob_id') or self._state.adding:
+            previous_blob_id = getattr(self, '_stored_blob_id', None)
+        else:
+            previous_blob_id = Package.objects.filter(pk=self.pk).values_list('blob_id', flat=True).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.blob_id != previous_blob_id:
+                PackageBlob.adjust_refs(previous_blob_id, -1)
+                PackageBlob.adjust_refs(self.blob_id, 1)
+        self._stored_blob_id = self.blob_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            PackageBlob.adjust_refs(self.blob_id, -1)
+        return result
+
+
+class PackageDelta(models.Model):
+    """A binary delta that rebuilds ``target`` from ``source`` (see ``packages.delta``)."""
+    source = models.ForeignKey(PackageBlob, on_delete=models.CASCADE, related_name='deltas_from')
+    target = models.ForeignKey(PackageBlob, on_delete=models.CASCADE, related_name='deltas_to')
+    file = models.FileField(upload_to='deltas/')
+    size = models.BigIntegerField(default=0)
+    checksum = models.CharField(max_length=64, help_text="SHA-256 checksum of the delta file")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('source', 'target')
+
+    def __str__(self):
+        return f"{self.source} -> {self.target}"
+
+
+class PackagePeer(models.Model):
+    """Chunks of a blob that an agent holds and serves to its neighbours."""
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='package_chunks')
+    blob = models.ForeignKey(PackageBlob, on_delete=models.CASCADE, related_name='peers')
+    port = models.PositiveIntegerField(help_text="Port of the agent's chunk server")
+    chunks = models.JSONField(default=list, help_text="Indexes of the chunks the agent holds")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('client', 'blob')
+
+    def __str__(self):
+        return f"{self.client} - {self.blob} ({len(self.chunks)} chunks)"
+
+
+class PackageUpload(models.Model):
+    """A resumable, chunked upload of a package file.
+
+    Chunks are written at their offset into a partial file; ``offset`` is
+    the number of contiguous bytes received so far. Completing the upload
+    hashes the file once and moves it into the blob store.
+    """
+    name = models.CharField(max_length=100)
+    version = models.CharField(max_length=50)
+    description = models.TextField(blank=True)
+    os_compatibility = models.CharField(max_length=10, choices=Client.OS_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(help_text="Total size of the file in bytes")
+    checksum = models.CharField(max_length=64, blank=True, help_text="Expected SHA-256, verified on completion")
+    offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} - {self.version} ({self.offset}/{self.size})"
+
+    @property
+    def part_name(self):
+        return f'uploads/{self.id}.part'
@@ -0,0 +1,58 @@
+"""Peer-assisted distribution of package chunks.
+
+Agents that opt in report which chunks of a blob they hold and serve them
+over HTTP. When another agent fetches the same blob, the manifest lists
+online peers on its own subnet, so most chunks are transferred inside the
+local network and only the rest comes from the server. Every chunk is
+verified against the manifest hashes, so peers need not be trusted.
+"""
+import ipaddress
+from django.conf import settings
+from .models import PackagePeer
+
+
+def subnet_prefix(ip_address):
+    """Return the string prefix shared by addresses on the same IPv4 /24.
+
+    Peers are only looked up for IPv4 clients; returns None otherwise.
+    """
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    if address.version != 4:
+        return None
+    return ip_address.rsplit('.', 1)[0] + '.'
+
+
+def peers_for(blob, client):
+    """Online peers on ``client``'s subnet holding chunks of ``blob``."""
+    prefix = subnet_prefix(client.ip_address)
+    if prefix is None:
+        return []
+    peers = (
+        PackagePeer.objects.filter(
+            blob=blob, client__status='online', client__ip_address__startswith=prefix
+        )
+        .exclude(client=client)
+        .select_related('client')
+        .order_by('-updated_at')[:settings.PACKAGE_PEER_LIMIT]
+    )
+    return [
+        {'client': peer.client_id, 'address': f'{peer.client.ip_address}:{peer.port}', 'chunks': peer.chunks}
+        for peer in peers
+    ]
+
+
+def manifest(blob, client=None):
+    """The chunk manifest of ``blob``, with peers for ``client`` if given.
+
+    The manifest must have been computed (see ``tasks.request_manifest``).
+    """
+    return {
+        'checksum': blob.checksum,
+        'size': blob.size,
+        'chunk_size': blob.chunk_size,
+        'chunks': blob.chunk_hashes,
+        'peers': peers_for(blob, client) if client is not None else [],
+    }
@@ -1,9 +1,42 @@
 from rest_framework import serializers
-from .models import Package
+import os
+from .models import PACKAGE_EXTENSIONS, Package, PackageUpload
 
 class PackageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Package
-        fields = ['id', 'name', 'version', 'description', 'file', 'os_compatibility',
-                 'size', 'created_at', 'is_active']
-        read_only_fields = ['id', 'size', 'created_at'] 
\ No newline at end of file
+        fields = ['id', 'name', 'version', 'description', 'file', 'filename', 'os_compatibility',
+                 'size', 'checksum', 'created_at', 'is_active']
+        read_only_fields = ['id', 'filename', 'size', 'checksum', 'created_at'] 
+
+class PackageUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PackageUpload
+        fields = ['id', 'name', 'version', 'description', 'os_compatibility', 'filename',
+                  'size', 'checksum', 'offset', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'offset', 'created_at', 'updated_at']
+
+    def validate_filename(self, value):
+        extension = os.path.splitext(value)[1][1:].lower()
+        if extension not in PACKAGE_EXTENSIONS:
+            raise serializers.ValidationError(
+                f"File extension '{extension}' is not allowed. Allowed extensions are: {', '.join(PACKAGE_EXTENSIONS)}."
+            )
+        return os.path.basename(value)
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be positive.")
+        return value
+
+    def validate(self, attrs):
+        if Package.objects.filter(name=attrs['name'], version=attrs['version']).exists():
+            raise serializers.ValidationError("A package with this name and version already exists.")
+        return attrs
+
+
+class PeerChunksSerializer(serializers.Serializer):
+    """Chunks of a blob an agent reports holding; an empty list withdraws it."""
+    checksum = serializers.RegexField(r'^[0-9a-f]{64}$')
+    port = serializers.IntegerField(min_value=1, max_value=65535)
+    chunks = serializers.ListField(child=serializers.IntegerField(min_value=0), allow_empty=True)
@@ -0,0 +1,11 @@
+"""Cache invalidation for package listings and checksum lookups."""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from deployment_backend.caching import invalidate
+from .models import Package, PackageBlob
+
+
+@receiver([post_save, post_delete], sender=Package)
+@receiver([post_save, post_delete], sender=PackageBlob)
+def invalidate_packages(sender, **kwargs):
+    invalidate('packages')
@@ -0,0 +1,159 @@
+from datetime import timedelta
+from mmap import ACCESS_READ, mmap
+from celery import shared_task
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import IntegrityError
+from django.db.models import Q
+from django.utils import timezone
+from .delta import DeltaTooLarge, apply_delta, make_delta
+from .models import Package, PackageBlob, PackageDelta, PackageUpload
+from .uploads import discard_part
+import hashlib
+import tempfile
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def collect_package_blobs():
+    """Delete blobs that no package refers to any more.
+
+    Blobs younger than ``PACKAGE_BLOB_GC_GRACE`` are kept so that an upload
+    whose package has not been saved yet does not lose its file. Each row is
+    deleted conditionally before its file, so a blob that was referenced
+    again in the meantime survives.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.PACKAGE_BLOB_GC_GRACE)
+    unreferenced = PackageBlob.objects.filter(
+        ref_count=0, packages__isnull=True, created_at__lt=cutoff
+    )
+    collected = 0
+    for blob in unreferenced.iterator():
+        delta_names = list(PackageDelta.objects.filter(
+            Q(source=blob) | Q(target=blob)
+        ).values_list('file', flat=True))
+        deleted, _ = PackageBlob.objects.filter(
+            id=blob.id, ref_count=0, packages__isnull=True
+        ).delete()
+        if deleted:
+            # The blob's deltas were removed with it by the cascade.
+            for delta_name in delta_names:
+                blob.file.storage.delete(delta_name)
+            blob.file.delete(save=False)
+            collected += 1
+    if collected:
+        logger.info("Collected %d unreferenced package blobs", collected)
+    return collected
+
+
+def _manifest_lock(blob_id):
+    return f'package-manifest:{blob_id}'
+
+
+def request_manifest(blob):
+    """Have a worker compute the manifest of ``blob`` unless one already is.
+
+    The lock expires after ``PACKAGE_MANIFEST_LOCK_TIMEOUT`` so that a
+    computation lost with its worker is eventually retried.
+    """
+    if cache.add(_manifest_lock(blob.id), 1, settings.PACKAGE_MANIFEST_LOCK_TIMEOUT):
+        build_blob_manifest.delay(blob.id)
+
+
+@shared_task
+def build_blob_manifest(blob_id):
+    """Compute the chunk hashes of a blob that has none."""
+    try:
+        blob = PackageBlob.objects.filter(id=blob_id).first()
+        if blob is not None:
+            blob.ensure_manifest()
+    finally:
+        cache.delete(_manifest_lock(blob_id))
+
+
+@shared_task
+def expire_package_uploads():
+    """Discard chunked uploads that have not received data for a while."""
+    cutoff = timezone.now() - timedelta(seconds=settings.PACKAGE_UPLOAD_EXPIRY)
+    expired = list(PackageUpload.objects.filter(updated_at__lt=cutoff))
+    for upload in expired:
+        discard_part(upload)
+        upload.delete()
+    if expired:
+        logger.info("Discarded %d abandoned package uploads", len(expired))
+    return len(expired)
+
+
+class _HashWriter:
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+
+
+def _map(file):
+    # mmap cannot map empty files.
+    return mmap(file.fileno(), 0, access=ACCESS_READ) if file.size else b''
+
+
+@shared_task
+def build_package_delta(package_id):
+    """Build the delta from the previous version of a package to this one.
+
+    The previous version is the most recently created package with the same
+    name. Deltas that are larger than ``PACKAGE_DELTA_MAX_RATIO`` of the full
+    file are not worth serving and are skipped. Every delta is applied once
+    and checked against the package checksum before it is stored.
+    """
+    package = Package.objects.select_related('blob').filter(id=package_id).first()
+    if package is None or package.blob is None or package.size > settings.PACKAGE_DELTA_MAX_FILE_SIZE:
+        return None
+    previous = (
+        Package.objects.filter(name=package.name, created_at__lt=package.created_at)
+        .exclude(blob=None).exclude(blob=package.blob)
+        .select_related('blob').order_by('-created_at').first()
+    )
+    if previous is None or previous.size > settings.PACKAGE_DELTA_MAX_FILE_SIZE:
+        return None
+    if PackageDelta.objects.filter(source=previous.blob, target=package.blob).exists():
+        return None
+
+    with previous.blob.file.open('rb') as old_file, package.blob.file.open('rb') as new_file, \
+            tempfile.TemporaryFile() as out:
+        try:
+            size = make_delta(
+                _map(old_file), _map(new_file), out,
+                block_size=settings.PACKAGE_DELTA_BLOCK_SIZE,
+                max_size=int(package.size * settings.PACKAGE_DELTA_MAX_RATIO),
+            )
+        except DeltaTooLarge:
+            logger.info("Skipped delta %s -> %s: not small enough", previous, package)
+            return None
+
+        out.seek(0)
+        rebuilt = _HashWriter()
+        apply_delta(old_file, out, rebuilt)
+        if rebuilt.sha256.hexdigest() != package.checksum:
+            logger.error("Delta %s -> %s does not reproduce the package; discarded", previous, package)
+            return None
+
+        out.seek(0)
+        sha256_hash = hashlib.sha256()
+        for block in iter(lambda: out.read(1 << 20), b""):
+            sha256_hash.update(block)
+        out.seek(0)
+        delta = PackageDelta(source=previous.blob, target=package.blob, size=size,
+                             checksum=sha256_hash.hexdigest())
+        delta.file.save(f'{previous.checksum[:16]}-{package.checksum[:16]}.delta', File(out), save=False)
+        try:
+            delta.save()
+        except IntegrityError:
+            # Built concurrently by another worker.
+            delta.file.delete(save=False)
+            return None
+    logger.info("Built delta %s -> %s: %d of %d bytes", previous, package, size, package.size)
+    return size
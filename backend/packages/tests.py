@@ -1,3 +1,376 @@
-from django.test import TestCase
+import hashlib
+import importlib.util
+import io
+import os
+import random
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+from deployment_backend.testing import (
+    LOCAL_CACHE, NO_CACHE, QueryCountMixin, TemporaryMediaMixin, make_client, make_package, sequence,
+)
+from .delta import DeltaTooLarge, apply_delta, make_delta
+from .downloads import parse_range
+from .models import Package, PackageBlob, PackagePeer, PackageUpload
+from .peers import peers_for
+from .tasks import build_package_delta, collect_package_blobs
 
-# Create your tests here.
+CLIENT_PATH = os.path.join(settings.BASE_DIR.parent, 'client', 'client.py')
+
+
+class PackageQueryCountTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_list(self):
+        self.assertQueryBudget(lambda: self.client.get('/api/packages/'), make_package, budget=2)
+
+    def test_upload_list(self):
+        def add_upload():
+            n = next(sequence)
+            PackageUpload.objects.create(name=f'upload-{n}', version='1.0', os_compatibility='linux',
+                                         filename=f'upload-{n}.deb', size=100, checksum='0' * 64)
+
+        self.assertQueryBudget(lambda: self.client.get('/api/package-uploads/'), add_upload, budget=2)
+
+    def test_manifest_with_peers(self):
+        blob = PackageBlob.objects.create(checksum='a' * 64, file='blobs/aa/' + 'a' * 64, size=10,
+                                          chunk_size=settings.PACKAGE_CHUNK_SIZE, chunk_hashes=['b' * 64])
+        agent = make_client(ip_address='10.2.0.1')
+
+        def add_peer():
+            peer = make_client(ip_address=f'10.2.0.{next(sequence) % 250 + 2}')
+            PackagePeer.objects.create(client=peer, blob=blob, port=8900, chunks=[0])
+
+        self.assertQueryBudget(
+            lambda: self.client.get(f'/api/packages/blobs/{blob.checksum}/manifest/?client={agent.id}'),
+            add_peer, budget=3,
+        )
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class PackageCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def test_conditional_get(self):
+        make_package()
+        response = self.client.get('/api/packages/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/packages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_package()
+        response = self.client.get('/api/packages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        # The end is clamped to the file.
+        self.assertEqual(parse_range('bytes=50-500', 100), (50, 99))
+
+    def test_ignored_headers(self):
+        for header in (None, '', 'bytes=-', 'items=0-9', 'bytes=0-9,20-29'):
+            self.assertIsNone(parse_range(header, 100), header)
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=100-', 'bytes=10-5', 'bytes=-0'):
+            with self.assertRaises(ValueError):
+                parse_range(header, 100)
+
+
+@override_settings(CACHES=NO_CACHE)
+class DownloadTests(TemporaryMediaMixin, APITestCase):
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+        self.package = make_package(file=SimpleUploadedFile('app.deb', self.content))
+        self.url = f'/api/packages/{self.package.id}/download/'
+        self.etag = f'"{hashlib.sha256(self.content).hexdigest()}"'
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('app.deb', response['Content-Disposition'])
+
+    def test_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[1000:])
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1023/{len(self.content)}')
+        self.assertEqual(response['Content-Length'], '24')
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_if_range(self):
+        response, _ = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        # The file changed since the partial download: send all of it.
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_if_none_match(self):
+        response, _ = self.get(HTTP_IF_NONE_MATCH=f'"other", {self.etag}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], self.etag)
+
+
+@override_settings(CACHES=NO_CACHE, PACKAGE_BLOB_GC_GRACE=0)
+class BlobStoreTests(TemporaryMediaMixin, APITestCase):
+    def upload(self, content, name='app.deb'):
+        return make_package(file=SimpleUploadedFile(name, content))
+
+    def test_identical_content_is_stored_once(self):
+        first = self.upload(b'same', 'a.deb')
+        second = self.upload(b'same', 'b.deb')
+        self.assertEqual(first.blob_id, second.blob_id)
+        blob = PackageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.file.name, f'blobs/{blob.checksum[:2]}/{blob.checksum}')
+        self.assertEqual((first.filename, second.filename), ('a.deb', 'b.deb'))
+
+    def test_references_follow_the_package(self):
+        package = self.upload(b'old')
+        old_blob = package.blob
+        package.file = SimpleUploadedFile('app.deb', b'new')
+        package.save()
+        old_blob.refresh_from_db()
+        self.assertEqual(old_blob.ref_count, 0)
+        self.assertEqual(package.blob.checksum, hashlib.sha256(b'new').hexdigest())
+
+        package.delete()
+        self.assertEqual(PackageBlob.objects.get(id=package.blob_id).ref_count, 0)
+
+    def test_collect_unreferenced_blobs(self):
+        kept = self.upload(b'kept', 'kept.deb')
+        dropped = self.upload(b'dropped', 'dropped.deb')
+        storage, name = dropped.blob.file.storage, dropped.blob.file.name
+        dropped.delete()
+        self.assertEqual(collect_package_blobs(), 1)
+        self.assertFalse(storage.exists(name))
+        self.assertEqual(list(PackageBlob.objects.all()), [kept.blob])
+        self.assertTrue(storage.exists(kept.blob.file.name))
+
+    def test_fetch_by_checksum(self):
+        package = self.upload(b'content')
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+        response = self.client.get(f'/api/packages/blobs/{package.checksum}/')
+        self.assertEqual(b''.join(response.streaming_content), b'content')
+        response.close()
+        self.assertEqual(self.client.get(f'/api/packages/blobs/{"0" * 64}/').status_code, 404)
+
+
+@override_settings(CACHES=NO_CACHE)
+@mock.patch('packages.views.build_package_delta')
+class ChunkedUploadTests(TemporaryMediaMixin, APITestCase):
+    content = b'0123456789'
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_authenticate(self.user)
+
+    def start(self, **fields):
+        response = self.client.post('/api/package-uploads/', {
+            'name': 'app', 'version': '1.0', 'os_compatibility': 'linux', 'filename': 'app.deb',
+            'size': len(self.content), **fields,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def send(self, upload_id, start, end):
+        return self.client.put(
+            f'/api/package-uploads/{upload_id}/', self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}',
+        )
+
+    def test_resume_after_interruption(self, build_delta):
+        upload_id = self.start(checksum=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.send(upload_id, 0, 3).data['offset'], 4)
+        # A chunk past the offset is refused with the offset to resume from.
+        response = self.send(upload_id, 6, 9)
+        self.assertEqual((response.status_code, response.data['offset']), (409, 4))
+        self.assertEqual(self.client.get(f'/api/package-uploads/{upload_id}/').data['offset'], 4)
+        self.assertEqual(self.send(upload_id, 4, 9).data['offset'], 10)
+
+        part = default_storage.path(f'uploads/{upload_id}.part')
+        response = self.client.post(f'/api/package-uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 201, response.data)
+        package = Package.objects.get(id=response.data['id'])
+        with package.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(package.filename, 'app.deb')
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(PackageUpload.objects.exists())
+        build_delta.delay.assert_called_once_with(package.id)
+
+    def test_incomplete_upload(self, build_delta):
+        upload_id = self.start()
+        self.send(upload_id, 0, 3)
+        self.assertEqual(self.client.post(f'/api/package-uploads/{upload_id}/complete/').status_code, 400)
+
+    def test_checksum_mismatch(self, build_delta):
+        upload_id = self.start(checksum='0' * 64)
+        self.send(upload_id, 0, 9)
+        self.assertEqual(self.client.post(f'/api/package-uploads/{upload_id}/complete/').status_code, 400)
+        self.assertFalse(Package.objects.exists())
+
+    def test_invalid_content_range(self, build_delta):
+        upload_id = self.start()
+        response = self.client.put(f'/api/package-uploads/{upload_id}/', b'x',
+                                   content_type='application/octet-stream', HTTP_CONTENT_RANGE='bytes 0-0/99')
+        self.assertEqual(response.status_code, 400)
+
+
+def load_client():
+    spec = importlib.util.spec_from_file_location('deployment_client', CLIENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class DeltaTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.old = rng.randbytes(64 * 1024)
+        # Shifted by an insertion, with a block's worth of new bytes in the middle.
+        self.new = b'header' + self.old[:30000] + rng.randbytes(4096) + self.old[30000:-100]
+
+    def delta(self, old, new, **kwargs):
+        out = io.BytesIO()
+        make_delta(old, new, out, block_size=512, **kwargs)
+        return out.getvalue()
+
+    def rebuild(self, apply, old, delta):
+        out = io.BytesIO()
+        apply(io.BytesIO(old), io.BytesIO(delta), out)
+        return out.getvalue()
+
+    def test_round_trip(self):
+        for old, new in [(self.old, self.new), (self.old, self.old), (b'', self.new), (self.old, b''),
+                         (self.new, self.old)]:
+            self.assertEqual(self.rebuild(apply_delta, old, self.delta(old, new)), new)
+
+    def test_shifted_content_is_copied(self):
+        delta = self.delta(self.old, self.new)
+        # The inserted bytes plus at most a block on each side of them.
+        self.assertLess(len(delta), 4096 + 3 * 512 + 200)
+
+    def test_unrelated_content_is_too_large(self):
+        with self.assertRaises(DeltaTooLarge):
+            self.delta(self.old, random.Random(1).randbytes(len(self.old)), max_size=len(self.old) // 2)
+
+    @skipUnless(os.path.exists(CLIENT_PATH), "needs the agent sources")
+    def test_agent_applies_deltas_like_the_server(self):
+        agent = load_client()
+        for old, new in [(self.old, self.new), (b'', self.new)]:
+            delta = self.delta(old, new)
+            self.assertEqual(self.rebuild(agent.apply_delta, old, delta), self.rebuild(apply_delta, old, delta))
+        with self.assertRaises(ValueError):
+            self.rebuild(agent.apply_delta, self.old, b'garbage')
+
+
+@override_settings(CACHES=NO_CACHE, PACKAGE_DELTA_BLOCK_SIZE=512)
+class BuildDeltaTests(TemporaryMediaMixin, APITestCase):
+    def test_delta_from_the_previous_version(self):
+        rng = random.Random(2)
+        old = rng.randbytes(32 * 1024)
+        new = old[:10000] + b'patch' + old[10000:]
+        previous = make_package(name='app', version='1.0', file=SimpleUploadedFile('app.deb', old))
+        package = make_package(name='app', version='1.1', file=SimpleUploadedFile('app.deb', new))
+        self.assertLess(build_package_delta(package.id), len(new) // 4)
+
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+        url = f'/api/packages/{package.id}/delta/'
+        response = self.client.get(url, {'from_checksum': previous.checksum})
+        delta = b''.join(response.streaming_content)
+        response.close()
+        out = io.BytesIO()
+        apply_delta(io.BytesIO(old), io.BytesIO(delta), out)
+        self.assertEqual(out.getvalue(), new)
+        self.assertEqual(self.client.get(url, {'from_checksum': '0' * 64}).status_code, 404)
+
+    @override_settings(PACKAGE_DELTA_MAX_FILE_SIZE=1000)
+    def test_large_packages_get_no_delta(self):
+        make_package(name='app', version='1.0', file=SimpleUploadedFile('app.deb', b'a' * 2000))
+        package = make_package(name='app', version='1.1', file=SimpleUploadedFile('app.deb', b'b' * 2000))
+        self.assertIsNone(build_package_delta(package.id))
+
+
+@override_settings(CACHES=NO_CACHE)
+class ManifestTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_user('user', 'user@example.com', 'password'))
+        self.content = b'x' * 2500
+        self.blob = make_package(file=SimpleUploadedFile('app.deb', self.content)).blob
+        self.url = f'/api/packages/blobs/{self.blob.checksum}/manifest/'
+
+    @override_settings(PACKAGE_CHUNK_SIZE=1000)
+    def test_missing_manifest_is_computed_by_a_worker(self):
+        # Stored with the default chunk size, so it has to be rehashed.
+        with mock.patch('packages.tasks.build_blob_manifest') as build:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response['Retry-After'], str(settings.PACKAGE_MANIFEST_RETRY_AFTER))
+            build.delay.assert_called_once_with(self.blob.id)
+
+        # Celery runs eagerly here: the retry has the manifest computed
+        # before it answers 202, and the next request gets it.
+        self.assertEqual(self.client.get(self.url).status_code, 202)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['chunk_size'], 1000)
+        self.assertEqual(response.data['chunks'], [
+            hashlib.sha256(self.content[start:start + 1000]).hexdigest() for start in (0, 1000, 2000)
+        ])
+
+    @override_settings(CACHES=LOCAL_CACHE, PACKAGE_CHUNK_SIZE=1000)
+    def test_one_computation_at_a_time(self):
+        with mock.patch('packages.tasks.build_blob_manifest') as build:
+            self.client.get(self.url)
+            self.client.get(self.url)
+        build.delay.assert_called_once_with(self.blob.id)
+
+    def test_peers_on_the_same_subnet(self):
+        agent = make_client(ip_address='10.3.0.1')
+        near = make_client(ip_address='10.3.0.2')
+        PackagePeer.objects.create(client=near, blob=self.blob, port=8900, chunks=[0])
+        for client in (make_client(ip_address='10.4.0.2'), make_client(ip_address='10.3.0.3', status='offline')):
+            PackagePeer.objects.create(client=client, blob=self.blob, port=8900, chunks=[0])
+        PackagePeer.objects.create(client=agent, blob=self.blob, port=8900, chunks=[0])
+
+        self.assertEqual(peers_for(self.blob, agent),
+                         [{'client': near.id, 'address': '10.3.0.2:8900', 'chunks': [0]}])
+        self.assertEqual(peers_for(self.blob, make_client(ip_address='fd00::1')), [])
+        response = self.client.get(self.url, {'client': agent.id})
+        self.assertEqual(response.data['peers'][0]['client'], near.id)
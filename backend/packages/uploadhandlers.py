@@ -0,0 +1,39 @@
+"""Upload handlers that hash files while Django writes them.
+
+Each finished upload carries ``sha256`` (hex digest) and ``chunk_hashes``
+next to its ``size``, so the package file does not have to be read again to
+checksum it.
+"""
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from .hashing import ContentHasher
+
+
+class HashingUploadMixin:
+    def new_file(self, *args, **kwargs):
+        # Set before super(): an activated memory handler stops the chain
+        # by raising StopFutureHandlers from new_file().
+        self.hasher = ContentHasher()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super().receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # This handler consumed the chunk.
+            self.hasher.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            self.hasher.finish()
+            file.sha256 = self.hasher.hexdigest()
+            file.chunk_hashes = self.hasher.chunk_hashes
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    """Keep small uploads in memory, hashing them as they arrive."""
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    """Stream large uploads to a temporary file, hashing them as they arrive."""
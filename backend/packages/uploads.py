@@ -0,0 +1,104 @@
+"""Resumable, chunked package uploads.
+
+A client creates a ``PackageUpload`` and sends the file in chunks with
+``PUT`` and a ``Content-Range: bytes <start>-<end>/<total>`` header. Each
+chunk is streamed straight into the partial file at its offset, so nothing
+is buffered in memory or copied through a temporary file. After an
+interruption the client reads ``offset`` and continues from there.
+Completing the upload hashes the file in a single pass and moves it into
+the blob store.
+"""
+import os
+import re
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from .hashing import ContentHasher
+from .models import Package, PackageBlob, PackageUpload
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+COPY_BUFFER_SIZE = 1 << 20
+
+
+def parse_content_range(header, size):
+    """Parse ``Content-Range`` into ``(start, length)``; raise ValueError if invalid."""
+    match = CONTENT_RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        raise ValueError("Content-Range header of the form 'bytes <start>-<end>/<total>' is required")
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or end < start or end >= size:
+        raise ValueError(f"Content-Range {header!r} does not fit an upload of {size} bytes")
+    return start, end - start + 1
+
+
+class PartialUpload(File):
+    """An assembled upload; exposes its path so storage can move it into place."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(upload):
+    return default_storage.path(upload.part_name)
+
+
+def write_chunk(upload, start, stream, length):
+    """Write ``length`` bytes from ``stream`` at ``start`` and advance the offset.
+
+    Bytes received before a dropped connection are kept. The offset only
+    advances if no other request moved it in the meantime, so concurrent
+    retries of the same chunk are harmless.
+    """
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    received = 0
+    try:
+        with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+            f.seek(start)
+            while received < length:
+                data = stream.read(min(COPY_BUFFER_SIZE, length - received))
+                if not data:
+                    break
+                f.write(data)
+                received += len(data)
+    finally:
+        if received:
+            PackageUpload.objects.filter(id=upload.id, offset=start).update(
+                offset=start + received, updated_at=timezone.now()
+            )
+    upload.refresh_from_db(fields=['offset', 'updated_at'])
+    return received
+
+
+def complete_upload(upload):
+    """Turn a fully received upload into a package.
+
+    Raises ValueError if the checksum does not match the expected one.
+    """
+    path = part_path(upload)
+    hasher = ContentHasher()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            hasher.update(block)
+    checksum = hasher.finish().hexdigest()
+    if upload.checksum and checksum != upload.checksum:
+        raise ValueError(f"Checksum mismatch: expected {upload.checksum}, got {checksum}")
+
+    with PartialUpload(open(path, 'rb'), name=upload.filename) as file:
+        blob = PackageBlob.store(file, checksum, hasher.chunk_hashes)
+    discard_part(upload)  # Still there if the content was already stored.
+
+    package = Package(
+        name=upload.name, version=upload.version, description=upload.description,
+        os_compatibility=upload.os_compatibility, filename=upload.filename,
+        file=blob.file.name, blob=blob, checksum=checksum, size=blob.size,
+    )
+    package.save()
+    upload.delete()
+    return package
+
+
+def discard_part(upload):
+    path = part_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
@@ -1,10 +1,20 @@
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render
-from rest_framework import viewsets, filters
+from django.db import IntegrityError
+from rest_framework import mixins, viewsets, filters
+from rest_framework.decorators import action
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
-from .models import Package
-from .serializers import PackageSerializer
-import hashlib
+from rest_framework.response import Response
+from clients.models import Client
+from deployment_backend.caching import cached, conditional_response
+from .downloads import file_response, package_file_response
+from .models import Package, PackageBlob, PackageDelta, PackageUpload
+from .serializers import PackageSerializer, PackageUploadSerializer
+from .peers import manifest
+from .tasks import build_package_delta, request_manifest
+from .uploads import complete_upload, discard_part, parse_content_range, write_chunk
 
 # Create your views here.
 
@@ -18,16 +28,125 @@ class PackageViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'created_at', 'version']
     ordering = ['-created_at']
 
+    def list(self, request, *args, **kwargs):
+        build = super().list
+        return conditional_response(request, 'packages', lambda: build(request, *args, **kwargs).data)
+
+    def _blob(self, checksum):
+        """Look up a blob by checksum, cached until packages change."""
+        blob = cached('packages', f'blob:{checksum}',
+                      lambda: PackageBlob.objects.filter(checksum=checksum).first())
+        if blob is None:
+            raise Http404
+        return blob
+
     def perform_create(self, serializer):
-        file_obj = self.request.FILES.get('file')
-        if file_obj:
-            # Calculate SHA-256 checksum
-            sha256_hash = hashlib.sha256()
-            for byte_block in iter(lambda: file_obj.read(4096), b""):
-                sha256_hash.update(byte_block)
-            file_obj.seek(0)  # Reset file pointer to beginning
-            
-            serializer.save(
-                checksum=sha256_hash.hexdigest(),
-                size=file_obj.size
+        package = serializer.save()
+        build_package_delta.delay(package.id)
+
+    def perform_update(self, serializer):
+        previous_blob_id = serializer.instance.blob_id
+        package = serializer.save()
+        if package.blob_id != previous_blob_id:
+            build_package_delta.delay(package.id)
+
+    @action(detail=True, methods=['get', 'head'])
+    def download(self, request, pk=None):
+        """Stream the package file; supports Range/If-Range and ETag revalidation."""
+        return package_file_response(request, self.get_object())
+
+    @action(detail=False, methods=['get', 'head'], url_path=r'blobs/(?P<checksum>[0-9a-f]{64})')
+    def blob(self, request, checksum=None):
+        """Fetch package content by its SHA-256, independent of name and version."""
+        blob = self._blob(checksum)
+        return file_response(request, blob.file, blob.checksum, blob.checksum)
+
+    @action(detail=False, methods=['get'], url_path=r'blobs/(?P<checksum>[0-9a-f]{64})/manifest')
+    def manifest(self, request, checksum=None):
+        """Chunk hashes of a blob and, with ``?client=<id>``, peers that hold chunks of it.
+
+        Blobs stored before manifests existed (or with another chunk size)
+        are hashed by a worker first; until then the response is a 202 with
+        ``Retry-After``.
+        """
+        blob = self._blob(checksum)
+        if not blob.has_manifest:
+            request_manifest(blob)
+            return Response({'status': 'pending'}, status=202,
+                            headers={'Retry-After': str(settings.PACKAGE_MANIFEST_RETRY_AFTER)})
+        client = None
+        if 'client' in request.query_params:
+            try:
+                client = Client.objects.filter(id=int(request.query_params['client'])).first()
+            except ValueError:
+                return Response({'status': 'error', 'message': 'Invalid client'}, status=400)
+        return Response(manifest(blob, client))
+
+    @action(detail=True, methods=['get', 'head'])
+    def delta(self, request, pk=None):
+        """Serve the delta from the content with ``from_checksum`` to this package.
+
+        Responds 404 when no delta exists; agents then download the full file.
+        """
+        package = self.get_object()
+        from_checksum = request.query_params.get('from_checksum')
+        if not from_checksum:
+            return Response({'status': 'error', 'message': 'from_checksum is required'}, status=400)
+        delta = PackageDelta.objects.filter(target_id=package.blob_id, source__checksum=from_checksum).first()
+        if delta is None:
+            return Response({'status': 'error', 'message': 'No delta available'}, status=404)
+        filename = f"{package.filename or package.name}.delta"
+        return file_response(request, delta.file, delta.checksum, filename)
+
+
+class PackageUploadViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.ListModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """Chunked, resumable package uploads.
+
+    ``POST`` starts an upload, ``PUT`` with ``Content-Range`` appends a chunk
+    at the current ``offset`` and ``complete`` creates the package.
+    """
+    queryset = PackageUpload.objects.all()
+    serializer_class = PackageUploadSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['created_at']
+    ordering = ['-created_at']
+
+    def update(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            start, length = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), upload.size)
+        except ValueError as e:
+            return Response({'status': 'error', 'message': str(e)}, status=400)
+        if start != upload.offset:
+            # Out of order or already received: tell the client where to resume.
+            return Response(self.get_serializer(upload).data, status=409)
+        write_chunk(upload, start, request.stream, length)
+        return Response(self.get_serializer(upload).data)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        upload = self.get_object()
+        if upload.offset != upload.size:
+            return Response(
+                {'status': 'error', 'message': f'Upload incomplete: received {upload.offset} of {upload.size} bytes'},
+                status=400
             )
+        try:
+            package = complete_upload(upload)
+        except ValueError as e:
+            return Response({'status': 'error', 'message': str(e)}, status=400)
+        except IntegrityError:
+            return Response({'status': 'error', 'message': 'A package with this name and version already exists'},
+                            status=400)
+        build_package_delta.delay(package.id)
+        return Response(PackageSerializer(package, context=self.get_serializer_context()).data,
+                        status=201)
+
+    def perform_destroy(self, instance):
+        discard_part(instance)
+        instance.delete()
@@ -1,22 +1,171 @@
+import asyncio
 import requests
+import hashlib
 import socket
+import random
+import re
+import struct
+import tempfile
+import threading
 import platform
 import time
 import json
 import logging
-from datetime import datetime
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+
+DELTA_MAGIC = b'PDELTA1\n'
+
+
+def apply_delta(old, delta, out):
+    """Rebuild a package from the previous version ``old`` and a server delta.
+
+    Mirrors ``packages.delta.apply_delta`` on the server: the delta is a
+    sequence of copy (offset, length into ``old``) and literal operations.
+    """
+    if delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError("Not a package delta")
+    while True:
+        op = delta.read(1)
+        if not op:
+            return
+        if op == b'C':
+            offset, length = struct.unpack('>QI', delta.read(12))
+            old.seek(offset)
+            out.write(old.read(length))
+        elif op == b'L':
+            (length,) = struct.unpack('>I', delta.read(4))
+            out.write(delta.read(length))
+        else:
+            raise ValueError(f"Unknown delta operation {op!r}")
+
+
+def file_sha256(path):
+    sha256_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+
+CHECKSUM_RE = re.compile(r'^[0-9a-f]{64}$')
+CHUNK_PATH_RE = re.compile(r'^/chunks/([0-9a-f]{64})/(\d+)$')
+# Report held chunks to the server after this many new ones.
+CHUNK_REPORT_INTERVAL = 16
+# Longest time (seconds) to wait for the server to compute a blob manifest.
+MANIFEST_MAX_WAIT = 120
+
+
+class ChunkRequestHandler(BaseHTTPRequestHandler):
+    """Serve chunks of packages this agent holds to peers on its subnet."""
+
+    def do_GET(self):
+        match = CHUNK_PATH_RE.match(self.path)
+        held = match and self.server.agent.shared_chunks.get(match.group(1))
+        index = int(match.group(2)) if match else None
+        if not held or index not in held['chunks']:
+            self.send_error(404)
+            return
+        try:
+            with open(held['path'], 'rb') as f:
+                f.seek(index * held['chunk_size'])
+                data = f.read(held['chunk_size'])
+        except OSError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Chunk server: {format % args}")
+
+
+class Backoff:
+    """Exponential backoff with jitter.
+
+    The delay doubles with each consecutive failure, up to ``cap``. Half of
+    every delay is random, so agents that failed at the same moment (say,
+    during a server restart) do not all retry at the same moment.
+    """
+
+    def __init__(self, cap=600):
+        self.cap = cap
+        self.failures = 0
+
+    def delay(self, base, minimum=0):
+        """Seconds to wait after another failure."""
+        delay = min(self.cap, base * 2 ** self.failures)
+        self.failures += 1
+        return max(minimum, delay / 2 + random.uniform(0, delay / 2))
+
+    def reset(self):
+        self.failures = 0
+
+
+def retry_after_header(error):
+    """Seconds from the Retry-After header of a 429/503 response, if any."""
+    response = getattr(error, 'response', None)
+    if response is not None and response.status_code in (429, 503):
+        value = response.headers.get('Retry-After', '')
+        if value.isdigit():
+            return int(value)
+    return 0
+
+
+class PackageCache:
+    """Downloaded packages on disk, named by checksum.
+
+    Using a package marks it as recently used (its mtime), and the least
+    recently used packages are evicted once the cache grows past
+    ``max_bytes``.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, checksum):
+        return os.path.join(self.directory, checksum)
+
+    def get(self, checksum):
+        """Return the cached package's path, or None if it is not cached."""
+        path = self.path(checksum)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def evict(self, keep=()):
+        """Remove least recently used packages until the cache fits.
+
+        Returns the checksums of the removed packages.
+        """
+        entries = []
+        for name in os.listdir(self.directory) if os.path.isdir(self.directory) else []:
+            if CHECKSUM_RE.match(name):
+                stat = os.stat(self.path(name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for _, size, checksum in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if checksum in keep:
+                continue
+            os.remove(self.path(checksum))
+            total -= size
+            removed.append(checksum)
+            logging.info(f"Evicted package {checksum} from the cache")
+        return removed
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('client.log'),
-        logging.StreamHandler()
-    ]
-)
 
 class DeploymentClient:
     def __init__(self, config_file='config.ini'):
@@ -24,9 +173,46 @@ class DeploymentClient:
         self.token = None
         self.client_id = None
         self.base_url = self.config['server']['base_url'].rstrip('/')
-        self.headers = {
-            'Content-Type': 'application/json'
-        }
+        self.poll_wait = self.config['server'].getint('poll_wait', fallback=30)
+        self.download_dir = self.config['server'].get('download_dir', fallback='downloads')
+        # Port of the chunk server for peer-assisted downloads; 0 disables them.
+        self.peer_port = self.config['server'].getint('peer_port', fallback=0)
+        # checksum -> {'path', 'chunk_size', 'chunks'} of packages served to peers
+        self.shared_chunks = {}
+        self.cache = PackageCache(
+            self.download_dir, self.config['server'].getint('cache_size', fallback=10240) * 1024 * 1024
+        )
+        # Seconds between checks for scheduled deployments to pre-stage; 0 disables them.
+        self.prestage_interval = self.config['server'].getint('prestage_interval', fallback=300)
+        # Deployments handled at the same time; syncing never waits for them.
+        self.max_concurrency = self.config['server'].getint('max_concurrency', fallback=2)
+        # Both are replaced by the server's advice on every sync.
+        self.heartbeat_interval = self.config['server'].getint('heartbeat_interval', fallback=60)
+        self.retry_after = self.config['server'].getint('retry_after', fallback=30)
+        # Retry-After requested by the server with its last error response
+        self.server_retry_after = 0
+        # Keep-alive connections shared by all threads; each worker thread
+        # may hold one connection, plus syncing and pre-staging.
+        self.session = self._make_session(self.max_concurrency + 3)
+        self.session.headers['Content-Type'] = 'application/json'
+        self.peer_session = self._make_session(self.max_concurrency + 3)
+        self._fetch_locks = defaultdict(threading.Lock)
+        self._installed_lock = threading.Lock()
+        # status id -> deployment currently being handled
+        self.active = {}
+        # Their tasks; the event loop only keeps weak references to tasks.
+        self.tasks = set()
+        # status id -> latest status report not yet accepted by the server
+        self.outbox = {}
+        self._outbox_lock = threading.Lock()
+
+    @staticmethod
+    def _make_session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def _load_config(self, config_file):
         if not os.path.exists(config_file):
@@ -35,7 +221,15 @@ class DeploymentClient:
             config['server'] = {
                 'base_url': 'http://localhost:8000',
                 'username': 'client',
-                'password': 'client_password'
+                'password': 'client_password',
+                'poll_wait': '30',
+                'download_dir': 'downloads',
+                'peer_port': '0',
+                'cache_size': '10240',
+                'prestage_interval': '300',
+                'max_concurrency': '2',
+                'heartbeat_interval': '60',
+                'retry_after': '30'
             }
             with open(config_file, 'w') as f:
                 config.write(f)
@@ -44,10 +238,23 @@ class DeploymentClient:
         config.read(config_file)
         return config
 
+    def connect(self):
+        """Authenticate and register, backing off until the server accepts us."""
+        backoff = Backoff()
+        while True:
+            try:
+                self.authenticate()
+                self.register()
+                return
+            except Exception as e:
+                delay = backoff.delay(self.retry_after, retry_after_header(e))
+                logging.warning(f"Could not connect to the server, retrying in {delay:.0f}s")
+                time.sleep(delay)
+
     def authenticate(self):
         """Authenticate with the server and get token."""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/token/",
                 json={
                     'username': self.config['server']['username'],
@@ -56,7 +263,7 @@ class DeploymentClient:
             )
             response.raise_for_status()
             self.token = response.json()['token']
-            self.headers['Authorization'] = f'Token {self.token}'
+            self.session.headers['Authorization'] = f'Token {self.token}'
             logging.info("Authentication successful")
         except Exception as e:
             logging.error(f"Authentication failed: {str(e)}")
@@ -66,31 +273,29 @@ class DeploymentClient:
         """Register the client with the server."""
         try:
             hostname = socket.gethostname()
-            ip_address = socket.gethostbyname(hostname)
+            # The server records the address our requests come from.
             system_info = {
                 'hostname': hostname,
-                'ip_address': ip_address,
                 'os_type': platform.system().lower(),
                 'os_version': platform.version()
             }
 
             # Check if already registered
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/api/clients/",
-                headers=self.headers,
                 params={'search': hostname}
             )
             response.raise_for_status()
-            clients = response.json()
+            # Search is a substring match, so look for this exact hostname.
+            clients = [c for c in response.json()['results'] if c['hostname'] == hostname]
 
             if clients:
                 self.client_id = clients[0]['id']
                 logging.info(f"Client already registered with ID: {self.client_id}")
             else:
                 # Register new client
-                response = requests.post(
+                response = self.session.post(
                     f"{self.base_url}/api/clients/",
-                    headers=self.headers,
                     json=system_info
                 )
                 response.raise_for_status()
@@ -101,88 +306,466 @@ class DeploymentClient:
             logging.error(f"Registration failed: {str(e)}")
             raise
 
-    def check_in(self):
-        """Update client status on server."""
+    def report(self, status_id, status, **fields):
+        """Queue a status report for the next sync.
+
+        A newer report for the same deployment replaces one that was not
+        sent yet; the server accepts e.g. ``completed`` straight from pending.
+        """
+        with self._outbox_lock:
+            self.outbox[status_id] = {'id': status_id, 'status': status, **fields}
+        self.loop.call_soon_threadsafe(self.reported.set)
+
+    def sync(self, wait):
+        """Send a heartbeat and the queued status reports, and fetch work.
+
+        The server holds the request open for up to ``wait`` seconds until
+        work is published for this client. Reports are dropped from the
+        outbox once the server has accepted them, and the sync interval and
+        retry delay the server suggests are adopted. Returns the pending
+        deployments, or None if the server could not be reached or no
+        longer knew this client, which then registers again.
+        """
+        with self._outbox_lock:
+            updates = list(self.outbox.values())
         try:
-            response = requests.post(
-                f"{self.base_url}/api/clients/{self.client_id}/checkin/",
-                headers=self.headers
+            response = self.session.post(
+                f"{self.base_url}/api/clients/{self.client_id}/sync/",
+                json={'status': 'online', 'updates': updates, 'wait': wait},
+                timeout=wait + 30
             )
+            if response.status_code == 404:
+                # Our record was deleted on the server; register again and
+                # sync under the new id after the usual retry delay.
+                logging.warning(f"Client {self.client_id} is no longer registered, registering again")
+                self.client_id = None
+                self.server_retry_after = 0
+                self.register()
+                return None
             response.raise_for_status()
-            logging.info("Successfully checked in with server")
+            result = response.json()
         except Exception as e:
-            logging.error(f"Check-in failed: {str(e)}")
+            self.server_retry_after = retry_after_header(e)
+            logging.error(f"Sync failed: {str(e)}")
+            return None
 
-    def check_deployments(self):
-        """Check for pending deployments."""
+        with self._outbox_lock:
+            for update in updates:
+                # Keep reports that were replaced while the request was in flight.
+                if self.outbox.get(update['id']) is update:
+                    del self.outbox[update['id']]
+        self.heartbeat_interval = result.get('poll_interval', self.heartbeat_interval)
+        self.retry_after = result.get('retry_after', self.retry_after)
+        return result['work']
+
+    async def run(self):
+        """Run syncing, pre-staging and deployments concurrently.
+
+        Blocking HTTP calls and installs run in worker threads; at most
+        ``max_concurrency`` deployments are handled at a time, so a slow
+        install never delays syncing.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=self.max_concurrency + 3)
+        )
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.reported = asyncio.Event()
+        loops = [self._sync_loop()]
+        if self.prestage_interval:
+            loops.append(self._prestage_loop())
+        await asyncio.gather(*loops)
+
+    async def _prestage_loop(self):
+        while True:
+            await asyncio.to_thread(self.prestage)
+            await asyncio.sleep(self.prestage_interval)
+
+    async def _sync_loop(self):
+        # One request carries the heartbeat, status reports and work fetch.
+        # While idle it long-polls for work, and idle syncs start no more
+        # often than the server advises even if it answers the long poll
+        # sooner. While deployments run it syncs every ``heartbeat_interval``
+        # or as soon as there is something to report.
+        backoff = Backoff()
+        while True:
+            self.reported.clear()
+            idle = not (self.outbox or self.active)
+            wait = max(self.poll_wait, self.heartbeat_interval) if idle else 0
+            started = time.monotonic()
+            deployments = await asyncio.to_thread(self.sync, wait)
+            if deployments is None:
+                await asyncio.sleep(backoff.delay(self.retry_after, self.server_retry_after))
+                continue
+            backoff.reset()
+            if idle and not deployments:
+                remaining = max(self.poll_wait, self.heartbeat_interval) - (time.monotonic() - started)
+                if remaining > 0:
+                    try:
+                        await asyncio.wait_for(self.reported.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            for deployment in deployments:
+                if deployment['id'] not in self.active:
+                    self.active[deployment['id']] = deployment
+                    task = asyncio.create_task(self._run_deployment(deployment))
+                    self.tasks.add(task)
+                    task.add_done_callback(self.tasks.discard)
+            if self.active and not self.outbox:
+                # A little jitter keeps agents started together from staying in lockstep.
+                delay = self.heartbeat_interval * random.uniform(0.9, 1.1)
+                try:
+                    await asyncio.wait_for(self.reported.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _run_deployment(self, deployment):
         try:
-            response = requests.get(
-                f"{self.base_url}/api/deployment-status/",
-                headers=self.headers,
-                params={
-                    'client': self.client_id,
-                    'status': 'pending'
-                }
+            async with self.semaphore:
+                await asyncio.to_thread(self._process_deployment, deployment)
+        finally:
+            del self.active[deployment['id']]
+            # Go back to long-polling once the last deployment is done.
+            self.reported.set()
+
+    def _load_installed(self):
+        """Checksums of the installed version of each package, by package name."""
+        try:
+            with open(os.path.join(self.download_dir, 'installed.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _record_installed(self, deployment):
+        with self._installed_lock:
+            installed = self._load_installed()
+            installed[deployment['package_name']] = deployment['checksum']
+            os.makedirs(self.download_dir, exist_ok=True)
+            with open(os.path.join(self.download_dir, 'installed.json'), 'w') as f:
+                json.dump(installed, f)
+
+    def fetch_package(self, deployment):
+        """Get a deployment's package from the cache or the cheapest source.
+
+        Tries a delta from the installed version, then peers (if enabled),
+        then a full download.
+        """
+        checksum = deployment['checksum']
+        # Deployments and pre-staging may want the same package at once.
+        with self._fetch_locks[checksum]:
+            path = self.cache.get(checksum)
+            if path is None:
+                path = (self.download_delta(deployment)
+                        or (self.peer_port and self.download_from_peers(deployment))
+                        or self.download_package(deployment))
+            if self.peer_port:
+                self.share_package(checksum, path)
+        in_use = {checksum} | {d['checksum'] for d in list(self.active.values())}
+        for evicted in self.cache.evict(keep=in_use):
+            self._unshare_package(evicted)
+        return path
+
+    def prestage(self):
+        """Download the packages of deployments scheduled to start soon.
+
+        The server offers each deployment ahead of ``scheduled_for`` at a
+        per-client time, so by the start the package is already cached.
+        """
+        try:
+            response = self.session.get(
+                f"{self.base_url}/api/clients/{self.client_id}/prestage/",
+                timeout=30
             )
             response.raise_for_status()
-            deployments = response.json()
+        except requests.RequestException as e:
+            logging.warning(f"Failed to check for deployments to pre-stage: {str(e)}")
+            return
+        for deployment in response.json():
+            try:
+                self.fetch_package(deployment)
+                logging.info(f"Pre-staged package {deployment['package']} for deployment "
+                             f"{deployment['deployment']} scheduled for {deployment['scheduled_for']}")
+            except Exception as e:
+                logging.warning(f"Failed to pre-stage package {deployment['package']}: {str(e)}")
 
-            for deployment in deployments:
-                self._process_deployment(deployment)
+    def start_chunk_server(self):
+        """Serve held package chunks to peers in a background thread."""
+        server = ThreadingHTTPServer(('', self.peer_port), ChunkRequestHandler)
+        server.agent = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Serving package chunks to peers on port {self.peer_port}")
 
-        except Exception as e:
-            logging.error(f"Failed to check deployments: {str(e)}")
+    def _get_manifest(self, checksum):
+        """Fetch a blob manifest, waiting while the server computes it."""
+        deadline = time.monotonic() + MANIFEST_MAX_WAIT
+        while True:
+            response = self.session.get(
+                f"{self.base_url}/api/packages/blobs/{checksum}/manifest/",
+                params={'client': self.client_id}, timeout=30
+            )
+            response.raise_for_status()
+            if response.status_code != 202:
+                return response.json()
+            retry_after = response.headers.get('Retry-After', '')
+            delay = int(retry_after) if retry_after.isdigit() else 5
+            if time.monotonic() + delay > deadline:
+                raise requests.RequestException(f"Manifest of {checksum} is not ready yet")
+            time.sleep(delay)
+
+    def _report_chunks(self, checksum):
+        held = self.shared_chunks[checksum]
+        try:
+            self.session.post(
+                f"{self.base_url}/api/clients/{self.client_id}/chunks/",
+                json={'checksum': checksum, 'port': self.peer_port, 'chunks': sorted(held['chunks'])},
+                timeout=30
+            ).raise_for_status()
+        except requests.RequestException as e:
+            logging.warning(f"Failed to report chunks of {checksum}: {str(e)}")
+
+    def share_package(self, checksum, path):
+        """Offer every chunk of a downloaded package to peers."""
+        held = self.shared_chunks.get(checksum)
+        if held is None:
+            try:
+                manifest = self._get_manifest(checksum)
+            except requests.RequestException as e:
+                logging.warning(f"Failed to get manifest of {checksum}: {str(e)}")
+                return
+            held = {'chunk_size': manifest['chunk_size'], 'chunks': set(range(len(manifest['chunks'])))}
+        held['path'] = path
+        self.shared_chunks[checksum] = held
+        self._report_chunks(checksum)
+
+    def _unshare_package(self, checksum):
+        held = self.shared_chunks.get(checksum)
+        if held is not None:
+            held['chunks'] = set()
+            self._report_chunks(checksum)
+            del self.shared_chunks[checksum]
+
+    def _fetch_chunk(self, checksum, index, manifest):
+        """Fetch one chunk from a peer that has it, or from the server."""
+        expected = manifest['chunks'][index]
+        peers = [peer for peer in manifest['peers'] if index in peer['chunks']]
+        random.shuffle(peers)
+        for peer in peers[:3]:
+            try:
+                # A separate session, so the API token is never sent to peers.
+                response = self.peer_session.get(f"http://{peer['address']}/chunks/{checksum}/{index}",
+                                                 timeout=(5, 60))
+                if response.ok and hashlib.sha256(response.content).hexdigest() == expected:
+                    return response.content
+                logging.warning(f"Peer {peer['address']} sent a bad chunk {index} of {checksum}")
+            except requests.RequestException as e:
+                logging.debug(f"Peer {peer['address']} unavailable: {str(e)}")
+
+        start = index * manifest['chunk_size']
+        end = min(start + manifest['chunk_size'], manifest['size']) - 1
+        response = self.session.get(f"{self.base_url}/api/packages/blobs/{checksum}/",
+                                    headers={'Range': f'bytes={start}-{end}'}, timeout=60)
+        response.raise_for_status()
+        if response.status_code != 206 or hashlib.sha256(response.content).hexdigest() != expected:
+            raise ValueError(f"Server sent a bad chunk {index} of {checksum}")
+        return response.content
+
+    def download_from_peers(self, deployment):
+        """Download a package chunk by chunk, preferring peers on the subnet.
+
+        Each chunk is checked against the manifest before it is written and
+        offered to other peers. Chunks left by an interrupted run are kept.
+        Returns the path of the verified file, or None on failure.
+        """
+        checksum = deployment['checksum']
+        path = os.path.join(self.download_dir, checksum)
+        chunks_path = path + '.chunks'
+        try:
+            manifest = self._get_manifest(checksum)
+        except requests.RequestException as e:
+            logging.warning(f"Failed to get manifest of {checksum}: {str(e)}")
+            return None
+        chunk_size = manifest['chunk_size']
+
+        os.makedirs(self.download_dir, exist_ok=True)
+        held = {'path': chunks_path, 'chunk_size': chunk_size, 'chunks': set()}
+        with open(chunks_path, 'r+b' if os.path.exists(chunks_path) else 'w+b') as f:
+            f.truncate(manifest['size'])
+            for index, expected in enumerate(manifest['chunks']):
+                f.seek(index * chunk_size)
+                if hashlib.sha256(f.read(chunk_size)).hexdigest() == expected:
+                    held['chunks'].add(index)
+            self.shared_chunks[checksum] = held
+
+            try:
+                reported = len(held['chunks'])
+                for index in range(len(manifest['chunks'])):
+                    if index in held['chunks']:
+                        continue
+                    data = self._fetch_chunk(checksum, index, manifest)
+                    f.seek(index * chunk_size)
+                    f.write(data)
+                    f.flush()
+                    held['chunks'].add(index)
+                    if len(held['chunks']) - reported >= CHUNK_REPORT_INTERVAL:
+                        self._report_chunks(checksum)
+                        reported = len(held['chunks'])
+            except (requests.RequestException, ValueError) as e:
+                logging.warning(f"Chunked download of {checksum} failed: {str(e)}")
+                return None
+
+        if file_sha256(chunks_path) != checksum:
+            logging.warning(f"Chunked download of {checksum} did not reproduce the checksum")
+            del self.shared_chunks[checksum]
+            os.remove(chunks_path)
+            return None
+        os.replace(chunks_path, path)
+        held['path'] = path
+        logging.info(f"Downloaded package {deployment['package']} in {len(manifest['chunks'])} chunks")
+        return path
+
+    def download_delta(self, deployment):
+        """Rebuild the package from the installed version and a delta.
+
+        Returns the path of the verified file, or None if no delta is
+        available or it could not be applied.
+        """
+        checksum = deployment['checksum']
+        old_checksum = self._load_installed().get(deployment['package_name'])
+        if not old_checksum or old_checksum == checksum:
+            return None
+        old_path = os.path.join(self.download_dir, old_checksum)
+        if not os.path.exists(old_path):
+            return None
+        path = os.path.join(self.download_dir, checksum)
+        part_path = path + '.rebuild'
+
+        try:
+            with self.session.get(
+                f"{self.base_url}/api/packages/{deployment['package']}/delta/",
+                params={'from_checksum': old_checksum},
+                stream=True, timeout=60
+            ) as response:
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                with tempfile.TemporaryFile() as delta_file:
+                    for block in response.iter_content(chunk_size=1 << 20):
+                        delta_file.write(block)
+                    delta_file.seek(0)
+                    with open(old_path, 'rb') as old, open(part_path, 'wb') as out:
+                        apply_delta(old, delta_file, out)
+        except (requests.RequestException, ValueError, struct.error) as e:
+            logging.warning(f"Delta for package {deployment['package']} failed: {str(e)}")
+            return None
+
+        if file_sha256(part_path) != checksum:
+            logging.warning(f"Delta for package {deployment['package']} did not reproduce the checksum")
+            os.remove(part_path)
+            return None
+        os.replace(part_path, path)
+        logging.info(f"Rebuilt package {deployment['package']} from a delta")
+        return path
+
+    def download_package(self, deployment, attempts=3):
+        """Download a deployment's package, resuming interrupted transfers.
+
+        Data is written to ``<checksum>.part`` and hashed as it streams in.
+        If the connection drops, the next attempt sends a ``Range`` request
+        for the remaining bytes, with ``If-Range`` so that a changed file is
+        fetched from the start. Returns the path of the verified file.
+        """
+        checksum = deployment['checksum']
+        os.makedirs(self.download_dir, exist_ok=True)
+        path = os.path.join(self.download_dir, checksum)
+        if os.path.exists(path):
+            return path
+        part_path = path + '.part'
+
+        for attempt in range(1, attempts + 1):
+            sha256_hash = hashlib.sha256()
+            offset = 0
+            if os.path.exists(part_path):
+                with open(part_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        sha256_hash.update(block)
+                        offset += len(block)
+
+            headers = {}
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = f'"{checksum}"'
+            try:
+                with self.session.get(
+                    f"{self.base_url}/api/packages/blobs/{checksum}/",
+                    headers=headers, stream=True, timeout=60
+                ) as response:
+                    if response.status_code == 416:
+                        # The partial file is no longer a prefix of the package.
+                        os.remove(part_path)
+                        continue
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        sha256_hash = hashlib.sha256()
+                        offset = 0
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        for block in response.iter_content(chunk_size=1 << 20):
+                            f.write(block)
+                            sha256_hash.update(block)
+            except requests.RequestException as e:
+                logging.warning(f"Download of package {deployment['package']} interrupted "
+                                f"(attempt {attempt}/{attempts}): {str(e)}")
+                continue
+
+            if sha256_hash.hexdigest() != checksum:
+                os.remove(part_path)
+                raise ValueError(f"Checksum mismatch for package {deployment['package']}")
+            os.replace(part_path, path)
+            logging.info(f"Downloaded package {deployment['package']} to {path}")
+            return path
+
+        raise RuntimeError(f"Could not download package {deployment['package']}")
 
     def _process_deployment(self, deployment):
-        """Process a deployment."""
+        """Process a deployment.
+
+        Progress is queued with ``report`` and sent with the next sync.
+        """
         try:
             logging.info(f"Processing deployment: {deployment['id']}")
-            
+            # Claim the deployment so the server stops handing it out.
+            self.report(deployment['id'], 'in_progress')
+            self.fetch_package(deployment)
+
             # Simulate installation process
             time.sleep(5)  # Simulate work
-            
-            # Update deployment status
-            response = requests.patch(
-                f"{self.base_url}/api/deployment-status/{deployment['id']}/",
-                headers=self.headers,
-                json={
-                    'status': 'completed',
-                    'completed_at': datetime.utcnow().isoformat(),
-                    'log_output': 'Installation completed successfully'
-                }
-            )
-            response.raise_for_status()
+
+            self.report(deployment['id'], 'completed', log_output='Installation completed successfully')
+            self._record_installed(deployment)
             logging.info(f"Deployment {deployment['id']} completed successfully")
 
         except Exception as e:
             logging.error(f"Deployment failed: {str(e)}")
-            # Update deployment status as failed
-            try:
-                requests.patch(
-                    f"{self.base_url}/api/deployment-status/{deployment['id']}/",
-                    headers=self.headers,
-                    json={
-                        'status': 'failed',
-                        'completed_at': datetime.utcnow().isoformat(),
-                        'error_message': str(e)
-                    }
-                )
-            except Exception as update_error:
-                logging.error(f"Failed to update deployment status: {str(update_error)}")
+            self.report(deployment['id'], 'failed', error_message=str(e))
 
 def main():
+    # Set up logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('client.log'),
+            logging.StreamHandler()
+        ]
+    )
     client = DeploymentClient()
     
     try:
         # Initial setup
-        client.authenticate()
-        client.register()
+        client.connect()
+        if client.peer_port:
+            client.start_chunk_server()
 
-        # Main loop
-        while True:
-            client.check_in()
-            client.check_deployments()
-            time.sleep(60)  # Wait for 1 minute before next check
+        asyncio.run(client.run())
 
     except KeyboardInterrupt:
         logging.info("Client shutting down")
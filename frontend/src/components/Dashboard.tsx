@@ -17,25 +17,37 @@ import {
   Archive as ArchiveIcon,
   Send as SendIcon,
 } from '@mui/icons-material';
-import { Client, Package, Deployment, clientService, packageService, deploymentService } from '../services/api';
+import {
+  ClientSummary,
+  DeploymentCounts,
+  Package,
+  DeploymentSummary,
+  clientService,
+  packageService,
+  deploymentService,
+} from '../services/api';
 
 export default function Dashboard() {
-  const [clients, setClients] = useState<Client[]>([]);
+  const [clientCounts, setClientCounts] = useState<ClientSummary | null>(null);
   const [packages, setPackages] = useState<Package[]>([]);
-  const [deployments, setDeployments] = useState<Deployment[]>([]);
+  const [deploymentCounts, setDeploymentCounts] = useState<DeploymentCounts | null>(null);
+  const [recentDeployments, setRecentDeployments] = useState<DeploymentSummary[]>([]);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const [clientsData, packagesData, deploymentsData] = await Promise.all([
-          clientService.getClients(),
+        // Counts come from the server; the fleet is too large to list here.
+        const [clientsData, packagesData, deploymentsData, recentData] = await Promise.all([
+          clientService.getSummary(),
           packageService.getPackages(),
-          deploymentService.getDeployments(),
+          deploymentService.getSummary(),
+          deploymentService.getRecentDeployments(5),
         ]);
-        setClients(clientsData);
+        setClientCounts(clientsData);
         setPackages(packagesData);
-        setDeployments(deploymentsData);
+        setDeploymentCounts(deploymentsData);
+        setRecentDeployments(recentData);
       } catch (error) {
         console.error('Error fetching dashboard data:', error);
       } finally {
@@ -54,8 +66,8 @@ export default function Dashboard() {
     );
   }
 
-  const onlineClients = clients.filter((client) => client.status === 'online');
-  const recentDeployments = deployments.slice(0, 5);
+  const getPackageName = (packageId: number) =>
+    packages.find((pkg) => pkg.id === packageId)?.name ?? `Package ${packageId}`;
 
   return (
     <Box>
@@ -78,7 +90,7 @@ export default function Dashboard() {
             <Box>
               <Typography variant="h6">Clients</Typography>
               <Typography variant="h4">
-                {onlineClients.length}/{clients.length}
+                {clientCounts?.online ?? 0}/{clientCounts?.total ?? 0}
               </Typography>
               <Typography variant="subtitle2">Online/Total</Typography>
             </Box>
@@ -115,7 +127,7 @@ export default function Dashboard() {
             <SendIcon sx={{ fontSize: 40, mr: 2 }} />
             <Box>
               <Typography variant="h6">Deployments</Typography>
-              <Typography variant="h4">{deployments.length}</Typography>
+              <Typography variant="h4">{deploymentCounts?.total ?? 0}</Typography>
               <Typography variant="subtitle2">Total</Typography>
             </Box>
           </Paper>
@@ -132,27 +144,29 @@ export default function Dashboard() {
                 {recentDeployments.map((deployment) => (
                   <ListItem key={deployment.id} divider>
                     <ListItemText
-                      primary={deployment.package.name}
+                      primary={getPackageName(deployment.package)}
                       secondary={`Created at: ${new Date(
                         deployment.created_at
                       ).toLocaleString()}`}
                     />
                     <Box>
-                      {deployment.deployment_statuses.map((status) => (
-                        <Chip
-                          key={status.id}
-                          label={status.status}
-                          color={
-                            status.status === 'completed'
-                              ? 'success'
-                              : status.status === 'failed'
-                              ? 'error'
-                              : 'default'
-                          }
-                          size="small"
-                          sx={{ mr: 1 }}
-                        />
-                      ))}
+                      {Object.entries(deployment.status_counts)
+                        .filter(([status, count]) => status !== 'total' && count > 0)
+                        .map(([status, count]) => (
+                          <Chip
+                            key={status}
+                            label={`${status}: ${count}`}
+                            color={
+                              status === 'completed'
+                                ? 'success'
+                                : status === 'failed'
+                                ? 'error'
+                                : 'default'
+                            }
+                            size="small"
+                            sx={{ mr: 1 }}
+                          />
+                        ))}
                     </Box>
                   </ListItem>
                 ))}
@@ -32,7 +32,9 @@ import {
   KeyboardArrowUp as ExpandLessIcon,
 } from '@mui/icons-material';
 import {
-  Deployment,
+  DeploymentSummary,
+  StatusCounts,
+  DeploymentStatus,
   Package,
   Client,
   deploymentService,
@@ -41,7 +43,8 @@ import {
 } from '../services/api';
 
 export default function Deployments() {
-  const [deployments, setDeployments] = useState<Deployment[]>([]);
+  const [deployments, setDeployments] = useState<DeploymentSummary[]>([]);
+  const [statuses, setStatuses] = useState<Record<number, DeploymentStatus[]>>({});
   const [packages, setPackages] = useState<Package[]>([]);
   const [clients, setClients] = useState<Client[]>([]);
   const [loading, setLoading] = useState(true);
@@ -63,6 +66,7 @@ export default function Deployments() {
         clientService.getClients(),
       ]);
       setDeployments(deploymentsData);
+      setStatuses({});
       setPackages(packagesData);
       setClients(clientsData);
     } catch (error) {
@@ -76,6 +80,48 @@ export default function Deployments() {
     fetchData();
   }, []);
 
+  // Follow the expanded deployment live instead of re-fetching it. Only one
+  // stream is open at a time, as browsers allow few connections per host.
+  useEffect(() => {
+    if (expandedRow === null) {
+      return;
+    }
+    const deploymentId = expandedRow;
+    return deploymentService.subscribeToDeployment(deploymentId, (event) => {
+      if (event.type === 'statuses') {
+        setStatuses((current) => {
+          const changes = new Map(event.statuses.map((status) => [status.id, status]));
+          const list = current[deploymentId];
+          if (!list) {
+            return current;
+          }
+          return {
+            ...current,
+            [deploymentId]: list.map((status) => ({ ...status, ...changes.get(status.id) })),
+          };
+        });
+        return;
+      }
+      setDeployments((current) =>
+        current.map((deployment) => {
+          if (deployment.id !== deploymentId) {
+            return deployment;
+          }
+          if (event.type === 'snapshot') {
+            const { rollout_status, current_wave, status_counts } = event;
+            return { ...deployment, rollout_status, current_wave, status_counts };
+          }
+          const counts = { ...deployment.status_counts };
+          for (const [status, delta] of Object.entries(event.deltas)) {
+            counts[status as keyof StatusCounts] += delta ?? 0;
+            counts.total += delta ?? 0;
+          }
+          return { ...deployment, status_counts: counts };
+        })
+      );
+    });
+  }, [expandedRow]);
+
   const handleSubmit = async (event: React.FormEvent) => {
     event.preventDefault();
     try {
@@ -116,6 +162,26 @@ export default function Deployments() {
     }
   };
 
+  const handleExpand = async (deploymentId: number) => {
+    if (expandedRow === deploymentId) {
+      setExpandedRow(null);
+      return;
+    }
+    setExpandedRow(deploymentId);
+    try {
+      const data = await deploymentService.getDeploymentStatuses(deploymentId);
+      setStatuses((current) => ({ ...current, [deploymentId]: data }));
+    } catch (error) {
+      console.error('Error fetching deployment statuses:', error);
+    }
+  };
+
+  const getPackageName = (packageId: number) =>
+    packages.find((pkg) => pkg.id === packageId)?.name ?? `Package ${packageId}`;
+
+  const getHostname = (clientId: number) =>
+    clients.find((client) => client.id === clientId)?.hostname ?? clientId;
+
   const getStatusColor = (status: string) => {
     switch (status) {
       case 'completed':
@@ -178,11 +244,7 @@ export default function Deployments() {
                   <TableCell>
                     <IconButton
                       size="small"
-                      onClick={() =>
-                        setExpandedRow(
-                          expandedRow === deployment.id ? null : deployment.id
-                        )
-                      }
+                      onClick={() => handleExpand(deployment.id)}
                     >
                       {expandedRow === deployment.id ? (
                         <ExpandLessIcon />
@@ -191,7 +253,7 @@ export default function Deployments() {
                       )}
                     </IconButton>
                   </TableCell>
-                  <TableCell>{deployment.package.name}</TableCell>
+                  <TableCell>{getPackageName(deployment.package)}</TableCell>
                   <TableCell>{deployment.description}</TableCell>
                   <TableCell>
                     {new Date(deployment.created_at).toLocaleString()}
@@ -202,24 +264,25 @@ export default function Deployments() {
                       : 'Immediate'}
                   </TableCell>
                   <TableCell>
-                    {deployment.deployment_statuses.map((status) => (
-                      <Chip
-                        key={status.id}
-                        label={status.status}
-                        color={getStatusColor(status.status) as any}
-                        size="small"
-                        sx={{ mr: 0.5, mb: 0.5 }}
-                      />
-                    ))}
+                    {Object.entries(deployment.status_counts)
+                      .filter(([status, count]) => status !== 'total' && count > 0)
+                      .map(([status, count]) => (
+                        <Chip
+                          key={status}
+                          label={`${status}: ${count}`}
+                          color={getStatusColor(status) as any}
+                          size="small"
+                          sx={{ mr: 0.5, mb: 0.5 }}
+                        />
+                      ))}
                   </TableCell>
                   <TableCell>
                     <Button
                       size="small"
                       onClick={() => handleCancel(deployment.id)}
                       disabled={
-                        !deployment.deployment_statuses.some(
-                          (s) => s.status === 'pending' || s.status === 'in_progress'
-                        )
+                        !deployment.status_counts.pending &&
+                        !deployment.status_counts.in_progress
                       }
                     >
                       Cancel
@@ -227,11 +290,7 @@ export default function Deployments() {
                     <Button
                       size="small"
                       onClick={() => handleRetry(deployment.id)}
-                      disabled={
-                        !deployment.deployment_statuses.some(
-                          (s) => s.status === 'failed'
-                        )
-                      }
+                      disabled={!deployment.status_counts.failed}
                     >
                       Retry Failed
                     </Button>
@@ -262,9 +321,9 @@ export default function Deployments() {
                             </TableRow>
                           </TableHead>
                           <TableBody>
-                            {deployment.deployment_statuses.map((status) => (
+                            {(statuses[deployment.id] ?? []).map((status) => (
                               <TableRow key={status.id}>
-                                <TableCell>{status.client.hostname}</TableCell>
+                                <TableCell>{getHostname(status.client)}</TableCell>
                                 <TableCell>
                                   <Chip
                                     label={status.status}
@@ -26,6 +26,9 @@ import {
 import { Add as AddIcon, Refresh as RefreshIcon } from '@mui/icons-material';
 import { Package, packageService } from '../services/api';
 
+// Files above this size are sent with the resumable chunked upload API.
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+
 export default function Packages() {
   const [packages, setPackages] = useState<Package[]>([]);
   const [loading, setLoading] = useState(true);
@@ -56,17 +59,22 @@ export default function Packages() {
 
   const handleSubmit = async (event: React.FormEvent) => {
     event.preventDefault();
-    if (!newPackage.file) return;
+    const { file, ...metadata } = newPackage;
+    if (!file) return;
 
     try {
-      const formData = new FormData();
-      formData.append('name', newPackage.name);
-      formData.append('version', newPackage.version);
-      formData.append('description', newPackage.description);
-      formData.append('os_compatibility', newPackage.os_compatibility);
-      formData.append('file', newPackage.file);
+      if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+        await packageService.uploadPackage(metadata, file);
+      } else {
+        const formData = new FormData();
+        formData.append('name', newPackage.name);
+        formData.append('version', newPackage.version);
+        formData.append('description', newPackage.description);
+        formData.append('os_compatibility', newPackage.os_compatibility);
+        formData.append('file', file);
 
-      await packageService.createPackage(formData);
+        await packageService.createPackage(formData);
+      }
       setOpenDialog(false);
       fetchPackages();
       setNewPackage({
@@ -18,6 +18,28 @@ api.interceptors.request.use((config) => {
     return config;
 });
 
+export interface Page<T> {
+    next: string | null;
+    previous: string | null;
+    results: T[];
+}
+
+// Largest page the API serves.
+const MAX_PAGE_SIZE = 500;
+// Milliseconds before a closed deployment event stream is reopened.
+const STREAM_RECONNECT_DELAY = 3000;
+
+// Read every page of a list by following its cursors.
+const fetchAll = async <T>(url: string, params: Record<string, unknown> = {}) => {
+    let page = (await api.get<Page<T>>(url, { params: { ...params, page_size: MAX_PAGE_SIZE } })).data;
+    const results = [...page.results];
+    while (page.next) {
+        page = (await api.get<Page<T>>(page.next)).data;
+        results.push(...page.results);
+    }
+    return results;
+};
+
 export interface LoginCredentials {
     username: string;
     password: string;
@@ -33,6 +55,13 @@ export interface Client {
     last_seen: string;
 }
 
+export interface ClientSummary {
+    online: number;
+    offline: number;
+    error: number;
+    total: number;
+}
+
 export interface Package {
     id: number;
     name: string;
@@ -40,10 +69,34 @@ export interface Package {
     description: string;
     os_compatibility: string;
     created_at: string;
+    filename: string;
     size: number;
+    checksum: string;
     is_active: boolean;
 }
 
+export interface PackageUpload {
+    id: number;
+    name: string;
+    version: string;
+    description: string;
+    os_compatibility: string;
+    filename: string;
+    size: number;
+    checksum: string;
+    offset: number;
+}
+
+export interface PackageMetadata {
+    name: string;
+    version: string;
+    description: string;
+    os_compatibility: string;
+}
+
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+const UPLOAD_CHUNK_RETRIES = 3;
+
 export interface Deployment {
     id: number;
     package: Package;
@@ -52,17 +105,63 @@ export interface Deployment {
     created_at: string;
     scheduled_for: string | null;
     description: string;
+    rollout_waves: number[];
+    wave_concurrency: number | null;
+    failure_threshold: number | null;
+    current_wave: number;
+    rollout_status: string;
+    status_counts: StatusCounts;
     deployment_statuses: DeploymentStatus[];
 }
 
+export interface StatusCounts {
+    pending: number;
+    in_progress: number;
+    completed: number;
+    failed: number;
+    cancelled: number;
+    total: number;
+}
+
+export interface DeploymentSummary {
+    id: number;
+    package: number;
+    description: string;
+    created_at: string;
+    scheduled_for: string | null;
+    rollout_waves: number[];
+    current_wave: number;
+    rollout_status: string;
+    status_counts: StatusCounts;
+}
+
+export interface DeploymentCounts {
+    pending: number;
+    running: number;
+    halted: number;
+    completed: number;
+    total: number;
+}
+
 export interface DeploymentStatus {
     id: number;
-    client: Client;
+    client: number;
     status: string;
     started_at: string | null;
     completed_at: string | null;
     error_message: string;
-    log_output: string;
+}
+
+export type DeploymentEvent =
+    | { type: 'snapshot'; rollout_status: string; current_wave: number; status_counts: StatusCounts }
+    | { type: 'counts'; deltas: Partial<Record<keyof StatusCounts, number>> }
+    | { type: 'statuses'; statuses: Partial<DeploymentStatus>[] };
+
+export interface LogRead {
+    offset: number;
+    content: string;
+    more: boolean;
+    finished: boolean;
 }
 
 export const authService = {
@@ -78,8 +177,9 @@ export const authService = {
 };
 
 export const clientService = {
-    getClients: async () => {
-        const response = await api.get('/clients/');
+    getClients: () => fetchAll<Client>('/clients/'),
+    getSummary: async () => {
+        const response = await api.get<ClientSummary>('/clients/summary/');
         return response.data;
     },
     getClientById: async (id: number) => {
@@ -89,10 +189,7 @@ export const clientService = {
 };
 
 export const packageService = {
-    getPackages: async () => {
-        const response = await api.get('/packages/');
-        return response.data;
-    },
+    getPackages: () => fetchAll<Package>('/packages/'),
     getPackageById: async (id: number) => {
         const response = await api.get(`/packages/${id}/`);
         return response.data;
@@ -105,22 +202,104 @@ export const packageService = {
         });
         return response.data;
     },
+    // Upload a large file in chunks; failed chunks are retried from the
+    // offset the server reports, so an interrupted upload resumes.
+    uploadPackage: async (metadata: PackageMetadata, file: File, onProgress?: (sent: number) => void) => {
+        let upload = (await api.post<PackageUpload>('/package-uploads/', {
+            ...metadata,
+            filename: file.name,
+            size: file.size,
+        })).data;
+        let failures = 0;
+        while (upload.offset < upload.size) {
+            const end = Math.min(upload.offset + UPLOAD_CHUNK_SIZE, upload.size);
+            try {
+                upload = (await api.put<PackageUpload>(`/package-uploads/${upload.id}/`, file.slice(upload.offset, end), {
+                    headers: {
+                        'Content-Type': 'application/octet-stream',
+                        'Content-Range': `bytes ${upload.offset}-${end - 1}/${upload.size}`,
+                    },
+                })).data;
+                failures = 0;
+            } catch (error) {
+                if (++failures > UPLOAD_CHUNK_RETRIES) throw error;
+                upload = (await api.get<PackageUpload>(`/package-uploads/${upload.id}/`)).data;
+            }
+            onProgress?.(upload.offset);
+        }
+        const response = await api.post<Package>(`/package-uploads/${upload.id}/complete/`);
+        return response.data;
+    },
 };
 
 export const deploymentService = {
-    getDeployments: async () => {
-        const response = await api.get('/deployments/');
+    getDeployments: () => fetchAll<DeploymentSummary>('/deployments/'),
+    getRecentDeployments: async (count: number) => {
+        const response = await api.get<Page<DeploymentSummary>>('/deployments/', {
+            params: { page_size: count },
+        });
+        return response.data.results;
+    },
+    getSummary: async () => {
+        const response = await api.get<DeploymentCounts>('/deployments/summary/');
         return response.data;
     },
+    getStatusLog: async (statusId: number, offset = 0, follow = 0) => {
+        const response = await api.get<LogRead>(`/deployment-status/${statusId}/logs/`, {
+            params: { offset, follow },
+        });
+        return response.data;
+    },
+    // Stream progress events of one deployment; returns a function that closes the stream.
+    subscribeToDeployment: (deploymentId: number, onEvent: (event: DeploymentEvent) => void) => {
+        // EventSource cannot send an Authorization header, so every connection
+        // is opened with a short-lived ticket for this deployment's stream.
+        let source: EventSource | null = null;
+        let closed = false;
+        const connect = async () => {
+            try {
+                const response = await api.post<{ ticket: string }>(`/deployments/${deploymentId}/events/ticket/`);
+                if (closed) {
+                    return;
+                }
+                const ticket = encodeURIComponent(response.data.ticket);
+                source = new EventSource(`${API_URL}/deployments/${deploymentId}/events/?ticket=${ticket}`);
+                source.onmessage = (message) => onEvent(JSON.parse(message.data));
+                // The ticket has expired by the time the browser would
+                // reconnect on its own, so reconnect with a fresh one.
+                source.onerror = () => {
+                    source?.close();
+                    if (!closed) {
+                        setTimeout(connect, STREAM_RECONNECT_DELAY);
+                    }
+                };
+            } catch {
+                if (!closed) {
+                    setTimeout(connect, STREAM_RECONNECT_DELAY);
+                }
+            }
+        };
+        connect();
+        return () => {
+            closed = true;
+            source?.close();
+        };
+    },
+    getDeploymentStatuses: (deploymentId: number) =>
+        fetchAll<DeploymentStatus>('/deployment-status/', { deployment: deploymentId }),
     getDeploymentById: async (id: number) => {
         const response = await api.get(`/deployments/${id}/`);
         return response.data;
     },
     createDeployment: async (data: {
         package: number;
-        clients: number[];
+        clients?: number[];
+        client_filter?: Record<string, string>;
         description: string;
         scheduled_for?: string;
+        rollout_waves?: number[];
+        wave_concurrency?: number;
+        failure_threshold?: number;
     }) => {
         const response = await api.post('/deployments/', data);
         return response.data;
@@ -133,4 +312,8 @@ export const deploymentService = {
         const response = await api.post(`/deployments/${id}/retry_failed/`);
         return response.data;
     },
+    resumeDeployment: async (id: number) => {
+        const response = await api.post(`/deployments/${id}/resume/`);
+        return response.data;
+    },
 }; 
\ No newline at end of file